@@ -0,0 +1,67 @@
+import re
+from functools import lru_cache
+from nltk.stem.snowball import SnowballStemmer
+import config
+
+# Версия правил анализа: при ее смене документы переиндексируются (термы в индексе другие)
+ANALYZER_VERSION = 2
+
+# Слово в исходном регистре: русское или латинское, от трех букв
+WORD_RE = re.compile(r'\b[а-яёa-z]{3,}\b', re.IGNORECASE)
+
+STOP_WORDS = frozenset({'и', 'в', 'с', 'по', 'на', 'не', 'что', 'это', 'как', 'а', 'но', 'или'})
+
+
+class Analyzer:
+    """
+    Общий конвейер анализа текста для индексации и запросов:
+    токенизация одним скомпилированным выражением, нижний регистр, стоп-слова
+    и стемминг Snowball (русский или английский по первой букве слова).
+    Основы словоформ кэшируются в ограниченном LRU-кэше: частые слова стеммятся один раз
+    """
+
+    def __init__(self, stop_words=STOP_WORDS, cache_size=config.ANALYZER_CACHE_SIZE):
+        self.version = ANALYZER_VERSION
+        self.stop_words = stop_words
+        self.russian = SnowballStemmer('russian')
+        self.english = SnowballStemmer('english')
+        self.stem = lru_cache(maxsize=cache_size)(self._stem)
+
+    def _stem(self, word):
+        """Основа словоформы в нижнем регистре"""
+        if word[0] <= 'z':
+            return self.english.stem(word)
+        return self.russian.stem(word.replace('ё', 'е'))
+
+    def analyze(self, text):
+        """Термы текста по порядку"""
+        stem, stop_words = self.stem, self.stop_words
+        return [stem(word) for word in WORD_RE.findall(text.lower()) if word not in stop_words]
+
+    def analyze_with_offsets(self, text):
+        """Термы со смещениями в исходном тексте: список (терм, начало, конец)"""
+        stem, stop_words = self.stem, self.stop_words
+        tokens = []
+        for match in WORD_RE.finditer(text):
+            word = match.group().lower()
+            if word not in stop_words:
+                start, end = match.span()
+                tokens.append((stem(word), start, end))
+        return tokens
+
+    def analyze_many(self, texts):
+        """Термы нескольких текстов: каждая словоформа пакета стеммится один раз"""
+        tokenized = [WORD_RE.findall(text.lower()) for text in texts]
+        stems = {}
+        for words in tokenized:
+            for word in words:
+                if word not in stems and word not in self.stop_words:
+                    stems[word] = self.stem(word)
+        return [[stems[word] for word in words if word in stems] for words in tokenized]
+
+    def cache_info(self):
+        return self.stem.cache_info()
+
+
+# Анализатор процесса: один кэш основ на парсер, поиск и тематический PageRank
+ANALYZER = Analyzer()
@@ -0,0 +1,182 @@
+import heapq
+import re
+from wand import wand_top_k
+
+# Фраза в кавычках (с необязательным + или -) или отдельное слово запроса
+QUERY_TOKEN_RE = re.compile(r'([+-]?)"([^"]*)"?|(\S+)')
+
+AND_WORDS = {'AND', 'И'}
+OR_WORDS = {'OR', 'ИЛИ'}
+NOT_WORDS = {'NOT', 'НЕ'}
+
+
+class BooleanQuery:
+    """
+    Разобранный запрос: should - необязательные термы (ИЛИ), must - обязательные
+    условия, must_not - исключающие. Условие - кортеж термов: один терм или фраза
+    """
+
+    __slots__ = ('should', 'must', 'must_not')
+
+    def __init__(self, should=(), must=(), must_not=()):
+        self.should = list(should)
+        self.must = list(must)
+        self.must_not = list(must_not)
+
+    def is_plain(self):
+        """Обычный запрос-мешок слов без операторов"""
+        return not self.must and not self.must_not
+
+    def terms(self):
+        """Термы, которые ищутся в документах (для оценки и сниппетов)"""
+        return list(dict.fromkeys(
+            [term for clause in self.must for term in clause] + self.should))
+
+    def key(self):
+        return tuple(self.should), tuple(self.must), tuple(self.must_not)
+
+
+def parse_query(query, tokenize):
+    """
+    Разбор запроса: "фраза" и +слово - обязательны, -слово, -"фраза" и NOT слово - исключены,
+    a AND b - оба обязательны, OR и просто слова через пробел - необязательны.
+    tokenize - токенизатор запроса (те же термы, что в индексе)
+    """
+    clauses = []  # [вид условия, термы] в порядке запроса
+    pending_and = False
+    pending_not = False
+
+    for sign, phrase, word in QUERY_TOKEN_RE.findall(query):
+        if word in AND_WORDS:
+            # Левый операнд AND тоже становится обязательным
+            if clauses and clauses[-1][0] == 'should':
+                clauses[-1][0] = 'must'
+            pending_and = True
+            continue
+        if word in OR_WORDS:
+            continue
+        if word in NOT_WORDS:
+            pending_not = True
+            continue
+
+        if word:
+            sign, text = (word[0], word[1:]) if word[0] in '+-' and len(word) > 1 else ('', word)
+        else:
+            text = phrase
+        clause = tuple(tokenize(text))
+        if clause:
+            if sign == '-' or pending_not:
+                kind = 'must_not'
+            elif sign == '+' or phrase or pending_and or len(clause) > 1:
+                # Слово, распавшееся на несколько термов (веб-поиск), ищется как фраза
+                kind = 'must'
+            else:
+                kind = 'should'
+            clauses.append([kind, clause])
+        pending_and = pending_not = False
+
+    return BooleanQuery(
+        [clause[0] for kind, clause in clauses if kind == 'should'],
+        dict.fromkeys(clause for kind, clause in clauses if kind == 'must'),
+        dict.fromkeys(clause for kind, clause in clauses if kind == 'must_not'),
+    )
+
+
+def phrase_match(terms, cursors):
+    """Стоят ли термы фразы подряд в текущем документе (курсоры выровнены на нем)"""
+    if len(terms) == 1:
+        return True
+    following = [set(cursors[term].positions()) for term in terms[1:]]
+    return any(all(position + i in positions for i, positions in enumerate(following, 1))
+               for position in cursors[terms[0]].positions())
+
+
+class ClauseMatcher:
+    """Проверка условия (терм или фраза) на документах в порядке возрастания id"""
+
+    def __init__(self, index, terms):
+        self.terms = terms
+        self.cursors = {term: index.cursor(term) for term in terms}
+        # Условие с отсутствующим в индексе термом не выполняется ни в одном документе
+        self.possible = all(self.cursors.values())
+
+    def matches(self, doc_id):
+        if not self.possible:
+            return False
+        for cursor in self.cursors.values():
+            cursor.next_geq(doc_id)
+            if cursor.doc != doc_id:
+                return False
+        return phrase_match(self.terms, self.cursors)
+
+
+def exclusion_filter(index, query):
+    """Функция doc_id -> True для документов под исключающими условиями (None, если исключать нечего)"""
+    excluded = [matcher for matcher in (ClauseMatcher(index, clause) for clause in query.must_not)
+                if matcher.possible]
+    if not excluded:
+        return None
+    return lambda doc_id: any(matcher.matches(doc_id) for matcher in excluded)
+
+
+def required_matches(index, query, skip=None):
+    """
+    Документы, выполняющие все обязательные условия и не исключенные skip: генератор
+    (doc_id, [курсоры термов, стоящие на документе]) по возрастанию id.
+    Обязательные термы пересекаются с самого редкого (наибольший IDF): остальные курсоры
+    догоняют кандидата через next_geq, поэтому время пропорционально самому короткому списку.
+    Фразы проверяются по позициям, необязательные термы добавляются, если они есть в документе
+    """
+    cursors = {}
+    for clause in query.must:
+        for term in clause:
+            if term not in cursors:
+                cursors[term] = index.cursor(term)
+                if cursors[term] is None:
+                    return
+    order = sorted(cursors.values(), key=lambda c: c.idf, reverse=True)
+    phrases = [clause for clause in query.must if len(clause) > 1]
+    optional = [cursor for cursor in (index.cursor(term) for term in query.should if term not in cursors)
+                if cursor is not None]
+
+    lead = order[0]
+    doc_id = lead.doc
+    while doc_id != lead.END:
+        # Выравнивание всех курсоров на кандидате; отставший курсор дает нового кандидата
+        for cursor in order:
+            cursor.next_geq(doc_id)
+            if cursor.doc != doc_id:
+                doc_id = cursor.doc
+                break
+        else:
+            if all(phrase_match(clause, cursors) for clause in phrases) and (skip is None or not skip(doc_id)):
+                matched = list(cursors.values())
+                for cursor in optional:
+                    cursor.next_geq(doc_id)
+                    if cursor.doc == doc_id:
+                        matched.append(cursor)
+                yield doc_id, matched
+            lead.next()
+            doc_id = lead.doc
+
+
+def boolean_top_k(index, query, k=5, pageranks=None):
+    """
+    Top-k для запроса с операторами: {doc_id: score}.
+    С обязательными условиями - пересечение required_matches, необязательные термы только
+    добавляют оценку. Без них - WAND по необязательным с отбрасыванием исключенных документов
+    """
+    is_excluded = exclusion_filter(index, query)
+    if not query.must:
+        return wand_top_k(index, query.should, k, pageranks, is_excluded)
+
+    top = []  # min-куча (score, doc_id)
+    for doc_id, matched in required_matches(index, query, is_excluded):
+        score = sum(index.bm25(c.tf(), doc_id, c.idf) for c in matched)
+        score *= index.pagerank_boost(doc_id, pageranks)
+        if len(top) < k:
+            heapq.heappush(top, (score, doc_id))
+        elif score > top[0][0]:
+            heapq.heapreplace(top, (score, doc_id))
+
+    return {doc_id: score for score, doc_id in top}
@@ -7,4 +7,88 @@ DB_PATH = os.path.join(BASE_DIR, 'search_engine.db')
 # Параметры PageRank
 DAMPING_FACTOR = 0.85
 MAX_ITERATIONS = 100
-TOLERANCE = 1e-6
\ No newline at end of file
+TOLERANCE = 1e-6
+PAGERANK_KEEP_RUNS = 2  # сколько последних снимков PageRank хранить
+# Инкрементальный PageRank: при большей доле изменившихся узлов - полный пересчет
+PAGERANK_INCREMENTAL_THRESHOLD = 0.1
+# Метод решения в SparsePageRank: 'power' (Якоби), 'gauss_seidel', 'aitken', 'quadratic'
+PAGERANK_SOLVER = 'power'
+PAGERANK_GS_BLOCKS = 32  # число блоков узлов, обновляемых по очереди в Гаусса-Зейделе
+PAGERANK_EXTRAPOLATION_PERIOD = 10  # экстраполяция (aitken/quadratic) раз в столько итераций
+# Остановка: 'residual' - по TOLERANCE, 'topk' - еще и когда top-k не меняется несколько итераций
+PAGERANK_STOP = 'residual'
+PAGERANK_STABLE_TOP_K = 10
+PAGERANK_STABLE_ROUNDS = 3
+PAGERANK_TRACE_PATH = None  # файл JSON Lines для журналов сходимости (None - не сохранять)
+# PageRank вне памяти: каталог выгруженного графа и число ребер в блоке чтения
+PAGERANK_GRAPH_DIR = os.path.join(BASE_DIR, 'graph')
+PAGERANK_BLOCK_EDGES = 1000000
+
+# Тематический PageRank: темы - явный список термов или TOPIC_COUNT самых частых термов,
+# встречающихся не более чем в TOPIC_MAX_DF доле документов
+TOPIC_TERMS = None
+TOPIC_COUNT = 20
+TOPIC_MAX_DF = 0.5
+TOPIC_VECTOR_SIZE = 1000  # сколько документов хранить на тему
+TOPIC_BLEND = 0.5  # вес тематических векторов относительно глобального PageRank
+
+# Кэш результатов поиска
+QUERY_CACHE_SIZE = 1000
+QUERY_CACHE_TTL = 300  # секунд, None - без ограничения
+
+# Гибридный поиск: слияние сигналов 'minmax' или 'rrf' (константа RRF и пул кандидатов по BM25),
+# вес BM25 (PageRank получает остаток до 1), вес близости термов (0 - не считать)
+HYBRID_FUSION = 'minmax'
+HYBRID_RRF_K = 60
+HYBRID_RRF_DEPTH = 100
+HYBRID_BM25_WEIGHT = 0.7
+HYBRID_PROXIMITY_WEIGHT = 0.0
+
+# Анализатор текста: сколько словоформ держать в кэше основ
+ANALYZER_CACHE_SIZE = 100000
+
+# Пакетная индексация: документов на одну транзакцию
+INGEST_BATCH_SIZE = 200
+
+# Параллельный разбор HTML: число процессов (1 - последовательно) и глубина очереди к процессу записи
+INGEST_WORKERS = 1
+INGEST_QUEUE_SIZE = 100
+INGEST_WRITER_POLL = 1.0  # как часто (секунд) проверять, жив ли процесс записи, пока его ждем
+
+# Число процессов-разделов графа в Pregel (1 - в текущем процессе)
+PREGEL_WORKERS = 1
+
+# Асинхронный обходчик: общие и на один хост лимиты одновременных запросов,
+# пауза между началами запросов к одному хосту (секунд) и границы обхода
+CRAWL_CONCURRENCY = 16
+CRAWL_PER_HOST = 2
+CRAWL_DELAY = 2.0
+CRAWL_MAX_PAGES = 100
+CRAWL_MAX_DEPTH = 2
+CRAWL_TIMEOUT = 10
+HTTP_CACHE_FILE = '.http_cache.db'  # кэш обходчика в директории со страницами
+HTTP_CACHE_COMMIT_EVERY = 20  # коммит кэша каждые столько записей, а не только в конце обхода
+SOURCE_URL_META = 'source-url'  # meta сохраненной страницы с ее исходным url
+
+# HTTP-сервер поиска: адрес, размер пула соединений только для чтения
+# и границы корзин гистограммы задержек (секунд)
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8080
+SERVER_POOL_SIZE = 8
+SERVER_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Число шардов индекса по документам (1 - единый индекс в текущем процессе)
+SEARCH_SHARDS = 1
+
+# Индекс в бинарных сегментах в директории рядом с БД (файл БД + суффикс), открываются через mmap;
+# шаг таблицы пропусков - число вхождений в блоке списка
+INDEX_SEGMENT = True
+INDEX_SEGMENT_SUFFIX = '.segments'
+SEGMENT_SKIP_INTERVAL = 64
+# Слияние сегментов: сколько сегментов одной ступени сливаются в один
+# и при какой доле удаленных документов сегмент переписывается
+SEGMENT_MERGE_FACTOR = 4
+SEGMENT_MAX_DELETED = 0.5
+# Повтор слияния после ошибки: первая пауза и предел ее удвоения (секунд)
+SEGMENT_MERGE_RETRY = 1.0
+SEGMENT_MERGE_RETRY_MAX = 60.0
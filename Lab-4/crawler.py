@@ -0,0 +1,196 @@
+import asyncio
+import time
+from urllib.parse import urljoin, urldefrag, urlparse
+import aiohttp
+from bs4 import BeautifulSoup
+import config
+from download_real_sites import RealSiteDownloader
+from http_cache import HttpCache
+
+
+class HostPolicy:
+    """Вежливость к одному хосту: не больше per_host запросов сразу и delay секунд между их началами"""
+
+    def __init__(self, per_host, delay):
+        self.semaphore = asyncio.Semaphore(per_host)
+        self.delay = delay
+        self.lock = asyncio.Lock()
+        self.next_start = 0.0
+
+    async def wait_turn(self):
+        """Ожидание очереди хоста (вызывается под семафором)"""
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_start > now:
+                await asyncio.sleep(self.next_start - now)
+            self.next_start = max(now, self.next_start) + self.delay
+
+
+class AsyncCrawler:
+    """
+    Асинхронный вежливый обходчик.
+    Фронтир - очередь (url, глубина), ее разбирают concurrency задач; соединения берутся
+    из общего пула aiohttp с keep-alive, для каждого хоста свои лимит и задержка.
+    Новые ссылки берутся только с того же домена (RealSiteDownloader.same_domain).
+    С кэшем (HttpCache) запросы условные: неизменившиеся страницы не перезаписываются,
+    а их ссылки берутся из кэша; дубликаты содержимого сохраняются один раз
+    """
+
+    def __init__(self, output_dir="data", max_pages=config.CRAWL_MAX_PAGES,
+                 max_depth=config.CRAWL_MAX_DEPTH, concurrency=config.CRAWL_CONCURRENCY,
+                 per_host=config.CRAWL_PER_HOST, delay=config.CRAWL_DELAY,
+                 timeout=config.CRAWL_TIMEOUT, use_cache=True):
+        self.downloader = RealSiteDownloader(output_dir)
+        self.output_dir = output_dir
+        self.use_cache = use_cache
+        self.cache = None
+        self.aliases = {}
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.delay = delay
+        self.timeout = timeout
+        self.hosts = {}
+        self.filenames = {}
+        self.seen = set()
+        self.saved = []
+        self.not_modified = 0
+        self.duplicates = 0
+
+    def filename_for(self, url):
+        """Локальный файл url: заданный для стартовой страницы, файл копии для псевдонима или по url"""
+        return self.filenames.get(url) or self.aliases.get(url) or self.downloader.local_filename(url)
+
+    def host_policy(self, url):
+        host = urlparse(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = HostPolicy(self.per_host, self.delay)
+        return self.hosts[host]
+
+    def enqueue(self, frontier, url, depth):
+        """Добавление url во фронтир, если он новый и лимит страниц не исчерпан"""
+        if url in self.seen or len(self.seen) >= self.max_pages:
+            return
+        self.seen.add(url)
+        frontier.put_nowait((url, depth))
+
+    def discover_links(self, url, soup):
+        """Абсолютные ссылки страницы на тот же домен (до перезаписи ссылок в локальные)"""
+        links = []
+        for a_tag in soup.find_all('a', href=True):
+            link, _ = urldefrag(urljoin(url, a_tag['href']))
+            if urlparse(link).scheme in ('http', 'https') and self.downloader.same_domain(url, link):
+                links.append(link)
+        return links
+
+    async def fetch(self, session, url, headers=None):
+        """GET с учетом вежливости хоста, возвращает (статус, тело HTML или None, заголовки ответа)"""
+        policy = self.host_policy(url)
+        async with policy.semaphore:
+            await policy.wait_turn()
+            print(f"Скачиваю: {url}")
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304:
+                    return response.status, None, response.headers
+                if response.status != 200 or 'html' not in response.headers.get('Content-Type', 'text/html'):
+                    print(f"Пропущено {url}: HTTP {response.status}")
+                    return response.status, None, response.headers
+                return response.status, await response.read(), response.headers
+
+    async def process(self, session, frontier, url, depth):
+        entry = self.cache.get(url) if self.cache else None
+        headers = self.cache.conditional_headers(entry) if self.cache else None
+        status, content, response_headers = await self.fetch(session, url, headers)
+
+        if status == 304 and entry is not None:
+            # Страница не изменилась: ни загрузки, ни разбора
+            self.cache.touch(url, response_headers)
+            self.not_modified += 1
+            links = entry.links
+        elif content is None:
+            return
+        else:
+            links = self.store(url, content, response_headers, entry)
+
+        if depth < self.max_depth:
+            for link in links:
+                self.enqueue(frontier, link, depth + 1)
+
+    def store(self, url, content, headers, entry):
+        """Сохранение полученной страницы с учетом кэша, возвращает ее ссылки"""
+        content_hash = HttpCache.content_hash(content)
+        if entry is not None and entry.content_hash == content_hash:
+            # Сервер не поддерживает условные запросы, но содержимое то же
+            self.cache.touch(url, headers)
+            self.not_modified += 1
+            return entry.links
+
+        soup = BeautifulSoup(content, 'html.parser')
+        links = self.discover_links(url, soup)
+        filename = self.filename_for(url)
+
+        duplicate = self.cache.find_content(content_hash, url) if self.cache else None
+        if duplicate is not None:
+            print(f"Дубликат: {url} -> {duplicate}")
+            self.cache.put(url, headers, content_hash, duplicate, filename, links, alias=True)
+            self.aliases[url] = duplicate
+            self.duplicates += 1
+            return links
+
+        self.downloader.save_page(url, soup, filename, self.filename_for)
+        if self.cache:
+            self.cache.put(url, headers, content_hash, filename, filename, links)
+        self.saved.append(filename)
+        return links
+
+    async def worker(self, session, frontier):
+        while True:
+            url, depth = await frontier.get()
+            try:
+                await self.process(session, frontier, url, depth)
+            except Exception as e:
+                print(f"Ошибка при скачивании {url}: {e}")
+            finally:
+                frontier.task_done()
+
+    async def crawl(self, seeds):
+        """Обход от стартовых url (строки или пары (url, имя файла)), возвращает сохраненные файлы"""
+        frontier = asyncio.Queue()
+        self.hosts, self.seen, self.saved = {}, set(), []
+        self.not_modified = self.duplicates = 0
+        if self.use_cache:
+            self.cache = HttpCache(self.output_dir)
+            self.aliases = self.cache.aliases()
+        for seed in seeds:
+            url, filename = seed if isinstance(seed, tuple) else (seed, None)
+            if filename:
+                self.filenames[url] = filename
+            self.enqueue(frontier, url, 0)
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                             headers=self.downloader.headers) as session:
+                workers = [asyncio.create_task(self.worker(session, frontier))
+                           for _ in range(self.concurrency)]
+                await frontier.join()
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            if self.cache:
+                self.cache.close()
+                self.cache = None
+        return self.saved
+
+    def run(self, seeds):
+        """Синхронный запуск обхода"""
+        start = time.perf_counter()
+        saved = asyncio.run(self.crawl(seeds))
+        elapsed = time.perf_counter() - start
+        print(f"Обход завершен: {len(saved)} страниц за {elapsed:.1f} с "
+              f"({len(saved) / elapsed if elapsed > 0 else 0:.1f} стр/сек), хостов: {len(self.hosts)}, "
+              f"без изменений: {self.not_modified}, дубликатов: {self.duplicates}")
+        return saved
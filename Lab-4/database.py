@@ -1,6 +1,7 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text, ForeignKey, Table
+from sqlalchemy import create_engine, Column, Integer, String, Float, Text, LargeBinary, ForeignKey, Table, Index, text, select, func
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import relationship, sessionmaker, scoped_session
+from array import array
 import config
 
 Base = declarative_base()
@@ -8,7 +9,12 @@ Base = declarative_base()
 # Таблица связи документов и слов (many-to-many)
 document_term = Table('document_term', Base.metadata,
                       Column('document_id', Integer, ForeignKey('documents.id')),
-                      Column('term_id', Integer, ForeignKey('terms.id'))
+                      Column('term_id', Integer, ForeignKey('terms.id')),
+                      Column('tf', Integer, default=1),
+                      Column('positions', Text),
+                      Column('offsets', Text),  # "начало:конец" вхождений в тексте - для сниппетов
+                      # Вхождения документа: сниппеты top-k и замена вхождений при переиндексации
+                      Index('ix_document_term_document', 'document_id', 'term_id')
                       )
 
 
@@ -19,8 +25,18 @@ class Document(Base):
     url = Column(String(500), unique=True)
     title = Column(String(500))
     content = Column(Text)
+    source_url = Column(String(500))  # исходный url страницы - цель абсолютных ссылок
     pagerank = Column(Float, default=1.0)
 
+    # Статистика, считается один раз при индексации
+    length = Column(Integer)  # число токенов в тексте
+    unique_terms = Column(Integer)
+    title_length = Column(Integer)  # норма поля title
+
+    # Для инкрементальной переиндексации
+    content_hash = Column(String(64))
+    mtime = Column(Float)
+
     # Связи
     terms = relationship("Term", secondary=document_term, back_populates="documents")
     outgoing_links = relationship("Link", foreign_keys="Link.source_id")
@@ -38,6 +54,9 @@ class Term(Base):
 
 class Link(Base):
     __tablename__ = 'links'
+    __table_args__ = (
+        Index('ix_links_source_target', 'source_id', 'target_id', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     source_id = Column(Integer, ForeignKey('documents.id'))
@@ -47,13 +66,169 @@ class Link(Base):
     target = relationship("Document", foreign_keys=[target_id])
 
 
+class DeferredLink(Base):
+    """Ссылка на документ, которого еще нет в индексе (разрешается при следующей индексации)"""
+    __tablename__ = 'deferred_links'
+
+    id = Column(Integer, primary_key=True)
+    source_id = Column(Integer, ForeignKey('documents.id'), index=True)
+    target_url = Column(String(500))
+
+
+class UrlAlias(Base):
+    """Url с тем же содержимым, что у уже сохраненного документа (дубликат, найденный обходчиком)"""
+    __tablename__ = 'url_aliases'
+
+    url = Column(String(500), primary_key=True)
+    target_url = Column(String(500))
+
+
+class PageRankRun(Base):
+    """Запуск вычисления PageRank"""
+    __tablename__ = 'pagerank_runs'
+
+    id = Column(Integer, primary_key=True)
+    engine = Column(String(50))
+    created_at = Column(Float)
+
+
+class PageRankSnapshot(Base):
+    """Значения PageRank одного запуска"""
+    __tablename__ = 'pagerank_snapshots'
+
+    run_id = Column(Integer, ForeignKey('pagerank_runs.id'), primary_key=True)
+    doc_id = Column(Integer, primary_key=True)
+    score = Column(Float)
+    links_hash = Column(Integer)  # подпись исходящих ссылок на момент запуска
+
+
+class TopicVector(Base):
+    """Тематический PageRank: top-документы темы (int32/float32) и значение для остальных"""
+    __tablename__ = 'topic_vectors'
+
+    topic = Column(String(100), primary_key=True)
+    doc_ids = Column(LargeBinary)
+    scores = Column(LargeBinary)
+    default_score = Column(Float)
+
+
+class IndexMeta(Base):
+    """Счетчики версий и агрегаты индекса (ключ -> число)"""
+    __tablename__ = 'index_meta'
+
+    key = Column(String(100), primary_key=True)
+    value = Column(Integer, default=0)
+
+
+# Ключи версий: меняются при переиндексации и при записи нового PageRank
+INDEX_VERSION = 'index_version'
+PAGERANK_VERSION = 'pagerank_version'
+# id текущего снимка PageRank (pagerank_runs.id)
+PAGERANK_RUN = 'pagerank_run'
+
+# Агрегаты коллекции для BM25, поддерживаются инкрементально
+DOC_COUNT = 'doc_count'
+TOTAL_LENGTH = 'total_length'
+# Версия анализатора, которым построены термы индекса
+ANALYZER_META = 'analyzer_version'
+
+ADD_META_SQL = (
+    "INSERT INTO index_meta (key, value) VALUES (:key, :delta) "
+    "ON CONFLICT(key) DO UPDATE SET value = value + :delta"
+)
+
+# Максимум параметров в одном IN (...) для SQLite
+SQL_CHUNK = 500
+
+
+def chunked(items, size=SQL_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+BUMP_VERSION_SQL = (
+    "INSERT INTO index_meta (key, value) VALUES (:key, 1) "
+    "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+)
+
+
+def bump_version_sqlite(cursor, key):
+    """Увеличение версии через обычный курсор sqlite3 (без коммита)"""
+    cursor.execute(BUMP_VERSION_SQL.replace(':key', '?'), (key,))
+
+
 class Database:
-    def __init__(self):
-        self.engine = create_engine(f'sqlite:///{config.DB_PATH}')
+    def __init__(self, db_path=None, read_only=False):
+        """
+        read_only - для сервера поиска: БД открывается только на чтение без миграций,
+        а session - потокобезопасная (своя сессия у каждого потока, соединения из пула)
+        """
+        self.db_path = db_path or config.DB_PATH
+        self.read_only = read_only
+        if read_only:
+            self.engine = create_engine(
+                f'sqlite:///file:{self.db_path}?mode=ro&uri=true',
+                connect_args={'check_same_thread': False},
+                pool_size=config.SERVER_POOL_SIZE, max_overflow=0,
+            )
+            self.session = scoped_session(sessionmaker(bind=self.engine))
+            return
+
+        self.engine = create_engine(f'sqlite:///{self.db_path}')
+        # WAL: читатели (поиск, сервер) не ждут коммитов индексации
+        with self.engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
         Base.metadata.create_all(self.engine)
+        self._migrate()
         Session = sessionmaker(bind=self.engine)
         self.session = Session()
 
+    def _migrate(self):
+        """Добавление новых колонок в уже существующую БД"""
+        self._ensure_columns('document_term', {
+            'tf': 'INTEGER DEFAULT 1',
+            'positions': 'TEXT',
+            'offsets': 'TEXT',
+        })
+        self._ensure_columns('documents', {
+            'length': 'INTEGER',
+            'unique_terms': 'INTEGER',
+            'title_length': 'INTEGER',
+            'content_hash': 'VARCHAR(64)',
+            'mtime': 'FLOAT',
+            'source_url': 'VARCHAR(500)',
+        })
+        self._ensure_columns('pagerank_snapshots', {
+            'links_hash': 'INTEGER',
+        })
+
+        # Индекс вхождений по документу для БД, созданных до него
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_document_term_document "
+                "ON document_term (document_id, term_id)"
+            ))
+
+        # Уникальность ссылок: сначала убираем дубликаты из старых БД
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "DELETE FROM links WHERE id NOT IN "
+                "(SELECT MIN(id) FROM links GROUP BY source_id, target_id)"
+            ))
+            conn.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ix_links_source_target "
+                "ON links (source_id, target_id)"
+            ))
+
+    def _ensure_columns(self, table_name, columns):
+        """ALTER TABLE для колонок, которых нет в таблице"""
+        with self.engine.begin() as conn:
+            existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table_name})"))}
+            for name, ddl in columns.items():
+                if name not in existing:
+                    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {ddl}"))
+
     def get_or_create_document(self, url, title, content):
         doc = self.session.query(Document).filter_by(url=url).first()
         if not doc:
@@ -70,6 +245,215 @@ class Database:
             self.session.commit()
         return term
 
+    def get_or_create_documents(self, records):
+        """Пакетный get_or_create: records - список (url, title, content), результат {url: Document}"""
+        docs = {}
+        for chunk in chunked({url for url, _, _ in records}):
+            for doc in self.session.query(Document).filter(Document.url.in_(chunk)):
+                docs[doc.url] = doc
+
+        new_docs = []
+        for url, title, content in records:
+            if url not in docs:
+                docs[url] = Document(url=url, title=title, content=content)
+                new_docs.append(docs[url])
+        if new_docs:
+            self.session.add_all(new_docs)
+            self.session.flush()
+        return docs
+
+    def get_or_create_terms(self, words):
+        """Пакетное получение id слов с созданием недостающих, результат {word: term_id}"""
+        term_ids = {}
+        words = set(words)
+        for chunk in chunked(words):
+            term_ids.update(self._select_term_ids(chunk))
+
+        missing = [w for w in words if w not in term_ids]
+        if missing:
+            self.session.execute(
+                text("INSERT OR IGNORE INTO terms (word) VALUES (:word)"),
+                [{'word': w} for w in missing]
+            )
+            for chunk in chunked(missing):
+                term_ids.update(self._select_term_ids(chunk))
+        return term_ids
+
+    def _select_term_ids(self, words):
+        return dict(
+            (word, term_id) for term_id, word in
+            self.session.query(Term.id, Term.word).filter(Term.word.in_(words))
+        )
+
+    def set_document_stats(self, doc, length, unique_terms, title_length):
+        """
+        Сохранение статистики документа (без коммита).
+        Возвращает изменение агрегатов коллекции: (число документов, суммарная длина)
+        """
+        if doc.length is None:
+            delta = (1, length)
+        else:
+            delta = (0, length - doc.length)
+
+        doc.length = length
+        doc.unique_terms = unique_terms
+        doc.title_length = title_length
+        return delta
+
+    def replace_postings(self, doc_ids, postings):
+        """
+        Замена вхождений термов для документов doc_ids (без коммита).
+        postings - список (document_id, term_id, [позиции], [(начало, конец)])
+        """
+        for chunk in chunked(doc_ids):
+            self.session.execute(
+                document_term.delete().where(document_term.c.document_id.in_(chunk))
+            )
+        rows = [
+            {'document_id': doc_id, 'term_id': term_id, 'tf': len(positions),
+             'positions': ' '.join(map(str, positions)),
+             'offsets': ' '.join(f'{start}:{end}' for start, end in offsets)}
+            for doc_id, term_id, positions, offsets in postings
+        ]
+        if rows:
+            self.session.execute(document_term.insert(), rows)
+
+    def get_file_states(self):
+        """Состояние проиндексированных файлов: {url: (id, mtime, content_hash)}"""
+        return {
+            url: (doc_id, mtime, content_hash)
+            for doc_id, url, mtime, content_hash in self.session.query(
+                Document.id, Document.url, Document.mtime, Document.content_hash)
+        }
+
+    def get_url_ids(self):
+        """Отображение url -> id документа, включая исходные url страниц и псевдонимы документов"""
+        url_ids = dict(self.session.query(Document.source_url, Document.id).filter(Document.source_url.isnot(None)))
+        url_ids.update(self.session.query(Document.url, Document.id))
+        url_ids.update(
+            self.session.query(UrlAlias.url, Document.id).join(Document, Document.url == UrlAlias.target_url)
+        )
+        return url_ids
+
+    def set_url_aliases(self, aliases):
+        """Замена псевдонимов {url: url документа} (без коммита)"""
+        self.session.execute(UrlAlias.__table__.delete())
+        if aliases:
+            self.session.execute(
+                UrlAlias.__table__.insert(),
+                [{'url': url, 'target_url': target} for url, target in aliases.items()]
+            )
+
+    def delete_outgoing_links(self, source_ids):
+        """Удаление исходящих и отложенных ссылок документов (без коммита)"""
+        for chunk in chunked(source_ids):
+            self.session.execute(Link.__table__.delete().where(Link.source_id.in_(chunk)))
+            self.session.execute(
+                DeferredLink.__table__.delete().where(DeferredLink.source_id.in_(chunk)))
+
+    def insert_links(self, links):
+        """Массовая вставка ссылок [(source_id, target_id)], дубликаты отсекает уникальный индекс"""
+        if links:
+            self.session.execute(
+                text("INSERT OR IGNORE INTO links (source_id, target_id) VALUES (:s, :t)"),
+                [{'s': s, 't': t} for s, t in links]
+            )
+
+    def pop_deferred_links(self):
+        """Все отложенные ссылки [(source_id, target_url)] с удалением их из таблицы (без коммита)"""
+        rows = self.session.query(DeferredLink.source_id, DeferredLink.target_url).all()
+        self.session.execute(DeferredLink.__table__.delete())
+        return [tuple(row) for row in rows]
+
+    def add_deferred_links(self, links):
+        if links:
+            self.session.execute(
+                DeferredLink.__table__.insert(),
+                [{'source_id': s, 'target_url': url} for s, url in links]
+            )
+
+    def delete_documents(self, doc_ids):
+        """
+        Удаление документов вместе с вхождениями и ссылками, с пересчетом агрегатов (без коммита).
+        Входящие ссылки от остающихся документов снова откладываются - вернувшийся url их получит
+        """
+        doc_count_delta = 0
+        length_delta = 0
+        deleted = set(doc_ids)
+        for chunk in chunked(doc_ids):
+            for length, in self.session.query(Document.length).filter(Document.id.in_(chunk)):
+                if length is not None:
+                    doc_count_delta -= 1
+                    length_delta -= length
+            self.session.execute(
+                document_term.delete().where(document_term.c.document_id.in_(chunk)))
+            in_links = (self.session.query(Link.source_id, Document.url)
+                        .join(Document, Document.id == Link.target_id)
+                        .filter(Link.target_id.in_(chunk)))
+            self.add_deferred_links([(source_id, url) for source_id, url in in_links
+                                     if source_id not in deleted])
+            self.session.execute(Link.__table__.delete().where(
+                Link.source_id.in_(chunk) | Link.target_id.in_(chunk)))
+            self.session.execute(
+                DeferredLink.__table__.delete().where(DeferredLink.source_id.in_(chunk)))
+            self.session.execute(Document.__table__.delete().where(Document.id.in_(chunk)))
+
+        self.add_meta(DOC_COUNT, doc_count_delta)
+        self.add_meta(TOTAL_LENGTH, length_delta)
+
+    def get_posting_rows(self, shard=None):
+        """
+        Все вхождения (слово, id документа, tf, позиции), отсортированные по слову и документу.
+        shard=(номер, число шардов) - только документы с id % число == номер
+        """
+        if shard is None:
+            return self.session.execute(text(
+                "SELECT t.word, dt.document_id, dt.tf, dt.positions "
+                "FROM document_term dt JOIN terms t ON t.id = dt.term_id "
+                "ORDER BY t.word, dt.document_id"
+            ))
+        return self.session.execute(text(
+            "SELECT t.word, dt.document_id, dt.tf, dt.positions "
+            "FROM document_term dt JOIN terms t ON t.id = dt.term_id "
+            "WHERE dt.document_id % :shards = :shard "
+            "ORDER BY t.word, dt.document_id"
+        ), {'shard': shard[0], 'shards': shard[1]})
+
+    def get_term_offsets(self, doc_ids, words):
+        """Вхождения слов в тексты документов одним запросом: {doc_id: [(начало, конец, слово)]} по возрастанию"""
+        doc_ids, words = list(doc_ids), list(words)
+        spans = {doc_id: [] for doc_id in doc_ids}
+        if not doc_ids or not words:
+            return spans
+
+        rows = self.session.execute(
+            select(document_term.c.document_id, Term.word, document_term.c.offsets)
+            .join(Term, Term.id == document_term.c.term_id)
+            .where(document_term.c.document_id.in_(doc_ids), Term.word.in_(words))
+        )
+        for doc_id, word, offsets in rows:
+            for span in (offsets or '').split():
+                start, end = span.split(':')
+                spans[doc_id].append((int(start), int(end), word))
+        for doc_spans in spans.values():
+            doc_spans.sort()
+        return spans
+
+    def get_result_documents(self, doc_ids):
+        """Поля документов для выдачи без текста: {doc_id: (title, url, pagerank, длина текста)}"""
+        rows = self.session.query(
+            Document.id, Document.title, Document.url, Document.pagerank,
+            func.length(Document.content)
+        ).filter(Document.id.in_(list(doc_ids)))
+        return {doc_id: (title, url, pagerank, length or 0)
+                for doc_id, title, url, pagerank, length in rows}
+
+    def get_content_window(self, doc_id, start, length):
+        """Фрагмент текста документа [start, start + length) без чтения всего текста в Python"""
+        return self.session.execute(
+            select(func.substr(Document.content, start + 1, length)).where(Document.id == doc_id)
+        ).scalar() or ''
+
     def add_link(self, source_doc, target_doc):
         link = self.session.query(Link).filter_by(
             source_id=source_doc.id, target_id=target_doc.id
@@ -94,11 +478,92 @@ class Database:
             doc.pagerank = pagerank
             self.session.commit()
 
+    def get_current_pageranks(self):
+        """
+        PageRank из текущего снимка {doc_id: score} одним запросом
+        (None, если снимков еще нет - тогда используется documents.pagerank)
+        """
+        rows = self.session.execute(text(
+            "SELECT doc_id, score FROM pagerank_snapshots "
+            "WHERE run_id = (SELECT value FROM index_meta WHERE key = :key)"
+        ), {'key': PAGERANK_RUN}).all()
+        if not rows:
+            return None
+        return dict(rows)
+
+    def get_topic_vectors(self):
+        """
+        Векторы тем {тема: ({doc_id: score}, значение для остальных документов, максимум вектора)}.
+        Максимум считается один раз при загрузке - для верхней границы PageRank в WAND
+        """
+        vectors = {}
+        for topic, doc_ids, scores, default_score in self.session.query(
+                TopicVector.topic, TopicVector.doc_ids, TopicVector.scores, TopicVector.default_score):
+            ids = array('i')
+            ids.frombytes(doc_ids)
+            values = array('f')
+            values.frombytes(scores)
+            rest = default_score or 0.0
+            vectors[topic] = (dict(zip(ids, values)), rest, max(max(values, default=0.0), rest))
+        return vectors
+
+    def get_versions(self):
+        """Текущие версии (индекс, PageRank)"""
+        rows = dict(self.session.execute(text(
+            "SELECT key, value FROM index_meta WHERE key IN (:index, :pagerank)"
+        ), {'index': INDEX_VERSION, 'pagerank': PAGERANK_VERSION}).all())
+        return rows.get(INDEX_VERSION, 0), rows.get(PAGERANK_VERSION, 0)
+
+    def has_tables(self, *names):
+        """Есть ли в БД все таблицы names (для БД, открытой на чтение без create_all)"""
+        existing = {row[0] for row in self.session.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+        return existing.issuperset(names)
+
+    def get_corpus_stats(self):
+        """Агрегаты коллекции: (число документов, суммарная длина)"""
+        rows = dict(self.session.execute(text(
+            "SELECT key, value FROM index_meta WHERE key IN (:count, :total)"
+        ), {'count': DOC_COUNT, 'total': TOTAL_LENGTH}).all())
+        return rows.get(DOC_COUNT, 0), rows.get(TOTAL_LENGTH, 0)
+
+    def get_meta(self, key):
+        return self.session.execute(
+            text("SELECT value FROM index_meta WHERE key = :key"), {'key': key}).scalar()
+
+    def set_meta(self, key, value):
+        """Запись значения в index_meta (без коммита)"""
+        self.session.execute(text(
+            "INSERT INTO index_meta (key, value) VALUES (:key, :value) "
+            "ON CONFLICT(key) DO UPDATE SET value = :value"
+        ), {'key': key, 'value': value})
+
+    def delete_unused_terms(self):
+        """Удаление термов без вхождений (без коммита), возвращает их число"""
+        return self.session.execute(text(
+            "DELETE FROM terms WHERE id NOT IN (SELECT DISTINCT term_id FROM document_term)"
+        )).rowcount
+
+    def add_meta(self, key, delta):
+        """Прибавление delta к счетчику в index_meta (без коммита)"""
+        self.session.execute(text(ADD_META_SQL), {'key': key, 'delta': delta})
+
+    def bump_version(self, key):
+        """Увеличение версии (без коммита)"""
+        self.session.execute(text(BUMP_VERSION_SQL), {'key': key})
+
     def search_by_term(self, term_word):
         term = self.session.query(Term).filter_by(word=term_word).first()
         if term:
             return term.documents
         return []
 
+    def release(self):
+        """Возврат соединения текущего потока в пул (для read_only)"""
+        if self.read_only:
+            self.session.remove()
+
     def close(self):
-        self.session.close()
\ No newline at end of file
+        self.session.close()
+        if self.read_only:
+            self.engine.dispose()
\ No newline at end of file
@@ -1,8 +1,10 @@
 import requests
 from bs4 import BeautifulSoup
+import hashlib
 import os
+import re
 from urllib.parse import urljoin, urlparse
-import time
+import config
 
 
 class RealSiteDownloader:
@@ -20,29 +22,49 @@ class RealSiteDownloader:
             response = requests.get(url, headers=self.headers, timeout=10)
             response.raise_for_status()
 
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # Преобразуем абсолютные ссылки для локального использования
-            for tag in soup.find_all(['a', 'img', 'link', 'script']):
-                for attr in ['href', 'src']:
-                    if tag.get(attr):
-                        absolute_url = urljoin(url, tag[attr])
-                        # Для ссылок на тот же домен делаем относительные
-                        if self.same_domain(url, absolute_url):
-                            tag[attr] = os.path.basename(urlparse(absolute_url).path) or 'index.html'
-
-            # Сохраняем
-            filepath = os.path.join(self.output_dir, filename)
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(str(soup))
-
-            print(f"Сохранено: {filename}")
+            self.save_page(url, BeautifulSoup(response.content, 'html.parser'), filename)
             return True
 
         except Exception as e:
             print(f"Ошибка при скачивании {url}: {e}")
             return False
 
+    def local_filename(self, url):
+        """Имя локального файла для url (одно и то же при сохранении и в переписанных ссылках)"""
+        parts = urlparse(url)
+        name = re.sub(r'[^A-Za-z0-9._-]+', '_', f"{parts.netloc}_{parts.path.strip('/') or 'index'}")
+        if parts.query or len(name) > 150:
+            name = name[:150] + '_' + hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]
+        return name if name.endswith('.html') else name + '.html'
+
+    def save_page(self, url, soup, filename, local_name=None):
+        """
+        Перевод ссылок того же домена на локальные файлы и сохранение страницы.
+        local_name - функция url -> имя файла (по умолчанию local_filename)
+        """
+        local_name = local_name or self.local_filename
+        # Преобразуем абсолютные ссылки для локального использования
+        for tag in soup.find_all(['a', 'img', 'link', 'script']):
+            for attr in ['href', 'src']:
+                if tag.get(attr):
+                    absolute_url = urljoin(url, tag[attr])
+                    # Для ссылок на тот же домен делаем относительные
+                    if self.same_domain(url, absolute_url):
+                        tag[attr] = local_name(absolute_url)
+
+        # Исходный url страницы - по нему парсер разрешает абсолютные ссылки других страниц
+        meta = soup.new_tag('meta', attrs={'name': config.SOURCE_URL_META, 'content': url})
+        if soup.head is None:
+            (soup.html or soup).insert(0, soup.new_tag('head'))
+        soup.head.insert(0, meta)
+
+        # Сохраняем
+        filepath = os.path.join(self.output_dir, filename)
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write(str(soup))
+
+        print(f"Сохранено: {filename}")
+
     def same_domain(self, url1, url2):
         """Проверка, что ссылки ведут на тот же домен"""
         return urlparse(url1).netloc == urlparse(url2).netloc
@@ -65,11 +87,9 @@ class RealSiteDownloader:
 
         all_sites = habr_sites + wiki_sites
 
-        downloaded = []
-        for url, filename in all_sites:
-            if self.download_site(url, filename):
-                downloaded.append(filename)
-            time.sleep(2)  # Задержка между запросами
+        # Разные хосты качаются параллельно, запросы к одному хосту - с задержкой CRAWL_DELAY
+        from crawler import AsyncCrawler
+        downloaded = AsyncCrawler(self.output_dir, max_depth=0).run(all_sites)
 
         print(f"\nСкачано {len(downloaded)} из {len(all_sites)} сайтов")
         return downloaded
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import sqlite3
+import time
+import config
+
+
+def cache_path(directory):
+    return os.path.join(directory, config.HTTP_CACHE_FILE)
+
+
+def load_aliases(directory):
+    """
+    Псевдонимы из кэша обходчика директории: {имя файла или url дубликата: имя сохраненного файла}
+    """
+    path = cache_path(directory)
+    if not os.path.exists(path):
+        return {}
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT url, local_name, filename FROM http_cache WHERE alias = 1").fetchall()
+    finally:
+        conn.close()
+
+    aliases = {}
+    for url, local_name, filename in rows:
+        aliases[url] = filename
+        if local_name != filename:
+            aliases[local_name] = filename
+    return aliases
+
+
+class CacheEntry:
+    """Запись кэша для url"""
+
+    __slots__ = ('url', 'etag', 'last_modified', 'content_hash', 'filename', 'links')
+
+    def __init__(self, url, etag, last_modified, content_hash, filename, links):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        self.filename = filename
+        self.links = links.split('\n') if links else []
+
+
+class HttpCache:
+    """
+    Кэш обходчика на диске (SQLite рядом со скачанными страницами).
+    Для каждого url - ETag, Last-Modified, хэш содержимого, файл и найденные ссылки:
+    по ним отправляются условные запросы, а при 304 или том же хэше страница
+    не перезаписывается и не разбирается. Одинаковое содержимое по разным url
+    хранится одним файлом, остальные url становятся его псевдонимами
+    """
+
+    def __init__(self, directory, commit_every=config.HTTP_CACHE_COMMIT_EVERY):
+        self.directory = directory
+        # Коммит каждые commit_every записей: прерванный обход сохраняет валидаторы
+        self.commit_every = commit_every
+        self.uncommitted = 0
+        self.conn = sqlite3.connect(cache_path(directory))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS http_cache ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT, "
+            "filename TEXT, local_name TEXT, alias INTEGER DEFAULT 0, links TEXT, fetched_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_http_cache_hash ON http_cache (content_hash)")
+
+    @staticmethod
+    def content_hash(content):
+        return hashlib.sha1(content).hexdigest()
+
+    def get(self, url):
+        """Запись для url, если ее файл еще на диске (иначе None - нужна полная загрузка)"""
+        row = self.conn.execute(
+            "SELECT url, etag, last_modified, content_hash, filename, links FROM http_cache WHERE url = ?",
+            (url,)
+        ).fetchone()
+        if row is None or not os.path.exists(os.path.join(self.directory, row[4])):
+            return None
+        return CacheEntry(*row)
+
+    def conditional_headers(self, entry):
+        """Заголовки условного GET по сохраненным валидаторам"""
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def find_content(self, content_hash, url):
+        """Файл, в котором уже сохранено такое же содержимое другого url (или None)"""
+        row = self.conn.execute(
+            "SELECT filename FROM http_cache WHERE content_hash = ? AND url != ? AND alias = 0 LIMIT 1",
+            (content_hash, url)
+        ).fetchone()
+        if row is None or not os.path.exists(os.path.join(self.directory, row[0])):
+            return None
+        return row[0]
+
+    def put(self, url, headers, content_hash, filename, local_name, links, alias=False):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO http_cache (url, etag, last_modified, content_hash, filename, "
+            "local_name, alias, links, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (url, headers.get('ETag'), headers.get('Last-Modified'), content_hash, filename,
+             local_name, int(alias), '\n'.join(links), time.time())
+        )
+        self._written()
+
+    def touch(self, url, headers):
+        """Обновление валидаторов после 304 или неизменившегося содержимого"""
+        self.conn.execute(
+            "UPDATE http_cache SET etag = COALESCE(?, etag), "
+            "last_modified = COALESCE(?, last_modified), fetched_at = ? WHERE url = ?",
+            (headers.get('ETag'), headers.get('Last-Modified'), time.time(), url)
+        )
+        self._written()
+
+    def _written(self):
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.conn.commit()
+            self.uncommitted = 0
+
+    def aliases(self):
+        """Псевдонимы url -> файл сохраненной копии"""
+        return dict(self.conn.execute("SELECT url, filename FROM http_cache WHERE alias = 1").fetchall())
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,192 @@
+import heapq
+from boolean_query import BooleanQuery, exclusion_filter, required_matches
+import config
+
+
+def min_window(position_lists):
+    """Длина наименьшего окна, содержащего хотя бы одну позицию из каждого списка"""
+    heap = [(positions[0], i, 0) for i, positions in enumerate(position_lists)]
+    heapq.heapify(heap)
+    right = max(position for position, _, _ in heap)
+    best = right - heap[0][0] + 1
+    while True:
+        left, i, j = heapq.heappop(heap)
+        best = min(best, right - left + 1)
+        if j + 1 == len(position_lists[i]):
+            return best
+        position = position_lists[i][j + 1]
+        right = max(right, position)
+        heapq.heappush(heap, (position, i, j + 1))
+
+
+def proximity(position_lists):
+    """Близость термов в документе: (число термов - 1) / длина наименьшего окна, от 0 до 1"""
+    if len(position_lists) < 2 or not all(position_lists):
+        return 0.0
+    return (len(position_lists) - 1) / max(min_window(position_lists) - 1, 1)
+
+
+def _ranks(values):
+    """Ранги значений по убыванию (1 - наибольшее)"""
+    ranks = [0] * len(values)
+    for rank, i in enumerate(sorted(range(len(values)), key=values.__getitem__, reverse=True), 1):
+        ranks[i] = rank
+    return ranks
+
+
+class HybridScorer:
+    """
+    Сигналы документа (BM25, PageRank запроса, близость термов) и их взвешенная сумма.
+    Сигналы нормируются min-max по известным границам, а не по кандидатам: BM25 - делением
+    на предел насыщения запроса (сумма idf * (K1 + 1)), PageRank - на его глобальный максимум.
+    Поэтому оценка документа не зависит от остальных кандидатов: ее можно ограничить сверху
+    для отсечения, и шарды с глобальной статистикой считают ее так же, как единый индекс
+    """
+
+    def __init__(self, index, query_terms, pageranks, weights):
+        self.index = index
+        self.pageranks = index.pageranks if pageranks is None else pageranks
+        self.weights = weights
+        terms = dict.fromkeys(query_terms)
+        self.bm25_norm = sum(index.idf(term) for term in terms) * (index.K1 + 1)
+        self.pagerank_norm = index.max_pagerank if pageranks is None else pageranks.max_value()
+
+    def signals(self, doc_id, cursors):
+        """(BM25, PageRank, близость) документа по курсорам его термов"""
+        bm25 = sum(self.index.bm25(c.tf(), doc_id, c.idf) for c in cursors)
+        closeness = proximity([c.positions() for c in cursors]) if self.weights[2] else 0.0
+        return bm25, self.pageranks.get(doc_id, 0.0), closeness
+
+    def fuse(self, signals, weights=None):
+        """Взвешенная сумма нормированных сигналов, от 0 до суммы весов"""
+        bm25_weight, pagerank_weight, proximity_weight = weights or self.weights
+        bm25, pagerank, closeness = signals
+        score = proximity_weight * closeness
+        if self.bm25_norm > 0:
+            score += bm25_weight * bm25 / self.bm25_norm
+        if self.pagerank_norm > 0:
+            score += pagerank_weight * pagerank / self.pagerank_norm
+        return score
+
+
+def _push(top, size, item):
+    """Добавление (оценка, doc_id, сигналы) в min-кучу top не больше size элементов"""
+    if len(top) < size:
+        heapq.heappush(top, item)
+    elif item[:2] > top[0][:2]:
+        heapq.heapreplace(top, item)
+
+
+def _pruned_candidates(scorer, cursors, size, weights, skip=None):
+    """
+    Отбор size документов с наибольшей оценкой scorer.fuse(..., weights) в стиле WAND.
+    Верхняя граница документа - веса BM25 по max_scores его термов плюс полный вес PageRank
+    и близости: документы до pivot, которые не могут превзойти порог, пропускаются через next_geq,
+    а у выровненного документа граница сначала уточняется его PageRank
+    """
+    bm25_weight, pagerank_weight, proximity_weight = weights
+    bm25_scale = bm25_weight / scorer.bm25_norm if scorer.bm25_norm > 0 else 0.0
+    pagerank_scale = pagerank_weight / scorer.pagerank_norm if scorer.pagerank_norm > 0 else 0.0
+    extra = (pagerank_weight if pagerank_scale else 0.0) + (proximity_weight if len(cursors) > 1 else 0.0)
+
+    # [doc_id, вклад BM25 в верхнюю границу, курсор]; курсоры в конце списка выбывают
+    entries = [[c.doc, bm25_scale * c.upper_bound, c] for c in cursors if c.doc != c.END]
+    top = []  # min-куча (оценка, doc_id, сигналы)
+    threshold = -1.0
+    while entries:
+        entries.sort(key=lambda e: e[0])
+
+        bound = extra
+        pivot = None
+        for i, entry in enumerate(entries):
+            bound += entry[1]
+            if bound >= threshold:
+                pivot = i
+                break
+        if pivot is None:
+            break
+
+        pivot_doc = entries[pivot][0]
+        if entries[0][0] == pivot_doc:
+            moved = [e for e in entries if e[0] == pivot_doc]
+            bound = (sum(e[1] for e in moved)
+                     + pagerank_scale * scorer.pageranks.get(pivot_doc, 0.0)
+                     + (proximity_weight if len(moved) > 1 else 0.0))
+            # Равная порогу оценка еще может пройти по doc_id - как при слиянии ответов шардов
+            if bound >= threshold and (skip is None or not skip(pivot_doc)):
+                signals = scorer.signals(pivot_doc, [e[2] for e in moved])
+                _push(top, size, (scorer.fuse(signals, weights), pivot_doc, signals))
+                if len(top) == size:
+                    threshold = top[0][0]
+            for entry in moved:
+                entry[2].next()
+        else:
+            moved = entries[:pivot]
+            for entry in moved:
+                entry[2].next_geq(pivot_doc)
+
+        for entry in moved:
+            entry[0] = entry[2].doc
+        if any(entry[0] == entry[2].END for entry in moved):
+            entries = [e for e in entries if e[0] != e[2].END]
+    return top
+
+
+def pool_size(k, fusion):
+    """Сколько кандидатов отбирается: k для minmax, для rrf - пул по BM25, чтобы ранги были осмысленны"""
+    return max(k, config.HYBRID_RRF_DEPTH) if fusion == 'rrf' else k
+
+
+def hybrid_candidates(index, query, k=5, pageranks=None, weights=(0.7, 0.3, 0.0), fusion='minmax'):
+    """
+    Кандидаты гибридного поиска за один проход: [(оценка отбора, doc_id, (BM25, PageRank, близость))].
+    query - список термов или BooleanQuery: обязательные условия и фразы отбирают документы,
+    исключающие условия их отбрасывают. Для minmax отбираются k документов по слитой оценке,
+    для rrf - пул pool_size по BM25 (ранги сигналов считаются уже на нем, в fuse_candidates)
+    """
+    if not isinstance(query, BooleanQuery):
+        query = BooleanQuery(query)
+    scorer = HybridScorer(index, query.terms(), pageranks, weights)
+    size = pool_size(k, fusion)
+    select_weights = (1.0, 0.0, 0.0) if fusion == 'rrf' else weights
+    skip = exclusion_filter(index, query)
+
+    if not query.must:
+        cursors = [cursor for cursor in (index.cursor(term) for term in dict.fromkeys(query.should))
+                   if cursor is not None]
+        return _pruned_candidates(scorer, cursors, size, select_weights, skip)
+
+    # Обязательные условия сужают кандидатов до пересечения - оценивается каждый документ в нем
+    top = []
+    for doc_id, matched in required_matches(index, query, skip):
+        signals = scorer.signals(doc_id, matched)
+        _push(top, size, (scorer.fuse(signals, select_weights), doc_id, signals))
+    return top
+
+
+def fuse_candidates(candidates, k=5, weights=(0.7, 0.3, 0.0), fusion='minmax'):
+    """
+    Итоговый top-k {doc_id: score} из кандидатов hybrid_candidates - одного индекса
+    или объединенных ответов шардов (отбор повторяется по всем, поэтому результат тот же).
+    'rrf' - reciprocal rank fusion по пулу: сумма weight / (HYBRID_RRF_K + ранг по сигналу)
+    """
+    candidates = heapq.nlargest(pool_size(k, fusion), candidates, key=lambda c: c[:2])
+    if fusion != 'rrf':
+        return {doc_id: score for score, doc_id, _ in candidates[:k]}
+
+    fused = [0.0] * len(candidates)
+    for column, weight in enumerate(weights):
+        if not weight:
+            continue
+        for i, rank in enumerate(_ranks([signals[column] for _, _, signals in candidates])):
+            fused[i] += weight / (config.HYBRID_RRF_K + rank)
+    doc_ids = [doc_id for _, doc_id, _ in candidates]
+    return {doc_id: score for score, doc_id in heapq.nlargest(k, zip(fused, doc_ids))}
+
+
+def hybrid_top_k(index, query, k=5, pageranks=None, weights=(0.7, 0.3, 0.0), fusion='minmax'):
+    """
+    Гибридный top-k за один проход: {doc_id: score}.
+    weights - веса (BM25, PageRank, близость термов), близость считается только при весе > 0
+    """
+    return fuse_candidates(hybrid_candidates(index, query, k, pageranks, weights, fusion), k, weights, fusion)
@@ -0,0 +1,242 @@
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+import math
+from database import Document
+
+
+class PostingList:
+    """Список вхождений терма: id документов, частоты и позиции в массивах"""
+
+    __slots__ = ('doc_ids', 'tfs', 'offsets', 'positions')
+
+    def __init__(self):
+        self.doc_ids = array('i')
+        self.tfs = array('i')
+        # offsets[i]..offsets[i + 1] - позиции i-го документа в массиве positions
+        self.offsets = array('i', [0])
+        self.positions = array('i')
+
+    def add(self, doc_id, tf, positions):
+        self.doc_ids.append(doc_id)
+        self.tfs.append(tf)
+        self.positions.extend(positions)
+        self.offsets.append(len(self.positions))
+
+    def get_positions(self, i):
+        """Позиции терма в i-м документе списка"""
+        return self.positions[self.offsets[i]:self.offsets[i + 1]]
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+
+class PostingCursor:
+    """Курсор по списку вхождений с пропуском вперед (галопирующий поиск)"""
+
+    END = float('inf')
+
+    __slots__ = ('postings', 'i', 'term', 'idf', 'upper_bound')
+
+    def __init__(self, postings, term=None, idf=0.0, upper_bound=0.0):
+        self.postings = postings
+        self.i = 0
+        self.term = term
+        self.idf = idf
+        self.upper_bound = upper_bound
+
+    @property
+    def doc(self):
+        if self.i < len(self.postings.doc_ids):
+            return self.postings.doc_ids[self.i]
+        return self.END
+
+    def tf(self):
+        return self.postings.tfs[self.i]
+
+    def positions(self):
+        return self.postings.get_positions(self.i)
+
+    def next(self):
+        self.i += 1
+
+    def next_geq(self, target):
+        """Переход к первому документу с id >= target"""
+        doc_ids = self.postings.doc_ids
+        n = len(doc_ids)
+        if self.i >= n or doc_ids[self.i] >= target:
+            return
+
+        # Галопом удваиваем шаг, пока не перепрыгнем target, затем бинарный поиск
+        lo = self.i
+        step = 1
+        while lo + step < n and doc_ids[lo + step] < target:
+            lo += step
+            step *= 2
+        self.i = bisect_left(doc_ids, target, lo + 1, min(lo + step + 1, n))
+
+
+class InvertedIndex:
+    """Позиционный инвертированный индекс в памяти, строится один раз из БД"""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.postings = {}
+        self.doc_lengths = {}
+        self.pageranks = {}
+        self.topic_vectors = {}
+        self.max_scores = {}
+        self.max_boost = 1.0
+        self.max_pagerank = 0.0
+        self.doc_count = 0
+        self.avg_doc_length = 1
+        # Глобальные df термов, когда индекс - один шард коллекции (None - считать по своим спискам)
+        self.global_df = None
+
+    @classmethod
+    def build(cls, db, shard=None):
+        """
+        Построение индекса по таблицам documents и document_term.
+        shard=(номер, число шардов) - только документы с id % число == номер,
+        статистика коллекции тогда локальная до вызова set_global_stats
+        """
+        index = cls()
+
+        missing_lengths = set()
+        documents = db.session.query(Document.id, Document.length)
+        if shard is not None:
+            documents = documents.filter(Document.id % shard[1] == shard[0])
+        for doc_id, length in documents:
+            index.doc_lengths[doc_id] = length or 0
+            if length is None:
+                missing_lengths.add(doc_id)
+        index._load_pageranks(db)
+
+        current_word = None
+        posting_list = None
+        for word, doc_id, tf, positions in db.get_posting_rows(shard):
+            if doc_id not in index.doc_lengths:
+                continue
+            if doc_id in missing_lengths:
+                # Документы из старой схемы без статистики: длина = сумма tf
+                index.doc_lengths[doc_id] += tf or 1
+            if word != current_word:
+                current_word = word
+                posting_list = index.postings.setdefault(word, PostingList())
+            elif posting_list.doc_ids and posting_list.doc_ids[-1] == doc_id:
+                # Дубликаты пар (документ, терм) из старой схемы БД
+                continue
+            positions = [int(p) for p in positions.split()] if positions else []
+            posting_list.add(doc_id, tf or 1, positions)
+
+        doc_count, total_length = db.get_corpus_stats()
+        if missing_lengths or doc_count == 0 or shard is not None:
+            doc_count = len(index.doc_lengths)
+            total_length = sum(index.doc_lengths.values())
+        index.set_corpus_stats(doc_count, total_length)
+
+        index._compute_upper_bounds()
+        return index
+
+    def set_corpus_stats(self, doc_count, total_length):
+        self.doc_count = doc_count
+        if doc_count > 0 and total_length > 0:
+            self.avg_doc_length = total_length / doc_count
+
+    def local_stats(self):
+        """Статистика шарда для глобальной агрегации: (число документов, суммарная длина, {терм: df})"""
+        return (len(self.doc_lengths), sum(self.doc_lengths.values()),
+                {term: len(posting_list) for term, posting_list in self.postings.items()})
+
+    def set_global_stats(self, doc_count, total_length, document_frequencies):
+        """Статистика всей коллекции для шарда: IDF и avgdl как у единого индекса"""
+        self.set_corpus_stats(doc_count, total_length)
+        self.global_df = document_frequencies
+        self._compute_upper_bounds()
+
+    def _load_pageranks(self, db):
+        """PageRank из текущего снимка (или из documents.pagerank, если снимков нет)"""
+        snapshot = db.get_current_pageranks()
+        if snapshot is None:
+            snapshot = dict(db.session.query(Document.id, Document.pagerank))
+        self.pageranks = {
+            doc_id: snapshot.get(doc_id) or 0.0 for doc_id in self.doc_lengths
+        }
+        # Максимум по всему снимку, а не по своим документам: у всех шардов он одинаковый
+        self.max_pagerank = max((score or 0.0 for score in snapshot.values()), default=0.0)
+        self.topic_vectors = db.get_topic_vectors()
+
+    def reload_pageranks(self, db):
+        """Обновление PageRank без перестройки списков вхождений"""
+        self._load_pageranks(db)
+        self.max_boost = max(
+            (self.pagerank_boost(doc_id) for doc_id in self.pageranks), default=1.0)
+
+    def _compute_upper_bounds(self):
+        """Верхние оценки BM25 по каждому терму и максимум множителя PageRank"""
+        for term, posting_list in self.postings.items():
+            idf = self.idf(term)
+            self.max_scores[term] = max(
+                self.bm25(tf, doc_id, idf)
+                for doc_id, tf in zip(posting_list.doc_ids, posting_list.tfs)
+            )
+        if self.pageranks:
+            self.max_boost = max(self.pagerank_boost(doc_id) for doc_id in self.pageranks)
+
+    def cursor(self, term):
+        """Курсор по списку терма или None, если терма нет в индексе"""
+        posting_list = self.postings.get(term)
+        if not posting_list:
+            return None
+        return PostingCursor(posting_list, term, self.idf(term), self.max_scores[term])
+
+    def get_postings(self, term):
+        return self.postings.get(term)
+
+    def taat_scores(self, query_terms, pageranks=None):
+        """Term-at-a-time: накопление BM25 по спискам термов, затем множитель PageRank"""
+        scores = defaultdict(float)
+
+        # Для каждого терма вычисляем вклад в документы
+        for term in dict.fromkeys(query_terms):
+            posting_list = self.get_postings(term)
+            if not posting_list:
+                continue
+
+            idf = self.idf(term)
+            for doc_id, tf in zip(posting_list.doc_ids, posting_list.tfs):
+                scores[doc_id] += self.bm25(tf, doc_id, idf)
+
+        # Учитываем PageRank
+        for doc_id in scores:
+            scores[doc_id] *= self.pagerank_boost(doc_id, pageranks)
+        return scores
+
+    def idf(self, term):
+        """IDF терма (0 для отсутствующих в индексе)"""
+        posting_list = self.postings.get(term)
+        if not posting_list:
+            return 0.0
+        df = self.global_df.get(term, len(posting_list)) if self.global_df else len(posting_list)
+        return math.log((self.doc_count + 1) / (df + 0.5))
+
+    def bm25(self, tf, doc_id, idf):
+        """Вклад одного терма в BM25 документа"""
+        doc_length = self.doc_lengths[doc_id]
+        norm = self.K1 * (1 - self.B + self.B * (doc_length / self.avg_doc_length))
+        return idf * (tf * (self.K1 + 1)) / (tf + norm)
+
+    def pagerank_boost(self, doc_id, pageranks=None):
+        """Множитель PageRank в итоговой оценке (pageranks - PageRank конкретного запроса)"""
+        if pageranks is None:
+            pageranks = self.pageranks
+        return 1 + math.log1p(pageranks.get(doc_id, 0.0))
+
+    def max_boost_for(self, pageranks=None):
+        """Максимальный множитель PageRank для PageRank запроса"""
+        if pageranks is None:
+            return self.max_boost
+        return 1 + math.log1p(pageranks.max_value())
+
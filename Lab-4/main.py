@@ -2,6 +2,10 @@ from database import Database, Document, Term, Link
 from parser import Parser
 from pagerank_mr import MapReducePageRank
 from pagerank_pregel import PregelPageRank
+from pagerank_sparse import SparsePageRank
+from pagerank_ooc import OutOfCorePageRank
+from pagerank_incremental import IncrementalPageRank
+from pagerank_topics import TopicPageRank
 from search_engine import SearchEngine
 import config
 import warnings
@@ -24,6 +28,11 @@ def main():
     parser = Parser(db)
     documents = parser.parse_directory(config.DATA_DIR)
 
+    # После переиндексации PageRank обновляется от прошлого снимка: проталкиваются
+    # только изменения графа (при большой доле изменений - полный пересчет)
+    print("\n2б. ОБНОВЛЕНИЕ PAGERANK ПОСЛЕ ПЕРЕИНДЕКСАЦИИ")
+    incremental_pr = IncrementalPageRank(config.DB_PATH)
+    incremental_pr.calculate_pagerank(iterations=20)
 
     # Теперь проверьте PageRank
     links_count = db.session.query(Link).count()
@@ -46,6 +55,26 @@ def main():
         if doc:
             print(f"  {doc.title}: {pr_value:.6f}")
 
+    # PageRank через разреженные матрицы
+    print("\n3б. ВЫЧИСЛЕНИЕ PAGERANK (CSR)")
+    sparse_pr = SparsePageRank(config.DB_PATH)
+    sparse_results = sparse_pr.calculate_pagerank(iterations=20)
+
+    max_diff = max((abs(sparse_results[d] - mr_results.get(d, 0)) for d in sparse_results), default=0)
+    print(f"Максимальное расхождение с MapReduce: {max_diff:.2e}")
+
+    # PageRank с потоковым чтением ребер из файла (для графов больше памяти)
+    print("\n3в. ВЫЧИСЛЕНИЕ PAGERANK (ВНЕ ПАМЯТИ)")
+    ooc_pr = OutOfCorePageRank(config.DB_PATH)
+    ooc_results = ooc_pr.calculate_pagerank(iterations=20)
+    max_diff = max((abs(ooc_results[d] - sparse_results.get(d, 0)) for d in ooc_results), default=0)
+    print(f"Максимальное расхождение с CSR: {max_diff:.2e}")
+
+    # Тематические векторы PageRank для смешивания при поиске
+    print("\n3г. ТЕМАТИЧЕСКИЙ PAGERANK")
+    topic_results = TopicPageRank(config.DB_PATH).calculate(iterations=20)
+    print(f"Темы: {', '.join(topic_results)}")
+
     print("\n=== ДИАГНОСТИКА ПЕРЕД PAGERANK ===")
 
     # PageRank через Pregel
@@ -59,6 +88,11 @@ def main():
         if doc:
             print(f"  {doc.title}: {pr_value:.6f}")
 
+    print("\nСходимость движков:")
+    for engine in (incremental_pr, mr_pr, sparse_pr, ooc_pr, pregel_pr):
+        if engine.trace:
+            print(f"  {engine.trace.summary()}")
+
     # Поиск
     print("\n5. ПОЛНОТЕКСТОВЫЙ ПОИСК")
     search_engine = SearchEngine(db)
@@ -0,0 +1,81 @@
+import json
+import time
+import numpy as np
+import config
+
+
+class ConvergenceTrace:
+    """
+    Журнал сходимости одного запуска PageRank: по записи на итерацию
+    (номер, L1-остаток, время итерации). Одинаков для всех движков, чтобы их можно было сравнивать
+    """
+
+    def __init__(self, engine, solver):
+        self.engine = engine
+        self.solver = solver
+        self.iterations = []
+        self.converged = False
+        self.stop_reason = None
+        self.started = time.perf_counter()
+        self._last = self.started
+
+    def record(self, residual, **extra):
+        """Запись очередной итерации; время - с предыдущей записи"""
+        now = time.perf_counter()
+        entry = {
+            'iteration': len(self.iterations) + 1,
+            'residual': float(residual),
+            'seconds': now - self._last,
+        }
+        entry.update(extra)
+        self.iterations.append(entry)
+        self._last = now
+        return entry
+
+    def finish(self, converged, stop_reason):
+        self.converged = converged
+        self.stop_reason = stop_reason
+        self._last = time.perf_counter()
+        if config.PAGERANK_TRACE_PATH:
+            with open(config.PAGERANK_TRACE_PATH, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(self.to_dict(), ensure_ascii=False) + '\n')
+
+    @property
+    def total_seconds(self):
+        return self._last - self.started
+
+    def to_dict(self):
+        return {
+            'engine': self.engine,
+            'solver': self.solver,
+            'converged': self.converged,
+            'stop_reason': self.stop_reason,
+            'total_seconds': self.total_seconds,
+            'iterations': self.iterations,
+        }
+
+    def summary(self):
+        """Краткая строка для сравнения движков"""
+        residual = self.iterations[-1]['residual'] if self.iterations else 0.0
+        return (f"{self.engine}/{self.solver}: {len(self.iterations)} итераций, "
+                f"{self.total_seconds:.3f} с, остаток {residual:.2e}, остановка: {self.stop_reason}")
+
+
+class TopKStability:
+    """Критерий остановки: top-k документов (с порядком) не меняется rounds итераций подряд"""
+
+    def __init__(self, k=config.PAGERANK_STABLE_TOP_K, rounds=config.PAGERANK_STABLE_ROUNDS):
+        self.k = k
+        self.rounds = rounds
+        self.previous = None
+        self.stable = 0
+
+    def update(self, pagerank):
+        """Учет нового вектора, возвращает True, если ранжирование устоялось"""
+        k = min(self.k, len(pagerank))
+        top = np.argpartition(-pagerank, k - 1)[:k]
+        top = tuple(top[np.argsort(-pagerank[top], kind='stable')].tolist())
+
+        self.stable = self.stable + 1 if top == self.previous else 0
+        self.previous = top
+        return self.stable >= self.rounds
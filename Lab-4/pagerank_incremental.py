@@ -0,0 +1,129 @@
+import time
+import numpy as np
+import config
+from pagerank_convergence import ConvergenceTrace
+from pagerank_sparse import SparsePageRank
+from pagerank_store import load_current_snapshot
+
+
+class IncrementalPageRank:
+    """
+    Инкрементальный PageRank: старт с последнего опубликованного вектора и локальное
+    проталкивание (push) остатка, возникшего из-за новых/удаленных ссылок и документов.
+    Если изменилась слишком большая доля узлов - полный пересчет через SparsePageRank
+    """
+
+    def __init__(self, db_path, change_threshold=config.PAGERANK_INCREMENTAL_THRESHOLD):
+        self.db_path = db_path
+        self.damping = config.DAMPING_FACTOR
+        self.change_threshold = change_threshold
+        self.graph = SparsePageRank(db_path)
+        self.trace = None
+
+    def find_changes(self, snapshot):
+        """Число изменившихся узлов: новые, удаленные и с другим набором исходящих ссылок"""
+        graph = self.graph
+        current = set(graph.doc_ids.tolist())
+        removed = sum(1 for doc_id in snapshot if doc_id not in current)
+
+        changed = removed
+        for doc_id, link_hash in zip(graph.doc_ids.tolist(), graph.link_hashes.tolist()):
+            previous = snapshot.get(doc_id)
+            if previous is None or previous[1] != link_hash:
+                changed += 1
+        return changed
+
+    def calculate_pagerank(self, iterations=config.MAX_ITERATIONS):
+        """Обновление PageRank после изменения графа"""
+        graph = self.graph
+        graph.load_graph()
+        N = len(graph.doc_ids)
+        if N == 0:
+            return {}
+
+        snapshot = load_current_snapshot(self.db_path)
+        if not snapshot or any(link_hash is None for _, link_hash in snapshot.values()):
+            print("Нет снимка с подписями ссылок - полный пересчет")
+            result = graph.calculate_pagerank(iterations)
+            self.trace = graph.trace
+            return result
+
+        changed = self.find_changes(snapshot)
+        if changed > self.change_threshold * N:
+            print(f"Изменилось {changed} из {N} узлов - полный пересчет")
+            result = graph.calculate_pagerank(iterations)
+            self.trace = graph.trace
+            return result
+
+        print(f"Инкрементальный PageRank: изменилось {changed} из {N} узлов")
+        if changed == 0:
+            return {doc_id: snapshot[doc_id][0] for doc_id in graph.doc_ids.tolist()}
+
+        # Теплый старт: новые документы начинают с нуля
+        pagerank = np.array([snapshot.get(doc_id, (0.0, None))[0]
+                             for doc_id in graph.doc_ids.tolist()])
+        pagerank = self.push(pagerank, iterations)
+        if not self.trace.converged:
+            # Недосошедшийся вектор не публикуется
+            print(f"Проталкивание не сошлось за {iterations} раундов - полный пересчет")
+            result = graph.calculate_pagerank(iterations)
+            self.trace = graph.trace
+            return result
+        return graph.publish(pagerank, engine='incremental')
+
+    def push(self, pagerank, max_rounds):
+        """
+        Локальные обновления Гаусса-Саусвелла: узел с остатком r переносит его в свое
+        значение и раздает d * r / outdeg соседям (висячий узел - всем поровну).
+        Точный остаток считается одним умножением, дальше трогаются только узлы с |r| > TOLERANCE / N,
+        пока суммарный остаток не станет меньше TOLERANCE (критерий полного пересчета)
+        """
+        graph = self.graph
+        N = len(graph.doc_ids)
+        residual = graph.iterate(pagerank) - pagerank
+        threshold = config.TOLERANCE / N
+
+        self.trace = ConvergenceTrace('incremental', 'push')
+        stop_reason = 'max_iterations'
+        touched_edges = 0
+        start = time.perf_counter()
+        for round_no in range(max_rounds):
+            if np.abs(residual).sum() < config.TOLERANCE:
+                stop_reason = 'tolerance'
+                break
+            frontier = np.flatnonzero(np.abs(residual) > threshold)
+            if frontier.size == 0:
+                stop_reason = 'tolerance'
+                break
+
+            pushed = residual[frontier]
+            pagerank[frontier] += pushed
+            residual[frontier] = 0.0
+
+            # Раздача по исходящим ссылкам фронта
+            starts = graph.out_indptr[frontier]
+            degrees = graph.out_indptr[frontier + 1] - starts
+            linked = degrees > 0
+            if linked.any():
+                degrees_linked = degrees[linked]
+                # Номера ребер фронта в out_indices: start узла + 0..outdeg-1
+                edge_index = np.repeat(
+                    starts[linked] - np.cumsum(degrees_linked) + degrees_linked, degrees_linked
+                ) + np.arange(degrees_linked.sum())
+                shares = np.repeat(self.damping * pushed[linked] / degrees_linked, degrees_linked)
+                np.add.at(residual, graph.out_indices[edge_index], shares)
+                touched_edges += edge_index.size
+
+            # Висячие узлы фронта раздают остаток равномерно
+            sink = pushed[~linked].sum()
+            if sink:
+                residual += self.damping * sink / N
+
+            self.trace.record(np.abs(residual).sum(), frontier=int(frontier.size))
+            print(f"Раунд {round_no + 1}: узлов во фронте = {frontier.size}, "
+                  f"остаток = {np.abs(residual).sum():.6f}")
+
+        self.trace.finish(stop_reason == 'tolerance', stop_reason)
+        print(f"Затронуто ребер: {touched_edges} (в графе {graph.indices.size}), "
+              f"{time.perf_counter() - start:.3f} с")
+        return pagerank
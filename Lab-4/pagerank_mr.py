@@ -1,12 +1,21 @@
 import sqlite3
 from collections import defaultdict
+import numpy as np
 import config
+from pagerank_convergence import ConvergenceTrace
+from pagerank_sparse import SparsePageRank
+from pagerank_store import PageRankPublisher, load_current_snapshot, out_link_hashes
+
+
+# Гаусс-Зейдель не выражается в MapReduce: reduce видит только значения прошлой итерации
+SOLVERS = ('power', 'aitken', 'quadratic')
 
 
 class MapReducePageRank:
     def __init__(self, db_path):
         self.db_path = db_path
         self.damping = config.DAMPING_FACTOR
+        self.trace = None
 
     def map_links(self):
         """Map: собираем исходящие ссылки для каждого документа"""
@@ -58,15 +67,44 @@ class MapReducePageRank:
 
         return new_pr
 
-    def calculate_pagerank(self, iterations=config.MAX_ITERATIONS):
-        """Основной алгоритм PageRank через MapReduce"""
+    def extrapolate(self, solver, history, doc_ids, outgoing, diff):
+        """
+        Экстраполяция (как в SparsePageRank) между заданиями MapReduce или None,
+        если она не уменьшает остаток - проверка стоит одной лишней итерации
+        """
+        extrapolated = getattr(SparsePageRank, solver)(history)
+        if not np.all(np.isfinite(extrapolated)) or extrapolated.min() < 0:
+            return None
+        candidate = dict(zip(doc_ids, (extrapolated / extrapolated.sum()).tolist()))
+        step = self.reduce_pagerank(doc_ids, outgoing, candidate)
+        if sum(abs(step[doc_id] - candidate[doc_id]) for doc_id in doc_ids) >= diff:
+            return None
+        return candidate
+
+    def calculate_pagerank(self, iterations=config.MAX_ITERATIONS, warm_start=False, solver='power'):
+        """
+        Основной алгоритм PageRank через MapReduce.
+        warm_start - начинать с последнего опубликованного вектора вместо равномерного,
+        solver - метод из SOLVERS (экстраполяция выполняется драйвером между итерациями)
+        """
+        if solver not in SOLVERS:
+            raise ValueError(f"Неизвестный метод PageRank для MapReduce: {solver}")
+
         # Инициализация
         doc_ids, outgoing = self.map_links()
         N = len(doc_ids)
         pagerank = {doc_id: 1.0 / N for doc_id in doc_ids}
+        if warm_start:
+            snapshot = load_current_snapshot(self.db_path)
+            pagerank = {doc_id: snapshot[doc_id][0] if doc_id in snapshot else 1.0 / N
+                        for doc_id in doc_ids}
 
         print("Запуск PageRank через MapReduce...")
 
+        self.trace = ConvergenceTrace('mapreduce', solver)
+        depth = {'aitken': 3, 'quadratic': 4}.get(solver, 1)
+        history = [np.array([pagerank[doc_id] for doc_id in doc_ids])]
+        stop_reason = 'max_iterations'
         for i in range(iterations):
             new_pagerank = self.reduce_pagerank(doc_ids, outgoing, pagerank)
 
@@ -74,24 +112,29 @@ class MapReducePageRank:
             diff = sum(abs(new_pagerank[doc_id] - pagerank[doc_id]) for doc_id in doc_ids)
 
             pagerank = new_pagerank
+            if depth > 1:
+                history = (history + [np.array([pagerank[doc_id] for doc_id in doc_ids])])[-depth:]
 
+            self.trace.record(diff)
             print(f"Итерация {i + 1}: максимальное изменение = {diff:.6f}")
 
             if diff < config.TOLERANCE:
                 print(f"Сходимость достигнута на итерации {i + 1}")
+                stop_reason = 'tolerance'
                 break
 
-        # Обновляем значения в БД
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+            # Периодическая экстраполяция по накопленной истории
+            if depth > 1 and len(history) == depth and (i + 1) % config.PAGERANK_EXTRAPOLATION_PERIOD == 0:
+                extrapolated = self.extrapolate(solver, history, doc_ids, outgoing, diff)
+                if extrapolated is not None:
+                    pagerank = extrapolated
+                    history = [np.array([pagerank[doc_id] for doc_id in doc_ids])]
 
-        for doc_id, pr_value in pagerank.items():
-            cursor.execute(
-                "UPDATE documents SET pagerank = ? WHERE id = ?",
-                (pr_value, doc_id)
-            )
+        self.trace.finish(stop_reason == 'tolerance', stop_reason)
+        print(self.trace.summary())
 
-        conn.commit()
-        conn.close()
+        # Публикуем новый снимок PageRank
+        link_hashes = out_link_hashes({doc_id: outgoing.get(doc_id, []) for doc_id in doc_ids})
+        PageRankPublisher(self.db_path).publish(pagerank, engine='mapreduce', link_hashes=link_hashes)
 
         return pagerank
\ No newline at end of file
@@ -0,0 +1,146 @@
+import json
+import os
+import sqlite3
+import numpy as np
+import config
+from pagerank_convergence import ConvergenceTrace
+from pagerank_store import PageRankPublisher, link_hash_sums, finish_link_hashes
+
+EDGE_DTYPE = np.int32
+
+
+class OutOfCorePageRank:
+    """
+    PageRank для графов больше оперативной памяти.
+    export() выгружает ребра, отсортированные по цели, в бинарный файл (пары плотных
+    индексов int32) блоками по block_edges; при расчете файл читается через memmap
+    блок за блоком, в памяти держатся только векторы рангов и степени (O(N))
+    """
+
+    def __init__(self, db_path, graph_dir=config.PAGERANK_GRAPH_DIR,
+                 block_edges=config.PAGERANK_BLOCK_EDGES):
+        self.db_path = db_path
+        self.graph_dir = graph_dir
+        self.block_edges = block_edges
+        self.damping = config.DAMPING_FACTOR
+        self.trace = None
+
+    def _path(self, name):
+        return os.path.join(self.graph_dir, name)
+
+    def export(self):
+        """Выгрузка графа: ids.bin, out_degree.bin, link_hashes.bin, edges.bin и meta.json"""
+        os.makedirs(self.graph_dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT id FROM documents ORDER BY id")
+        doc_ids = np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
+        N = len(doc_ids)
+        out_degree = np.zeros(N, dtype=np.int64)
+        hash_sums = np.zeros(N, dtype=np.int64)
+
+        # Сортировку по цели делает SQLite (при нехватке памяти - во временных файлах)
+        cursor.execute("SELECT source_id, target_id FROM links ORDER BY target_id, source_id")
+        edges_count = 0
+        with open(self._path('edges.bin.tmp'), 'wb') as f:
+            while True:
+                rows = cursor.fetchmany(self.block_edges)
+                if not rows:
+                    break
+                block = np.array(rows, dtype=np.int64)
+                src = np.searchsorted(doc_ids, block[:, 0])
+                dst = np.searchsorted(doc_ids, block[:, 1])
+                ok = (src < N) & (dst < N)
+                ok[ok] = (doc_ids[src[ok]] == block[ok, 0]) & (doc_ids[dst[ok]] == block[ok, 1])
+                src, dst = src[ok], dst[ok]
+
+                np.column_stack((src, dst)).astype(EDGE_DTYPE).tofile(f)
+                out_degree += np.bincount(src, minlength=N)
+                link_hash_sums(N, src, doc_ids[dst], hash_sums)
+                edges_count += len(src)
+        conn.close()
+
+        doc_ids.tofile(self._path('ids.bin.tmp'))
+        out_degree.tofile(self._path('out_degree.bin.tmp'))
+        finish_link_hashes(hash_sums, out_degree).tofile(self._path('link_hashes.bin.tmp'))
+        with open(self._path('meta.json.tmp'), 'w', encoding='utf-8') as f:
+            json.dump({'nodes': N, 'edges': edges_count}, f)
+
+        # Файлы заменяются только после полной выгрузки
+        for name in ('edges.bin', 'ids.bin', 'out_degree.bin', 'link_hashes.bin', 'meta.json'):
+            os.replace(self._path(name + '.tmp'), self._path(name))
+
+        print(f"Граф выгружен в {self.graph_dir}: {N} узлов, {edges_count} ребер")
+        return N, edges_count
+
+    def load(self):
+        """Открытие выгруженного графа: (doc_ids, out_degree, edges memmap)"""
+        with open(self._path('meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        doc_ids = np.fromfile(self._path('ids.bin'), dtype=np.int64)
+        out_degree = np.fromfile(self._path('out_degree.bin'), dtype=np.int64).astype(np.float64)
+        edges = None
+        if meta['edges']:
+            edges = np.memmap(self._path('edges.bin'), dtype=EDGE_DTYPE, mode='r',
+                              shape=(meta['edges'], 2))
+        return doc_ids, out_degree, edges
+
+    def multiply(self, share, edges, N):
+        """Вклад входящих ссылок: потоковый проход по блокам ребер"""
+        incoming = np.zeros(N)
+        if edges is None:
+            return incoming
+        for start in range(0, len(edges), self.block_edges):
+            block = np.asarray(edges[start:start + self.block_edges])
+            src, dst = block[:, 0], block[:, 1]
+            # Ребра отсортированы по цели - блок покрывает узкий диапазон целей
+            lo, hi = int(dst[0]), int(dst[-1]) + 1
+            incoming[lo:hi] += np.bincount(dst - lo, weights=share[src], minlength=hi - lo)
+        return incoming
+
+    def calculate_pagerank(self, iterations=config.MAX_ITERATIONS, export=True):
+        """PageRank степенным методом с потоковым чтением ребер; export=False - взять уже выгруженный граф"""
+        if export:
+            self.export()
+        doc_ids, out_degree, edges = self.load()
+        N = len(doc_ids)
+        if N == 0:
+            return {}
+
+        dangling = out_degree == 0
+        pagerank = np.full(N, 1.0 / N)
+
+        print("Запуск PageRank вне памяти (memmap)...")
+
+        self.trace = ConvergenceTrace('out_of_core', 'power')
+        stop_reason = 'max_iterations'
+        for i in range(iterations):
+            share = np.divide(pagerank, out_degree, out=np.zeros(N), where=~dangling)
+            sink_pr = pagerank[dangling].sum()
+            new_pagerank = (1 - self.damping) / N + \
+                self.damping * (self.multiply(share, edges, N) + sink_pr / N)
+
+            # Проверка сходимости (L1, как в MapReduce)
+            diff = np.abs(new_pagerank - pagerank).sum()
+            pagerank = new_pagerank
+
+            self.trace.record(diff)
+            print(f"Итерация {i + 1}: максимальное изменение = {diff:.6f}")
+
+            if diff < config.TOLERANCE:
+                print(f"Сходимость достигнута на итерации {i + 1}")
+                stop_reason = 'tolerance'
+                break
+
+        self.trace.finish(stop_reason == 'tolerance', stop_reason)
+        print(self.trace.summary())
+
+        result = dict(zip(doc_ids.tolist(), pagerank.tolist()))
+        # Граф, выгруженный до появления подписей, публикуется без них (следующее обновление - полное)
+        link_hashes = None
+        if os.path.exists(self._path('link_hashes.bin')):
+            hashes = np.fromfile(self._path('link_hashes.bin'), dtype=np.int64)
+            link_hashes = dict(zip(doc_ids.tolist(), hashes.tolist()))
+        PageRankPublisher(self.db_path).publish(result, engine='out_of_core', link_hashes=link_hashes)
+        return result
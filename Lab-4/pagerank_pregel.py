@@ -1,86 +1,119 @@
-import networkx as nx
-from database import Database
+import operator
+from database import Document, Link
+from pagerank_convergence import ConvergenceTrace
+from pagerank_store import PageRankPublisher, out_link_hashes
+from pregel import Pregel
 import config
 
 
-class PregelPageRank:
-    def __init__(self, db):
-        self.db = db
-        self.damping = config.DAMPING_FACTOR
-        self.graph = nx.DiGraph()
-
-    def build_graph(self):
-        """Строим граф из данных БД"""
-        documents = self.db.get_all_documents()
-        links = self.db.get_all_links()
-
-        # Добавляем узлы (документы)
-        for doc in documents:
-            self.graph.add_node(doc.id, pagerank=1.0 / len(documents))
-
-        # Добавляем ребра (ссылки)
-        for link in links:
-            self.graph.add_edge(link.source_id, link.target_id)
-
-        print(f"Построен граф: {len(documents)} узлов, {len(links)} ребер")
-
-    def pregel_iteration(self):
-        """Одна итерация в стиле Pregel"""
-        new_pagerank = {}
-        N = len(self.graph.nodes())
+class PageRankVertex:
+    """Вершинная программа PageRank для Pregel"""
 
-        # Вычисляем сумму PageRank для узлов без исходящих ребер
-        sink_pr = 0
-        for node in self.graph.nodes():
-            if self.graph.out_degree[node] == 0:
-                sink_pr += self.graph.nodes[node]['pagerank']
+    def __init__(self, damping, tolerance, max_iterations):
+        self.damping = damping
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
 
-        for node in self.graph.nodes():
-            # Начальное значение
-            new_pr = (1 - self.damping) / N
+    def __call__(self, vertex, messages):
+        N = vertex.num_vertices
 
-            # Вклад от узлов без исходящих ссылок
-            new_pr += self.damping * sink_pr / N
+        if vertex.superstep == 0:
+            # Теплый старт: значение уже задано из последнего снимка
+            if not vertex.value:
+                vertex.value = 1.0 / N
+        else:
+            # Сошлось на предыдущем супершаге - больше ничего не меняем
+            max_change = vertex.get_aggregated('max_change')
+            if max_change is not None and max_change < self.tolerance:
+                vertex.vote_to_halt()
+                return
 
-            # Вклад от входящих ссылок
-            for predecessor in self.graph.predecessors(node):
-                outgoing_count = self.graph.out_degree[predecessor]
-                if outgoing_count > 0:
-                    new_pr += self.damping * (
-                            self.graph.nodes[predecessor]['pagerank'] / outgoing_count
-                    )
+            # Вклад входящих ссылок (уже сложен комбайнером) и узлов без исходящих ссылок
+            sink_pr = vertex.get_aggregated('sink_pr') or 0.0
+            new_pr = (1 - self.damping) / N + self.damping * (sum(messages) + sink_pr / N)
+            change = abs(new_pr - vertex.value)
+            vertex.aggregate('max_change', change)
+            vertex.aggregate('l1_change', change)
+            vertex.value = new_pr
 
-            new_pagerank[node] = new_pr
+        if vertex.superstep >= self.max_iterations:
+            vertex.vote_to_halt()
+            return
 
-        # ОШИБКА ЗДЕСЬ: Сначала нужно вычислить max_change, потом обновлять!
-        max_change = 0
-        for node, pr in new_pagerank.items():
-            old_pr = self.graph.nodes[node]['pagerank']
-            change = abs(pr - old_pr)
-            if change > max_change:
-                max_change = change
-            self.graph.nodes[node]['pagerank'] = pr  # Обновляем ПОСЛЕ вычисления
+        if vertex.out_edges:
+            vertex.send_to_all_neighbors(vertex.value / len(vertex.out_edges))
+        else:
+            vertex.aggregate('sink_pr', vertex.value)
 
-        return max_change
 
-    def calculate_pagerank(self, max_iterations=config.MAX_ITERATIONS):
-        """Вычисление PageRank в стиле Pregel"""
-        self.build_graph()
-
-        print("Запуск PageRank через Pregel-подобный алгоритм...")
-
-        for i in range(max_iterations):
-            max_change = self.pregel_iteration()
-
-            print(f"Итерация {i + 1}: максимальное изменение = {max_change:.6f}")
-
-            if max_change < config.TOLERANCE:
-                print(f"Сходимость достигнута на итерации {i + 1}")
-                break
-
-        # Обновляем значения в БД
-        for node in self.graph.nodes():
-            self.db.update_pagerank(node, self.graph.nodes[node]['pagerank'])
+class PregelPageRank:
+    def __init__(self, db, workers=config.PREGEL_WORKERS):
+        self.db = db
+        self.damping = config.DAMPING_FACTOR
+        self.workers = workers
+        self.vertices = []
+        self.trace = None
+
+    def build_graph(self, warm_start=False):
+        """Строим список вершин (id, значение, исходящие ребра) из данных БД"""
+        initial = (self.db.get_current_pageranks() or {}) if warm_start else {}
+        doc_ids = [doc_id for doc_id, in self.db.session.query(Document.id)]
+        out_edges = {doc_id: [] for doc_id in doc_ids}
+        links_count = 0
+        for source_id, target_id in self.db.session.query(Link.source_id, Link.target_id):
+            if source_id in out_edges and target_id in out_edges:
+                out_edges[source_id].append(target_id)
+                links_count += 1
+
+        self.vertices = [(doc_id, initial.get(doc_id, 0.0), out_edges[doc_id]) for doc_id in doc_ids]
+
+        print(f"Построен граф: {len(doc_ids)} узлов, {links_count} ребер")
+
+    def calculate_pagerank(self, max_iterations=config.MAX_ITERATIONS, warm_start=False):
+        """
+        Вычисление PageRank на Pregel: супершаг 0 - инициализация, далее по итерации на супершаг.
+        warm_start - начинать с последнего опубликованного вектора вместо равномерного
+        """
+        self.build_graph(warm_start)
+        if not self.vertices:
+            return {}
+
+        print("Запуск PageRank через Pregel...")
+
+        pregel = Pregel(
+            PageRankVertex(self.damping, config.TOLERANCE, max_iterations),
+            combiner=operator.add,
+            aggregators={'sink_pr': operator.add, 'max_change': max, 'l1_change': operator.add},
+            num_workers=self.workers,
+        )
+        # Остаток в журнале - L1, как у остальных движков; максимум - для критерия остановки
+        self.trace = ConvergenceTrace('pregel', 'power')
+        stop_reason = 'max_iterations'
+        try:
+            pregel.load(self.vertices)
+            while not pregel.done:
+                aggregated = pregel.step()
+                if 'max_change' not in aggregated:
+                    continue
+
+                max_change = aggregated['max_change']
+                self.trace.record(aggregated['l1_change'], max_change=max_change)
+                print(f"Итерация {pregel.superstep - 1}: максимальное изменение = {max_change:.6f}")
+
+                if max_change < config.TOLERANCE:
+                    print(f"Сходимость достигнута на итерации {pregel.superstep - 1}")
+                    stop_reason = 'tolerance'
+
+            pagerank = pregel.values()
+        finally:
+            pregel.close()
+
+        self.trace.finish(stop_reason == 'tolerance', stop_reason)
+        print(self.trace.summary())
+
+        # Публикуем новый снимок PageRank
+        link_hashes = out_link_hashes({doc_id: out_edges for doc_id, _, out_edges in self.vertices})
+        PageRankPublisher(self.db.db_path).publish(pagerank, engine='pregel', link_hashes=link_hashes)
 
         # Возвращаем результаты
-        return {node: self.graph.nodes[node]['pagerank'] for node in self.graph.nodes()}
\ No newline at end of file
+        return pagerank
@@ -0,0 +1,227 @@
+import sqlite3
+import numpy as np
+import config
+from pagerank_convergence import ConvergenceTrace, TopKStability
+from pagerank_store import PageRankPublisher, link_hash_sums, finish_link_hashes
+
+SOLVERS = ('power', 'gauss_seidel', 'aitken', 'quadratic')
+
+
+class SparsePageRank:
+    """
+    PageRank через разреженное умножение матрицы на вектор.
+    Граф ссылок хранится в CSR по целевым документам (для каждого документа -
+    массив входящих источников), степени исходящих ссылок и маска висячих
+    узлов считаются один раз при загрузке
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.damping = config.DAMPING_FACTOR
+        self.doc_ids = None
+        self.indptr = None
+        self.indices = None
+        self.out_degree = None
+        self.dangling = None
+        self.out_indptr = None
+        self.out_indices = None
+        self.link_hashes = None
+        self.trace = None
+
+    def load_graph(self):
+        """Загрузка таблицы links в CSR"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT id FROM documents ORDER BY id")
+        self.doc_ids = np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
+
+        cursor.execute("SELECT source_id, target_id FROM links")
+        edges = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+        conn.close()
+
+        self._build_csr(edges[:, 0], edges[:, 1])
+
+    def _build_csr(self, sources, targets):
+        """Построение CSR по id документов источников и целей"""
+        N = len(self.doc_ids)
+
+        # Переводим id документов в плотные индексы 0..N-1, ребра к неизвестным id отбрасываем
+        src = np.searchsorted(self.doc_ids, sources)
+        dst = np.searchsorted(self.doc_ids, targets)
+        src_ok = (src < N) & (self.doc_ids[np.minimum(src, N - 1)] == sources) if N else src < 0
+        dst_ok = (dst < N) & (self.doc_ids[np.minimum(dst, N - 1)] == targets) if N else dst < 0
+        src, dst = src[src_ok & dst_ok], dst[src_ok & dst_ok]
+
+        order = np.argsort(dst, kind='stable')
+        self.indices = src[order]
+        self.indptr = np.zeros(N + 1, dtype=np.int64)
+        np.cumsum(np.bincount(dst, minlength=N), out=self.indptr[1:])
+
+        self.out_degree = np.bincount(src, minlength=N).astype(np.float64)
+        self.dangling = self.out_degree == 0
+
+        # CSR по источникам - для локального проталкивания остатков (инкрементальный режим)
+        self.out_indices = dst[np.argsort(src, kind='stable')]
+        self.out_indptr = np.zeros(N + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=N), out=self.out_indptr[1:])
+
+        # Подпись множества исходящих ссылок документа - для поиска изменившихся узлов
+        self.link_hashes = finish_link_hashes(link_hash_sums(N, src, self.doc_ids[dst]), self.out_degree)
+
+    def multiply(self, pagerank):
+        """
+        Вклад входящих ссылок: сумма PR(источника) / outdeg(источника) по строкам CSR.
+        pagerank - вектор длины N или матрица N x K (K векторов сразу)
+        """
+        out_degree = self.out_degree
+        linked = ~self.dangling
+        if pagerank.ndim == 2:
+            out_degree = out_degree[:, None]
+            linked = linked[:, None]
+        share = np.divide(pagerank, out_degree, out=np.zeros_like(pagerank), where=linked)
+        values = share[self.indices]
+
+        incoming = np.zeros_like(pagerank)
+        starts = self.indptr[:-1]
+        nonempty = starts < self.indptr[1:]
+        if values.size:
+            incoming[nonempty] = np.add.reduceat(values, starts[nonempty])
+        return incoming
+
+    def iterate(self, pagerank):
+        """Одна итерация степенного метода"""
+        N = len(self.doc_ids)
+        sink_pr = pagerank[self.dangling].sum()
+        return (1 - self.damping) / N + self.damping * (self.multiply(pagerank) + sink_pr / N)
+
+    def gauss_seidel_sweep(self, pagerank, num_blocks=config.PAGERANK_GS_BLOCKS):
+        """
+        Блочный Гаусс-Зейдель: узлы обновляются блоками по порядку, и каждый следующий
+        блок уже видит новые значения предыдущих (вектор меняется на месте)
+        """
+        N = len(self.doc_ids)
+        linked = ~self.dangling
+        share = np.divide(pagerank, self.out_degree, out=np.zeros_like(pagerank), where=linked)
+        sink_pr = pagerank[self.dangling].sum()
+
+        bounds = np.linspace(0, N, min(num_blocks, N) + 1).astype(np.int64)
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            lo, hi = self.indptr[a], self.indptr[b]
+            incoming = np.zeros(b - a)
+            if hi > lo:
+                starts = self.indptr[a:b] - lo
+                nonempty = self.indptr[a:b] < self.indptr[a + 1:b + 1]
+                incoming[nonempty] = np.add.reduceat(share[self.indices[lo:hi]], starts[nonempty])
+
+            block = (1 - self.damping) / N + self.damping * (incoming + sink_pr / N)
+            block_dangling = self.dangling[a:b]
+            sink_pr += (block - pagerank[a:b])[block_dangling].sum()
+            pagerank[a:b] = block
+            share[a:b] = np.where(block_dangling, 0.0, block / np.maximum(self.out_degree[a:b], 1))
+
+        # Сумма точного решения равна 1 - нормировка убирает медленно затухающую ошибку массы
+        return pagerank / pagerank.sum()
+
+    @staticmethod
+    def aitken(history):
+        """Покомпонентная дельта-квадрат экстраполяция Эйткена по трем последним итерациям"""
+        x0, x1, x2 = history[-3:]
+        denominator = x2 - 2 * x1 + x0
+        safe = np.abs(denominator) > 1e-15
+        result = x2.copy()
+        result[safe] -= (x2[safe] - x1[safe]) ** 2 / denominator[safe]
+        # Там, где экстраполяция дала неположительное значение, оставляем последнюю итерацию
+        return np.where(result > 0, result, x2)
+
+    @staticmethod
+    def quadratic(history):
+        """Квадратичная экстраполяция (Kamvar et al.) по четырем последним итерациям"""
+        x0, x1, x2, x3 = history[-4:]
+        Y = np.column_stack((x1 - x0, x2 - x0))
+        g1, g2 = np.linalg.lstsq(Y, -(x3 - x0), rcond=None)[0]
+        g3 = 1.0
+        return (g1 + g2 + g3) * x1 + (g2 + g3) * x2 + g3 * x3
+
+    def extrapolate(self, solver, history, diff):
+        """
+        Экстраполяция методом solver или None, если она не уменьшает остаток:
+        на графах, где ошибка не затухает по одному направлению, Эйткен только сбивает итерации.
+        Проверка стоит одной итерации на каждые PAGERANK_EXTRAPOLATION_PERIOD
+        """
+        extrapolated = getattr(self, solver)(history)
+        if not np.all(np.isfinite(extrapolated)) or extrapolated.min() < 0:
+            return None
+        extrapolated = extrapolated / extrapolated.sum()
+        if np.abs(self.iterate(extrapolated) - extrapolated).sum() >= diff:
+            return None
+        return extrapolated
+
+    def calculate_pagerank(self, iterations=config.MAX_ITERATIONS,
+                           solver=config.PAGERANK_SOLVER, stop=config.PAGERANK_STOP):
+        """
+        PageRank выбранным методом (SOLVERS) с той же L1-проверкой сходимости, что у MapReduce.
+        stop='topk' - дополнительно остановка, когда top-k документов перестал меняться
+        """
+        if solver not in SOLVERS:
+            raise ValueError(f"Неизвестный метод PageRank: {solver}")
+
+        self.load_graph()
+        N = len(self.doc_ids)
+        if N == 0:
+            return {}
+
+        pagerank = np.full(N, 1.0 / N)
+
+        print(f"Запуск PageRank через разреженные матрицы (CSR), метод {solver}...")
+
+        self.trace = ConvergenceTrace('sparse', solver)
+        stability = TopKStability() if stop == 'topk' else None
+        history = [pagerank]
+        depth = {'aitken': 3, 'quadratic': 4}.get(solver, 1)
+        stop_reason = 'max_iterations'
+
+        for i in range(iterations):
+            if solver == 'gauss_seidel':
+                new_pagerank = self.gauss_seidel_sweep(pagerank.copy())
+            else:
+                new_pagerank = self.iterate(pagerank)
+
+            # Проверка сходимости (L1, как в MapReduce)
+            diff = np.abs(new_pagerank - pagerank).sum()
+
+            pagerank = new_pagerank
+            history = (history + [pagerank])[-depth:]
+
+            self.trace.record(diff)
+            print(f"Итерация {i + 1}: максимальное изменение = {diff:.6f}")
+
+            if diff < config.TOLERANCE:
+                print(f"Сходимость достигнута на итерации {i + 1}")
+                stop_reason = 'tolerance'
+                break
+
+            if stability is not None and stability.update(pagerank):
+                print(f"Top-{stability.k} не меняется {stability.rounds} итераций - остановка на {i + 1}")
+                stop_reason = 'topk'
+                break
+
+            # Периодическая экстраполяция по накопленной истории
+            if depth > 1 and len(history) == depth and (i + 1) % config.PAGERANK_EXTRAPOLATION_PERIOD == 0:
+                extrapolated = self.extrapolate(solver, history, diff)
+                if extrapolated is not None:
+                    pagerank = extrapolated
+                    history = [pagerank]
+
+        self.trace.finish(stop_reason != 'max_iterations', stop_reason)
+        print(self.trace.summary())
+        return self.publish(pagerank, engine='sparse')
+
+    def publish(self, pagerank, engine):
+        """Публикация вектора вместе с подписями ссылок, возвращает {doc_id: score}"""
+        result = dict(zip(self.doc_ids.tolist(), pagerank.tolist()))
+        PageRankPublisher(self.db_path).publish(
+            result, engine=engine,
+            link_hashes=dict(zip(self.doc_ids.tolist(), self.link_hashes.tolist()))
+        )
+        return result
@@ -0,0 +1,133 @@
+import sqlite3
+import time
+from itertools import chain
+import numpy as np
+import config
+from database import bump_version_sqlite, PAGERANK_VERSION, PAGERANK_RUN
+
+
+def link_hash_sums(size, sources, target_ids, sums=None):
+    """
+    Накопление подписей исходящих ссылок (можно по блокам ребер):
+    sources - плотные индексы источников 0..size-1, target_ids - id документов целей
+    """
+    if sums is None:
+        sums = np.zeros(size, dtype=np.int64)
+    np.add.at(sums, sources, (np.asarray(target_ids, dtype=np.int64) * 2654435761) & 0xFFFFFFFF)
+    return sums
+
+
+def finish_link_hashes(sums, out_degree):
+    """Подписи множеств исходящих ссылок: не зависят от порядка ребер, учитывают степень"""
+    return sums * 1000003 + np.asarray(out_degree).astype(np.int64)
+
+
+def out_link_hashes(out_edges):
+    """
+    Подписи {doc_id: hash} по спискам исходящих ссылок {doc_id: [id целей]} (MapReduce, Pregel).
+    Ссылки на документы вне словаря не учитываются - как в CSR SparsePageRank
+    """
+    known = set(out_edges)
+    targets = {doc_id: [t for t in links if t in known] for doc_id, links in out_edges.items()}
+    degrees = np.array([len(links) for links in targets.values()], dtype=np.int64)
+    sources = np.repeat(np.arange(len(targets)), degrees)
+    target_ids = np.fromiter(chain.from_iterable(targets.values()), dtype=np.int64, count=int(degrees.sum()))
+    hashes = finish_link_hashes(link_hash_sums(len(targets), sources, target_ids), degrees)
+    return dict(zip(targets, hashes.tolist()))
+
+
+def load_current_snapshot(db_path):
+    """Текущий снимок PageRank {doc_id: (score, links_hash)} (пустой, если снимков нет)"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT doc_id, score, links_hash FROM pagerank_snapshots "
+        "WHERE run_id = (SELECT value FROM index_meta WHERE key = ?)",
+        (PAGERANK_RUN,)
+    )
+    snapshot = {doc_id: (score, links_hash) for doc_id, score, links_hash in cursor.fetchall()}
+    conn.close()
+    return snapshot
+
+
+class PageRankPublisher:
+    """
+    Публикация вектора PageRank как нового снимка в pagerank_snapshots.
+    Весь вектор пишется одним executemany, текущий снимок (index_meta.pagerank_run)
+    переключается в той же транзакции - читатели видят либо старый, либо новый
+    набор оценок целиком
+    """
+
+    def __init__(self, db_path, keep_runs=config.PAGERANK_KEEP_RUNS):
+        self.db_path = db_path
+        self.keep_runs = keep_runs
+
+    def publish(self, scores, engine, link_hashes=None):
+        """
+        Публикация {doc_id: score}, возвращает id нового запуска.
+        link_hashes - подписи исходящих ссылок {doc_id: hash} для инкрементального пересчета
+        """
+        link_hashes = link_hashes or {}
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(
+                "INSERT INTO pagerank_runs (engine, created_at) VALUES (?, ?)",
+                (engine, time.time())
+            )
+            run_id = cursor.lastrowid
+
+            cursor.executemany(
+                "INSERT INTO pagerank_snapshots (run_id, doc_id, score, links_hash) VALUES (?, ?, ?, ?)",
+                ((run_id, doc_id, score, link_hashes.get(doc_id)) for doc_id, score in scores.items())
+            )
+
+            # Атомарное переключение текущего снимка
+            cursor.execute(
+                "INSERT INTO index_meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (PAGERANK_RUN, run_id)
+            )
+            bump_version_sqlite(cursor, PAGERANK_VERSION)
+
+            # Старые снимки больше не нужны
+            cursor.execute(
+                "SELECT id FROM pagerank_runs ORDER BY id DESC LIMIT -1 OFFSET ?",
+                (self.keep_runs,)
+            )
+            old_runs = [(row[0],) for row in cursor.fetchall()]
+            cursor.executemany("DELETE FROM pagerank_snapshots WHERE run_id = ?", old_runs)
+            cursor.executemany("DELETE FROM pagerank_runs WHERE id = ?", old_runs)
+
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        print(f"PageRank опубликован: запуск {run_id} ({engine}, {len(scores)} документов)")
+        return run_id
+
+    def publish_topics(self, vectors):
+        """Замена всех векторов тем: {тема: (doc_ids int32, scores float32, значение для остальных)}"""
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("DELETE FROM topic_vectors")
+            cursor.executemany(
+                "INSERT INTO topic_vectors (topic, doc_ids, scores, default_score) VALUES (?, ?, ?, ?)",
+                ((topic, doc_ids.tobytes(), scores.tobytes(), default)
+                 for topic, (doc_ids, scores, default) in vectors.items())
+            )
+            bump_version_sqlite(cursor, PAGERANK_VERSION)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        print(f"Тематический PageRank опубликован: {len(vectors)} тем")
@@ -0,0 +1,164 @@
+import sqlite3
+import numpy as np
+import config
+from analyzer import ANALYZER
+from pagerank_convergence import ConvergenceTrace
+from pagerank_sparse import SparsePageRank
+from pagerank_store import PageRankPublisher
+
+
+class TopicPageRank:
+    """
+    Тематический (персонализированный) PageRank.
+    Для каждой темы - терма из словаря - телепортация идет только в документы с этим термом.
+    Все векторы считаются одновременно: матрица N x K умножается на CSR за одну итерацию
+    """
+
+    def __init__(self, db_path, topics=config.TOPIC_TERMS, num_topics=config.TOPIC_COUNT):
+        self.db_path = db_path
+        self.damping = config.DAMPING_FACTOR
+        self.topics = topics
+        self.num_topics = num_topics
+        self.graph = SparsePageRank(db_path)
+        self.trace = None
+
+    def select_topics(self, cursor):
+        """
+        Темы: самые частые термы, встречающиеся не более чем в TOPIC_MAX_DF доле документов.
+        При равной документной частоте выше терм с большим числом вхождений (он тематичнее),
+        затем - встреченный раньше, а не первый по алфавиту
+        """
+        if self.topics:
+            # Темы заданы словами - в индексе они хранятся основами
+            return list(dict.fromkeys(
+                term for terms in ANALYZER.analyze_many(self.topics) for term in terms))
+
+        N = len(self.graph.doc_ids)
+        cursor.execute(
+            "SELECT t.word, COUNT(*) AS df FROM document_term dt "
+            "JOIN terms t ON t.id = dt.term_id GROUP BY dt.term_id "
+            "HAVING df <= ? ORDER BY df DESC, SUM(dt.tf) DESC, dt.term_id LIMIT ?",
+            (max(1, int(N * config.TOPIC_MAX_DF)), self.num_topics)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def teleport_matrix(self, cursor, topics):
+        """Матрица телепортации N x K: равномерно по документам темы"""
+        N = len(self.graph.doc_ids)
+        teleport = np.zeros((N, len(topics)))
+        column = {topic: i for i, topic in enumerate(topics)}
+
+        placeholders = ', '.join('?' for _ in topics)
+        cursor.execute(
+            "SELECT t.word, dt.document_id FROM document_term dt "
+            f"JOIN terms t ON t.id = dt.term_id WHERE t.word IN ({placeholders})",
+            topics
+        )
+        for word, doc_id in cursor.fetchall():
+            row = np.searchsorted(self.graph.doc_ids, doc_id)
+            if row < N and self.graph.doc_ids[row] == doc_id:
+                teleport[row, column[word]] = 1.0
+
+        sizes = teleport.sum(axis=0)
+        keep = sizes > 0
+        return teleport[:, keep] / sizes[keep], [t for t, k in zip(topics, keep) if k]
+
+    def calculate(self, iterations=config.MAX_ITERATIONS):
+        """Вычисление и публикация векторов всех тем, возвращает {тема: {doc_id: score}}"""
+        self.graph.load_graph()
+        if len(self.graph.doc_ids) == 0:
+            return {}
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        topics = self.select_topics(cursor)
+        teleport, topics = self.teleport_matrix(cursor, topics) if topics else (None, [])
+        conn.close()
+        if not topics:
+            return {}
+
+        print(f"Запуск тематического PageRank: {len(topics)} тем")
+
+        graph = self.graph
+        pagerank = teleport.copy()
+        self.trace = ConvergenceTrace('topics', 'power')
+        stop_reason = 'max_iterations'
+        for i in range(iterations):
+            # Масса висячих узлов возвращается в телепортационное множество темы
+            sink_pr = pagerank[graph.dangling].sum(axis=0)
+            new_pagerank = (1 - self.damping) * teleport + \
+                self.damping * (graph.multiply(pagerank) + teleport * sink_pr)
+
+            diff = np.abs(new_pagerank - pagerank).sum(axis=0).max()
+            pagerank = new_pagerank
+
+            self.trace.record(diff, topics=len(topics))
+            print(f"Итерация {i + 1}: максимальное изменение = {diff:.6f}")
+
+            if diff < config.TOLERANCE:
+                print(f"Сходимость достигнута на итерации {i + 1}")
+                stop_reason = 'tolerance'
+                break
+
+        self.trace.finish(stop_reason == 'tolerance', stop_reason)
+
+        vectors = {
+            topic: self._compact(pagerank[:, column])
+            for column, topic in enumerate(topics)
+        }
+        PageRankPublisher(self.db_path).publish_topics(vectors)
+        return {
+            topic: dict(zip(doc_ids.tolist(), scores.tolist()))
+            for topic, (doc_ids, scores, _) in vectors.items()
+        }
+
+    def _compact(self, vector):
+        """
+        Top TOPIC_VECTOR_SIZE документов темы (float32) и значение для остальных -
+        минимум вектора: документы вне top не получают завышенного тематического PageRank
+        """
+        size = min(config.TOPIC_VECTOR_SIZE, len(vector))
+        top = np.argsort(-vector, kind='stable')[:size]
+        rest = np.delete(vector, top)
+        default = float(rest.min()) if rest.size else 0.0
+        return (self.graph.doc_ids[top].astype(np.int32),
+                vector[top].astype(np.float32), default)
+
+
+class TopicBlend:
+    """
+    PageRank для конкретного запроса: смесь глобального вектора и векторов тем,
+    совпавших с термами запроса (по dict-подобному интерфейсу get)
+    """
+
+    def __init__(self, global_pageranks, topic_vectors, weights, global_max, blend=config.TOPIC_BLEND):
+        self.global_pageranks = global_pageranks
+        self.topic_vectors = topic_vectors
+        self.weights = weights
+        self.global_max = global_max
+        self.blend = blend
+
+    @classmethod
+    def for_query(cls, global_pageranks, topic_vectors, query_terms, global_max):
+        """
+        Смесь для запроса или None, если ни один терм запроса не является темой.
+        global_max - максимум глобального PageRank (считается при загрузке индекса)
+        """
+        matched = [term for term in query_terms if term in topic_vectors]
+        if not matched:
+            return None
+        weights = {term: matched.count(term) / len(matched) for term in set(matched)}
+        return cls(global_pageranks, topic_vectors, weights, global_max)
+
+    def get(self, doc_id, default=0.0):
+        topic_pr = 0.0
+        for topic, weight in self.weights.items():
+            scores, rest, _ = self.topic_vectors[topic]
+            topic_pr += weight * scores.get(doc_id, rest)
+        global_pr = self.global_pageranks.get(doc_id, default)
+        return (1 - self.blend) * global_pr + self.blend * topic_pr
+
+    def max_value(self):
+        """Верхняя граница смешанного PageRank (для отсечения в WAND) по максимумам, посчитанным при загрузке"""
+        topic_max = sum(weight * self.topic_vectors[topic][2] for topic, weight in self.weights.items())
+        return (1 - self.blend) * self.global_max + self.blend * topic_max
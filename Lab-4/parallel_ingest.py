@@ -0,0 +1,136 @@
+import multiprocessing as mp
+import queue as queue_module
+import time
+import traceback
+from database import Database
+from parser import Parser
+import config
+
+# Парсер в процессе-обработчике (без БД - только разбор HTML)
+_worker_parser = None
+
+
+def _init_worker():
+    global _worker_parser
+    _worker_parser = Parser(None)
+
+
+def _parse_file(file_path):
+    """Разбор одного файла в процессе пула: ('ok', запись) или ('error', путь, сообщение)"""
+    try:
+        return ('ok', _worker_parser.read_document(file_path))
+    except Exception as e:
+        return ('error', file_path, str(e))
+
+
+def _writer(queue, result_queue, db_path, batch_size):
+    """
+    Единственный процесс, который пишет в БД: собирает записи в пакеты и сохраняет их.
+    Результат - ('ok', url сохраненных документов) или ('error', traceback)
+    """
+    try:
+        db = Database(db_path)
+        parser = Parser(db)
+        urls = []
+
+        batch = []
+        while True:
+            record = queue.get()
+            if record is not None:
+                batch.append(record)
+            if batch and (record is None or len(batch) >= batch_size):
+                urls.extend(doc.url for doc in parser._store_batch(batch))
+                batch = []
+            if record is None:
+                break
+
+        parser.flush_links()
+        parser.close_segments()
+        db.close()
+    except Exception:
+        result_queue.put(('error', traceback.format_exc()))
+        return
+    result_queue.put(('ok', urls))
+
+
+class ParallelIngest:
+    """
+    Параллельная индексация: HTML разбирается и токенизируется в пуле процессов,
+    компактные записи передаются через ограниченную очередь одному процессу-писателю,
+    который владеет сессией SQLAlchemy (SQLite остается с одним писателем)
+    """
+
+    def __init__(self, db_path, workers=config.INGEST_WORKERS,
+                 queue_size=config.INGEST_QUEUE_SIZE, batch_size=config.INGEST_BATCH_SIZE,
+                 poll_interval=config.INGEST_WRITER_POLL):
+        self.db_path = db_path
+        self.workers = workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+
+    def run(self, file_paths):
+        """Индексация файлов, возвращает url сохраненных документов"""
+        start_time = time.perf_counter()
+
+        queue = mp.Queue(maxsize=self.queue_size)
+        result_queue = mp.Queue()
+        writer = mp.Process(
+            target=_writer, args=(queue, result_queue, self.db_path, self.batch_size)
+        )
+        writer.start()
+
+        try:
+            # Выход из with при ошибке писателя останавливает пул (terminate)
+            with mp.Pool(self.workers, initializer=_init_worker) as pool:
+                for result in pool.imap_unordered(_parse_file, file_paths, chunksize=4):
+                    if result[0] == 'ok':
+                        # Блокируется, если писатель отстает - очередь ограничена
+                        self._put(queue, result[1], writer, result_queue)
+                    else:
+                        print(f"Ошибка при обработке {result[1]}: {result[2]}")
+            self._put(queue, None, writer, result_queue)
+            urls = self._result(writer, result_queue)
+        except BaseException:
+            # Не ждать при выходе, пока недоставленные записи уйдут в канал мертвого писателя
+            queue.cancel_join_thread()
+            if writer.is_alive():
+                writer.terminate()
+            writer.join()
+            raise
+        writer.join()
+
+        elapsed = time.perf_counter() - start_time
+        print(f"\n=== ИТОГИ ПАРСИНГА ===")
+        print(f"Обработано документов: {len(urls)} ({self.workers} процессов)")
+        if elapsed > 0:
+            print(f"Скорость: {len(urls) / elapsed:.1f} док/сек")
+
+        return urls
+
+    def _put(self, queue, record, writer, result_queue):
+        """Запись в очередь писателя с проверкой, что он жив, пока очередь заполнена"""
+        while True:
+            try:
+                queue.put(record, timeout=self.poll_interval)
+                return
+            except queue_module.Full:
+                if not writer.is_alive():
+                    # Ошибка писателя поднимется из _result
+                    self._result(writer, result_queue)
+                    raise RuntimeError("Процесс записи в БД завершился раньше, чем получил все документы")
+
+    def _result(self, writer, result_queue):
+        """Ожидание итога писателя: url сохраненных документов или RuntimeError с его ошибкой"""
+        while True:
+            # Жив ли писатель - до ожидания: после его выхода очередь читается еще раз
+            alive = writer.is_alive()
+            try:
+                status, value = result_queue.get(timeout=self.poll_interval)
+            except queue_module.Empty:
+                if not alive:
+                    raise RuntimeError(f"Процесс записи в БД завершился без результата (код {writer.exitcode})")
+                continue
+            if status == 'error':
+                raise RuntimeError(f"Ошибка в процессе записи в БД:\n{value}")
+            return value
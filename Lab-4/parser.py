@@ -1,14 +1,27 @@
 from bs4 import BeautifulSoup
+import hashlib
 import os
-import re
-from database import Document
+import time
+from collections import defaultdict
+from urllib.parse import urljoin, urldefrag, urlsplit, urlunsplit
+from analyzer import ANALYZER
+from database import Document, INDEX_VERSION, DOC_COUNT, TOTAL_LENGTH, ANALYZER_META, chunked
 from database import Link as DBLink
-
+from http_cache import load_aliases
+from segmented_index import SegmentWriter
+import config
 
 class Parser:
-    def __init__(self, db):
+    def __init__(self, db, analyzer=ANALYZER):
         self.db = db
-        self.stop_words = {'и', 'в', 'с', 'по', 'на', 'не', 'что', 'это', 'как', 'а', 'но', 'или'}
+        # Тот же анализатор, что и у поиска: термы индекса и запросов совпадают
+        self.analyzer = analyzer
+
+        # url -> id документа (загружается при первой записи) и ссылки, ждущие разрешения
+        self.url_ids = None
+        self.pending_links = []
+        # Писатель сегментов индекса (открывается при первой записи)
+        self.segments = None
 
     def extract_text(self, soup):
         """Извлечение чистого текста из HTML"""
@@ -30,90 +43,366 @@ class Parser:
                 links.append(href)
         return links
 
+    def extract_source_url(self, soup):
+        """Исходный url страницы: meta загрузчика, og:url или абсолютный canonical (None, если неизвестен)"""
+        candidates = (
+            (soup.find('meta', attrs={'name': config.SOURCE_URL_META}), 'content'),
+            (soup.find('meta', attrs={'property': 'og:url'}), 'content'),
+            (soup.find('link', rel='canonical'), 'href'),
+        )
+        for tag, attr in candidates:
+            url = tag.get(attr) if tag else None
+            if url and urlsplit(url.strip()).scheme in ('http', 'https'):
+                return self.normalize_url(url, '')
+        return None
+
+    def is_local_name(self, href):
+        """Ссылка на локальный файл, в которую загрузчик переписал ссылку своего домена"""
+        return href.endswith('.html') and '/' not in href and ':' not in href
+
+    def normalize_url(self, base_url, href):
+        """Абсолютный нормализованный url ссылки без фрагмента (None для не-http ссылок)"""
+        url, _ = urldefrag(urljoin(base_url, href.strip()))
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ('', 'http', 'https'):
+            return None
+
+        netloc = parts.netloc.lower()
+        if (scheme == 'http' and netloc.endswith(':80')) or \
+                (scheme == 'https' and netloc.endswith(':443')):
+            netloc = netloc.rsplit(':', 1)[0]
+        path = parts.path or ('/' if netloc else '')
+        return urlunsplit((scheme, netloc, path, parts.query, ''))
+
     def tokenize_text(self, text):
         """Токенизация текста"""
-        words = re.findall(r'\b[а-яa-z]{3,}\b', text.lower())
-        words = [word for word in words if word not in self.stop_words]
-        return words
+        return self.analyzer.analyze(text)
+
+    def tokenize_with_offsets(self, text):
+        """Токенизация со смещениями в исходном тексте: список (терм, начало, конец)"""
+        return self.analyzer.analyze_with_offsets(text)
+
+    def file_hash(self, data):
+        """Хэш содержимого файла"""
+        return hashlib.sha1(data).hexdigest()
+
+    def read_document(self, file_path):
+        """Чтение и разбор одного HTML файла без обращения к БД"""
+        mtime = os.path.getmtime(file_path)
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        html_content = data.decode('utf-8')
+
+        soup = BeautifulSoup(html_content, 'html.parser')
+
+        # Извлекаем заголовок
+        title = soup.title.string if soup.title else os.path.basename(file_path)
+        title = str(title) if title else None
+
+        source_url = self.extract_source_url(soup)
+
+        # Извлекаем текст
+        text = self.extract_text(soup)
+        links = self.extract_links(soup)
+
+        # Токенизируем текст и собираем позиции и смещения каждого слова
+        tokens = self.tokenize_with_offsets(text)
+        positions = defaultdict(list)
+        offsets = defaultdict(list)
+        for position, (word, start, end) in enumerate(tokens):
+            positions[word].append(position)
+            offsets[word].append((start, end))
+
+        return {
+            'url': os.path.basename(file_path),
+            'source_url': source_url,
+            'title': title,
+            'text': text,
+            'positions': dict(positions),
+            'offsets': dict(offsets),
+            'length': len(tokens),
+            'title_length': len(self.tokenize_text(title or '')),
+            'links': links,
+            'content_hash': self.file_hash(data),
+            'mtime': mtime,
+        }
+
+    def store_documents(self, records):
+        """
+        Запись пакета разобранных документов в БД одной транзакцией:
+        словарь пакета разрешается в id одним набором запросов,
+        вхождения вставляются через executemany
+        """
+        self._open_segments()
+        docs = self.db.get_or_create_documents(
+            [(r['url'], r['title'], r['text']) for r in records]
+        )
+        term_ids = self.db.get_or_create_terms(
+            word for r in records for word in r['positions']
+        )
+
+        postings = []
+        doc_count_delta = 0
+        length_delta = 0
+        for r in records:
+            doc = docs[r['url']]
+            # Для измененных файлов обновляем и сам документ
+            doc.title = r['title']
+            doc.content = r['text']
+            doc.source_url = r['source_url']
+            doc.content_hash = r['content_hash']
+            doc.mtime = r['mtime']
+            for word, word_positions in r['positions'].items():
+                postings.append((doc.id, term_ids[word], word_positions, r['offsets'][word]))
+
+            # Статистика документа для BM25 - чтобы поиск не токенизировал текст
+            count, length = self.db.set_document_stats(
+                doc, r['length'], len(r['positions']), r['title_length']
+            )
+            doc_count_delta += count
+            length_delta += length
+
+        self.db.replace_postings([docs[r['url']].id for r in records], postings)
+        self.db.add_meta(DOC_COUNT, doc_count_delta)
+        self.db.add_meta(TOTAL_LENGTH, length_delta)
+
+        batch_ids, batch_links = self._add_links(records, docs)
+
+        self.db.bump_version(INDEX_VERSION)
+        self.db.session.commit()
+
+        # Только после коммита: при откате пакета его id не должны попасть в ссылки
+        if self.url_ids is not None:
+            self.url_ids.update(batch_ids)
+        self.pending_links.extend(batch_links)
+
+        # Пакет становится виден поиску новым сегментом, без перестройки индекса
+        self._flush_segment([(docs[r['url']].id, r['length'], r['positions']) for r in records], [])
+        return [docs[r['url']] for r in records]
+
+    def _open_segments(self):
+        """Писатель сегментов - до изменения БД, пока версия индекса в манифесте совпадает с ней"""
+        if config.INDEX_SEGMENT and self.segments is None:
+            self.segments = SegmentWriter(self.db.db_path + config.INDEX_SEGMENT_SUFFIX)
+            self.segments.open(self.db)
+
+    def _flush_segment(self, documents, deleted_ids):
+        """Сброс закоммиченного пакета в новый сегмент индекса"""
+        if self.segments is not None:
+            self.segments.flush(documents, deleted_ids, self.db.get_versions()[0])
+
+    def close_segments(self):
+        """Ожидание фоновых слияний сегментов и закрытие писателя"""
+        if self.segments is not None:
+            self.segments.close()
+            self.segments = None
+
+    def _add_links(self, records, docs):
+        """
+        Исходящие ссылки документов пакета (без коммита): старые удаляются, новые
+        возвращаются вместе с url -> id пакета - store_documents добавляет их в pending_links
+        после коммита, а flush_links вставляет одним запросом
+        """
+        self.db.delete_outgoing_links([docs[r['url']].id for r in records])
+
+        batch_ids = {}
+        batch_links = []
+        for r in records:
+            source_id = docs[r['url']].id
+            batch_ids[r['url']] = source_id
+            if r['source_url']:
+                batch_ids[r['source_url']] = source_id
+            own_urls = (r['url'], r['source_url'])
+            targets = set()
+            for href in r['links']:
+                # Переписанные загрузчиком ссылки - имена файлов рядом, остальные - от исходного url
+                base_url = r['url'] if self.is_local_name(href) else (r['source_url'] or r['url'])
+                target_url = self.normalize_url(base_url, href)
+                if target_url and target_url not in own_urls and target_url not in targets:
+                    targets.add(target_url)
+                    batch_links.append((source_id, target_url))
+            print(f"\nОбработан: {r['url']} (ссылок: {len(targets)})")
+        return batch_ids, batch_links
+
+    def flush_links(self):
+        """
+        Разрешение накопленных ссылок через url -> id и вставка одним executemany.
+        Ссылки на еще не проиндексированные документы откладываются в deferred_links
+        """
+        if self.url_ids is None:
+            self.url_ids = self.db.get_url_ids()
+
+        pending = self.pending_links + self.db.pop_deferred_links()
+        self.pending_links = []
+
+        edges = set()
+        deferred = []
+        for source_id, target_url in pending:
+            target_id = self.url_ids.get(target_url)
+            if target_id is None:
+                deferred.append((source_id, target_url))
+            elif target_id != source_id:
+                edges.add((source_id, target_id))
+
+        self.db.insert_links(sorted(edges))
+        self.db.add_deferred_links(deferred)
+        self.db.session.commit()
+        print(f"Ссылок разрешено: {len(edges)}, отложено: {len(deferred)}")
 
     def parse_document(self, file_path):
         """Парсинг одного документа"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                html_content = f.read()
-
-            soup = BeautifulSoup(html_content, 'html.parser')
-
-            # Извлекаем заголовок
-            title = soup.title.string if soup.title else os.path.basename(file_path)
-
-            # Извлекаем текст
-            text = self.extract_text(soup)
-
-            # Получаем или создаем документ в БД
-            url = os.path.basename(file_path)
-            doc = self.db.get_or_create_document(url, title, text)
-
-            # Токенизируем текст
-            words = self.tokenize_text(text)
-            for word in words:
-                term = self.db.get_or_create_term(word)
-                if term not in doc.terms:
-                    doc.terms.append(term)
-
-            # СОЗДАЕМ ССЫЛКИ ВРУЧНУЮ МЕЖДУ ВСЕМИ ДОКУМЕНТАМИ
-            print(f"\nОбработан: {url}")
-
-            # Получаем ВСЕ документы из БД
-            all_docs = self.db.session.query(Document).all()
-            doc_map = {d.url: d for d in all_docs}
-
-            # Создаем простой граф ссылок
-            link_graph = {
-                'site1.html': ['site2.html', 'site3.html', 'site4.html'],
-                'site2.html': ['site1.html', 'site3.html'],
-                'site3.html': ['site1.html', 'site4.html'],
-                'site4.html': ['site1.html', 'site2.html'],
-            }
-
-            # Добавляем ссылки согласно графу
-            if url in link_graph:
-                for target_url in link_graph[url]:
-                    if target_url in doc_map:
-                        target_doc = doc_map[target_url]
-                        if target_doc.id != doc.id:  # Не ссылаемся на себя
-                            # Проверяем, нет ли уже такой ссылки
-                            existing = self.db.session.query(DBLink).filter_by(
-                                source_id=doc.id,
-                                target_id=target_doc.id
-                            ).first()
-
-                            if not existing:
-                                self.db.add_link(doc, target_doc)
-                                print(f"  ✓ Ссылка: {url} -> {target_url}")
-
-            self.db.session.commit()
+            record = self.read_document(file_path)
+            doc = self.store_documents([record])[0]
+            self.flush_links()
             return doc
 
         except Exception as e:
+            self.db.session.rollback()
             print(f"Ошибка при обработке {file_path}: {e}")
             return None
 
-    def parse_directory(self, directory):
-        """Парсинг всех документов в директории"""
+    def plan_directory(self, directory, force=False):
+        """
+        Определение изменений в директории относительно индекса.
+        Файлы с прежним mtime пропускаются без чтения, при новом mtime сравнивается хэш.
+        Возвращает (пути новых/измененных файлов, id документов удаленных файлов)
+        """
+        known = self.db.get_file_states()
+        changed = []
+        unchanged = 0
+
+        filenames = sorted(f for f in os.listdir(directory) if f.endswith('.html'))
+        for filename in filenames:
+            file_path = os.path.join(directory, filename)
+            state = known.get(filename)
+            if state is None or force:
+                changed.append(file_path)
+                continue
+
+            doc_id, mtime, content_hash = state
+            file_mtime = os.path.getmtime(file_path)
+            if mtime == file_mtime:
+                unchanged += 1
+                continue
+
+            # mtime изменился - сравниваем содержимое, BeautifulSoup не нужен
+            with open(file_path, 'rb') as f:
+                if self.file_hash(f.read()) == content_hash:
+                    self.db.session.query(Document).filter_by(id=doc_id).update({'mtime': file_mtime})
+                    unchanged += 1
+                    continue
+            changed.append(file_path)
+
+        present = set(filenames)
+        deleted = [state[0] for url, state in known.items() if url not in present]
+
+        self.db.session.commit()
+        print(f"Без изменений: {unchanged}, к индексации: {len(changed)}, удалено: {len(deleted)}")
+        return changed, deleted
+
+    def remove_documents(self, doc_ids):
+        """Удаление документов, файлы которых исчезли из директории"""
+        if not doc_ids:
+            return
+        self._open_segments()
+        self.db.delete_documents(doc_ids)
+        self.db.bump_version(INDEX_VERSION)
+        self.db.session.commit()
+        self.url_ids = None
+        self._flush_segment([], doc_ids)
+
+    def parse_directory(self, directory, batch_size=config.INGEST_BATCH_SIZE,
+                        workers=config.INGEST_WORKERS, force=False):
+        """
+        Инкрементальный пакетный парсинг директории: одна транзакция на batch_size документов.
+        Неизмененные файлы пропускаются, удаленные убираются из индекса.
+        При workers > 1 HTML разбирается в пуле процессов, а пишет в БД один процесс-писатель
+        """
+        # Дубликаты страниц, схлопнутые обходчиком: ссылки на них ведут к сохраненной копии
+        self.db.set_url_aliases(load_aliases(directory))
+        self.url_ids = None
+
+        # Термы, построенные другой версией анализатора, с запросами не совпадут
+        upgrade = self.db.get_meta(ANALYZER_META) != self.analyzer.version
+        if upgrade:
+            print("Анализатор текста изменился - переиндексация всех документов")
+
+        file_paths, deleted = self.plan_directory(directory, force or upgrade)
+        self.remove_documents(deleted)
+
+        if workers > 1:
+            # Сегменты пишет процесс-писатель - здесь писатель закрывается
+            self.close_segments()
+            parsed_docs = self._parse_files_parallel(file_paths, batch_size, workers)
+        else:
+            parsed_docs = self._parse_files(file_paths, batch_size)
+
+        if upgrade:
+            removed = self.db.delete_unused_terms()
+            self.db.set_meta(ANALYZER_META, self.analyzer.version)
+            self.db.session.commit()
+            print(f"Удалено термов прежнего анализатора: {removed}")
+        return parsed_docs
+
+    def _parse_files(self, file_paths, batch_size):
+        """Последовательный разбор файлов и запись пакетами"""
         parsed_docs = []
-        for filename in os.listdir(directory):
-            if filename.endswith('.html'):
-                file_path = os.path.join(directory, filename)
-                doc = self.parse_document(file_path)
-                if doc:
-                    parsed_docs.append(doc)
+        start_time = time.perf_counter()
+
+        batch = []
+        for file_path in file_paths:
+            try:
+                batch.append(self.read_document(file_path))
+            except Exception as e:
+                print(f"Ошибка при обработке {file_path}: {e}")
+                continue
+
+            if len(batch) >= batch_size:
+                parsed_docs.extend(self._store_batch(batch))
+                batch = []
+
+        if batch:
+            parsed_docs.extend(self._store_batch(batch))
+
+        # Все ссылки - одной вставкой в конце, когда известны id всех документов
+        self.flush_links()
+        self.close_segments()
+
+        elapsed = time.perf_counter() - start_time
 
         print(f"\n=== ИТОГИ ПАРСИНГА ===")
         print(f"Обработано документов: {len(parsed_docs)}")
+        if elapsed > 0:
+            print(f"Скорость: {len(parsed_docs) / elapsed:.1f} док/сек")
 
         # Выводим статистику ссылок
         total_links = self.db.session.query(DBLink).count()
         print(f"Создано ссылок: {total_links}")
 
-        return parsed_docs
\ No newline at end of file
+        return parsed_docs
+
+    def _parse_files_parallel(self, file_paths, batch_size, workers):
+        from parallel_ingest import ParallelIngest
+
+        ingest = ParallelIngest(self.db.db_path, workers=workers, batch_size=batch_size)
+        urls = ingest.run(file_paths)
+
+        # Писатель работал в другом процессе - сбрасываем состояние сессии
+        self.db.session.expire_all()
+        docs = []
+        for chunk in chunked(urls):
+            docs.extend(self.db.session.query(Document).filter(Document.url.in_(chunk)))
+
+        total_links = self.db.session.query(DBLink).count()
+        print(f"Создано ссылок: {total_links}")
+        return docs
+
+    def _store_batch(self, batch):
+        try:
+            return self.store_documents(batch)
+        except Exception as e:
+            self.db.session.rollback()
+            print(f"Ошибка при записи пакета из {len(batch)} документов: {e}")
+            return []
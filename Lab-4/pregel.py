@@ -0,0 +1,241 @@
+import multiprocessing as mp
+import zlib
+
+
+def partition_of(vertex_id, num_partitions):
+    """Хэш-разбиение вершин по разделам (одинаковое во всех процессах)"""
+    if isinstance(vertex_id, int):
+        return vertex_id % num_partitions
+    return zlib.crc32(str(vertex_id).encode('utf-8')) % num_partitions
+
+
+class Vertex:
+    """Вершина графа: значение, исходящие ребра и API для compute()"""
+
+    __slots__ = ('id', 'value', 'out_edges', 'halted', '_partition')
+
+    def __init__(self, vertex_id, value, out_edges, partition):
+        self.id = vertex_id
+        self.value = value
+        self.out_edges = out_edges
+        self.halted = False
+        self._partition = partition
+
+    @property
+    def superstep(self):
+        return self._partition.superstep
+
+    @property
+    def num_vertices(self):
+        return self._partition.num_vertices
+
+    def send_message(self, target, message):
+        self._partition.send(target, message)
+
+    def send_to_all_neighbors(self, message):
+        for target in self.out_edges:
+            self._partition.send(target, message)
+
+    def aggregate(self, name, value):
+        self._partition.aggregate(name, value)
+
+    def get_aggregated(self, name):
+        """Значение агрегатора за предыдущий супершаг (None, если никто не вносил вклад)"""
+        return self._partition.aggregated.get(name)
+
+    def vote_to_halt(self):
+        self.halted = True
+
+
+class Partition:
+    """Раздел графа: вершины одного обработчика и его исходящие сообщения"""
+
+    def __init__(self, compute, combiner, aggregators, num_partitions, num_vertices):
+        self.compute = compute
+        self.combiner = combiner
+        self.aggregators = aggregators
+        self.num_partitions = num_partitions
+        self.num_vertices = num_vertices
+        self.vertices = {}
+        self.superstep = 0
+        self.aggregated = {}
+        self.outboxes = None
+        self.partials = None
+
+    def load(self, vertices):
+        for vertex_id, value, out_edges in vertices:
+            self.vertices[vertex_id] = Vertex(vertex_id, value, out_edges, self)
+
+    def send(self, target, message):
+        outbox = self.outboxes[partition_of(target, self.num_partitions)]
+        if self.combiner is None:
+            outbox.setdefault(target, []).append(message)
+        elif target in outbox:
+            # Комбайнер применяется еще на стороне отправителя
+            outbox[target] = self.combiner(outbox[target], message)
+        else:
+            outbox[target] = message
+
+    def aggregate(self, name, value):
+        if name in self.partials:
+            self.partials[name] = self.aggregators[name](self.partials[name], value)
+        else:
+            self.partials[name] = value
+
+    def run_superstep(self, superstep, inbox, aggregated):
+        """
+        Выполнение compute() для активных вершин и вершин с сообщениями.
+        Возвращает (сообщения по разделам, частичные агрегаты, число активных вершин)
+        """
+        self.superstep = superstep
+        self.aggregated = aggregated
+        self.outboxes = [{} for _ in range(self.num_partitions)]
+        self.partials = {}
+
+        active = 0
+        for vertex in self.vertices.values():
+            messages = inbox.get(vertex.id)
+            if vertex.halted and messages is None:
+                continue
+            vertex.halted = False
+            self.compute(vertex, messages or [])
+            if not vertex.halted:
+                active += 1
+
+        return self.outboxes, self.partials, active
+
+    def values(self):
+        return {vertex_id: vertex.value for vertex_id, vertex in self.vertices.items()}
+
+
+def _partition_worker(conn, compute, combiner, aggregators, num_partitions, num_vertices):
+    """Процесс-обработчик одного раздела: выполняет команды главного процесса"""
+    partition = Partition(compute, combiner, aggregators, num_partitions, num_vertices)
+    while True:
+        command, args = conn.recv()
+        if command == 'load':
+            partition.load(args)
+        elif command == 'step':
+            conn.send(partition.run_superstep(*args))
+        elif command == 'values':
+            conn.send(partition.values())
+        elif command == 'stop':
+            break
+    conn.close()
+
+
+class Pregel:
+    """
+    Вершинно-ориентированный движок в стиле Pregel.
+    compute(vertex, messages) вызывается для каждой активной вершины на каждом супершаге,
+    сообщения объединяются комбайнером до доставки, агрегаторы сводятся между супершагами.
+    Вершины хэш-разбиты по num_workers процессам, между супершагами - барьер.
+    При num_workers == 1 все выполняется в текущем процессе
+    """
+
+    def __init__(self, compute, combiner=None, aggregators=None, num_workers=1):
+        self.compute = compute
+        self.combiner = combiner
+        self.aggregators = aggregators or {}
+        self.num_workers = max(1, num_workers)
+        self.superstep = 0
+        self.aggregated = {}
+        self.done = False
+        self.inboxes = None
+        self.partitions = None
+        self.connections = None
+        self.processes = None
+
+    def load(self, vertices):
+        """Загрузка вершин: итерируемое (id, начальное значение, список исходящих ребер)"""
+        vertices = list(vertices)
+        num_vertices = len(vertices)
+        parts = [[] for _ in range(self.num_workers)]
+        for vertex in vertices:
+            parts[partition_of(vertex[0], self.num_workers)].append(vertex)
+
+        args = (self.compute, self.combiner, self.aggregators, self.num_workers, num_vertices)
+        if self.num_workers == 1:
+            self.partitions = [Partition(*args)]
+            self.partitions[0].load(parts[0])
+        else:
+            self.connections = []
+            self.processes = []
+            for part in parts:
+                parent_conn, child_conn = mp.Pipe()
+                process = mp.Process(target=_partition_worker, args=(child_conn,) + args)
+                process.start()
+                child_conn.close()
+                parent_conn.send(('load', part))
+                self.connections.append(parent_conn)
+                self.processes.append(process)
+
+        self.inboxes = [{} for _ in range(self.num_workers)]
+        self.superstep = 0
+        self.aggregated = {}
+        self.done = False
+
+    def step(self):
+        """Один супершаг на всех разделах с барьером в конце; возвращает агрегаты супершага"""
+        if self.partitions is not None:
+            results = [self.partitions[0].run_superstep(
+                self.superstep, self.inboxes[0], self.aggregated)]
+        else:
+            for conn, inbox in zip(self.connections, self.inboxes):
+                conn.send(('step', (self.superstep, inbox, self.aggregated)))
+            # Барьер: ждем все разделы
+            results = [conn.recv() for conn in self.connections]
+
+        aggregated = {}
+        inboxes = [{} for _ in range(self.num_workers)]
+        active = 0
+        for outboxes, partials, partition_active in results:
+            active += partition_active
+            for name, value in partials.items():
+                if name in aggregated:
+                    aggregated[name] = self.aggregators[name](aggregated[name], value)
+                else:
+                    aggregated[name] = value
+            for target_partition, outbox in enumerate(outboxes):
+                self._deliver(inboxes[target_partition], outbox)
+
+        self.inboxes = inboxes
+        self.aggregated = aggregated
+        self.superstep += 1
+        self.done = active == 0 and not any(inboxes)
+        return aggregated
+
+    def _deliver(self, inbox, outbox):
+        """Слияние сообщений от разных разделов с применением комбайнера"""
+        for target, message in outbox.items():
+            if self.combiner is None:
+                inbox.setdefault(target, []).extend(message)
+            elif target in inbox:
+                inbox[target][0] = self.combiner(inbox[target][0], message)
+            else:
+                inbox[target] = [message]
+
+    def run(self, max_supersteps):
+        while not self.done and self.superstep < max_supersteps:
+            self.step()
+        return self.values()
+
+    def values(self):
+        """Значения всех вершин {id: value}"""
+        if self.partitions is not None:
+            return self.partitions[0].values()
+        result = {}
+        for conn in self.connections:
+            conn.send(('values', None))
+            result.update(conn.recv())
+        return result
+
+    def close(self):
+        if self.connections:
+            for conn, process in zip(self.connections, self.processes):
+                conn.send(('stop', None))
+                conn.close()
+                process.join()
+        self.connections = None
+        self.processes = None
+        self.partitions = None
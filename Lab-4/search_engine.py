@@ -1,222 +1,308 @@
-from database import Database
-import math
+from inverted_index import InvertedIndex
+from segmented_index import SegmentedIndex, manifest_stamp
+from wand import wand_top_k
+from boolean_query import boolean_top_k, parse_query
+from hybrid import hybrid_top_k, fuse_candidates
+from query_cache import QueryCache
+from pagerank_topics import TopicBlend
+from analyzer import ANALYZER, WORD_RE
+from sharded_index import ShardedIndex
+import config
+import copy
+import heapq
+import threading
 from collections import defaultdict
 
 
 class SearchEngine:
-    def __init__(self, db):
+    def __init__(self, db, shards=config.SEARCH_SHARDS, use_segment=config.INDEX_SEGMENT,
+                 analyzer=ANALYZER):
         self.db = db
-        self.doc_count = len(self.db.get_all_documents())
-        self.avg_doc_length = self._calculate_avg_doc_length()
-
-    def _calculate_avg_doc_length(self):
-        """Вычисление средней длины документа"""
-        total_length = 0
-        docs = self.db.get_all_documents()
-        for doc in docs:
-            if doc.content:
-                total_length += len(doc.content.split())
-        return total_length / self.doc_count if self.doc_count > 0 else 1
+        self.analyzer = analyzer
+        # Слияние сигналов гибридного поиска
+        self.fusion = config.HYBRID_FUSION
+        self.proximity_weight = config.HYBRID_PROXIMITY_WEIGHT
+        # Единый индекс читается из сегментов рядом с БД (через mmap), а не из таблиц БД
+        self.segment_dir = db.db_path + config.INDEX_SEGMENT_SUFFIX if use_segment else None
+        self.cache = QueryCache(config.QUERY_CACHE_SIZE, config.QUERY_CACHE_TTL)
+        self.versions = None
+        self.index = None
+        # При shards > 1 оценка идет в процессах шардов, self.index не строится
+        self.shards = ShardedIndex(db.db_path, shards) if shards > 1 else None
+        # Перестройка индекса - одним потоком, запросы продолжают работать со старым
+        self.refresh_lock = threading.Lock()
+        # Фоновая перестройка шардов (пока она идет, шарды отвечают по старым индексам)
+        self.shard_build = None
+
+        # Агрегаты коллекции читаются из БД, индекс строится при первом запросе
+        self.doc_count, total_length = self.db.get_corpus_stats()
+        self.avg_doc_length = total_length / self.doc_count if self.doc_count > 0 else 1
+
+    def _versions(self):
+        """
+        (версия индекса, версия PageRank); для сегментов версия индекса - отметка манифеста
+        и версия индекса в БД (изменение БД без новых сегментов тоже заметно при открытии)
+        """
+        versions = self.db.get_versions()
+        if self.segment_dir is None:
+            return versions
+        return (manifest_stamp(self.segment_dir), versions[0]), versions[1]
+
+    def _refresh(self):
+        """
+        Перестройка индекса и сброс кэша, если изменились версии индекса или PageRank.
+        Пока один поток открывает новый индекс, остальные отвечают по старому
+        """
+        versions = self._versions()
+        if versions == self.versions:
+            return
+
+        if not self.refresh_lock.acquire(blocking=self.versions is None):
+            return
+        try:
+            if versions == self.versions:
+                return
+
+            if self.shards is not None:
+                if self.versions is None:
+                    self._build_shards(versions)
+                elif self.versions[0] != versions[0]:
+                    # Индексация меняет версию часто - перестройка в фоне, без остановки поиска
+                    if self.shard_build is None or not self.shard_build.is_alive():
+                        self.shard_build = threading.Thread(
+                            target=self._rebuild_shards, args=(versions,), daemon=True)
+                        self.shard_build.start()
+                else:
+                    self.shards.reload_pageranks()
+                    self.versions = versions
+                    self.cache.clear()
+                return
+
+            if self.index is None or self.versions[0] != versions[0]:
+                index = self._open_index()
+            else:
+                # Новый PageRank - в копии индекса (списки вхождений общие), затем подмена
+                index = copy.copy(self.index)
+                index.reload_pageranks(self.db)
+
+            self.index = index
+            self.doc_count = index.doc_count
+            self.avg_doc_length = index.avg_doc_length
+            self.versions = versions
+            self.cache.clear()
+        finally:
+            self.refresh_lock.release()
+
+    def _build_shards(self, versions):
+        """Построение индексов шардов; версии и статистика подменяются после его завершения"""
+        self.shards.build()
+        self.doc_count = self.shards.doc_count
+        self.avg_doc_length = self.shards.avg_doc_length
+        self.versions = versions
+        self.cache.clear()
+
+    def _rebuild_shards(self, versions):
+        """Фоновая перестройка: при ошибке остаются прежние индексы, следующий запрос повторит ее"""
+        try:
+            self._build_shards(versions)
+        except Exception as e:
+            print(f"Ошибка перестройки шардов: {e}")
+
+    def _open_index(self):
+        """
+        Новый индекс: живые сегменты из манифеста (уже открытые не переоткрываются) или построение из БД.
+        Сегментов еще нет или они в старом формате - индекс строится из БД до их записи писателем
+        """
+        if self.segment_dir is None:
+            return InvertedIndex.build(self.db)
+        index = SegmentedIndex.open(self.segment_dir, self.db, self.index)
+        if index is None:
+            print(f"Сегменты {self.segment_dir} не созданы или в другом формате - индекс строится из БД")
+            index = InvertedIndex.build(self.db)
+        return index
 
     def document_at_a_time(self, query, k=5):
         """
         Document-at-a-time подход
-        Обрабатываем все документы одновременно для каждого терма запроса
+        Параллельно идем по спискам вхождений всех термов запроса (WAND),
+        пропуская документы, которые не могут попасть в top-k
         """
-        query_terms = self._tokenize_query(query)
-        scores = defaultdict(float)
-
-        # Получаем все документы
-        all_docs = self.db.get_all_documents()
-
-        # Для каждого документа вычисляем релевантность
-        for doc in all_docs:
-            if not doc.content:
-                continue
-
-            doc_score = 0
-            doc_terms = [term.word for term in doc.terms]
-            doc_length = len(doc.content.split())
-
-            for term in query_terms:
-                # TF (частота термина в документе)
-                tf = doc_terms.count(term)
-                if tf == 0:
-                    continue
-
-                # IDF (обратная частота документа)
-                term_docs = self.db.search_by_term(term)
-                idf = math.log((self.doc_count + 1) / (len(term_docs) + 0.5))
-
-                # BM25 scoring
-                k1 = 1.2
-                b = 0.75
-                tf_component = (tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (doc_length / self.avg_doc_length)))
-
-                doc_score += idf * tf_component
-
-            # Учитываем PageRank
-            final_score = doc_score * (1 + math.log1p(doc.pagerank))
-            scores[doc.id] = final_score
-
-        # Сортировка результатов
-        sorted_results = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
-
-        # Получаем документы
-        results = []
-        for doc_id, score in sorted_results:
-            doc = next((d for d in all_docs if d.id == doc_id), None)
-            if doc:
-                results.append({
-                    'title': doc.title,
-                    'url': doc.url,
-                    'score': score,
-                    'pagerank': doc.pagerank,
-                    'snippet': self._create_snippet(doc.content, query_terms)
-                })
-
-        return results
+        self._refresh()
+        parsed = self._parse_query(query)
+        if not parsed.is_plain():
+            return self._boolean_search(parsed, k)
+        query_terms = parsed.should
+        if self.shards is not None:
+            scores, pageranks = self.shards.top_k(query_terms, k, 'daat')
+            return self._build_results(scores, query_terms, k, pageranks)
+
+        pageranks = self._query_pageranks(query_terms)
+        scores = wand_top_k(self.index, query_terms, k, pageranks)
+        return self._build_results(scores, query_terms, k, pageranks)
 
     def term_at_a_time(self, query, k=5):
         """
         Term-at-a-time подход
-        Обрабатываем все документы для каждого терма по отдельности
+        Обрабатываем списки вхождений термов по отдельности, накапливая оценки
         """
-        query_terms = self._tokenize_query(query)
-        scores = defaultdict(float)
-
-        # Создаем инвертированный индекс
-        inverted_index = {}
-        for term in query_terms:
-            term_docs = self.db.search_by_term(term)
-            if term_docs:
-                inverted_index[term] = term_docs
-
-        # Для каждого терма вычисляем вклад в документы
-        for term, docs in inverted_index.items():
-            # IDF для терма
-            idf = math.log((self.doc_count + 1) / (len(docs) + 0.5))
-
-            for doc in docs:
-                # TF для документа
-                doc_terms = [t.word for t in doc.terms]
-                tf = doc_terms.count(term)
-
-                if tf > 0:
-                    doc_length = len(doc.content.split())
-
-                    # BM25 scoring для этого терма
-                    k1 = 1.2
-                    b = 0.75
-                    tf_component = (tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (doc_length / self.avg_doc_length)))
-
-                    # Добавляем вклад терма к документу
-                    scores[doc.id] += idf * tf_component
-
-        # Учитываем PageRank и сортируем
-        all_docs = self.db.get_all_documents()
-        for doc_id in scores:
-            doc = next((d for d in all_docs if d.id == doc_id), None)
-            if doc:
-                scores[doc_id] *= (1 + math.log1p(doc.pagerank))
-
-        sorted_results = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+        self._refresh()
+        parsed = self._parse_query(query)
+        if not parsed.is_plain():
+            return self._boolean_search(parsed, k)
+        query_terms = parsed.should
+        if self.shards is not None:
+            scores, pageranks = self.shards.top_k(query_terms, k, 'taat')
+            return self._build_results(scores, query_terms, k, pageranks)
+
+        pageranks = self._query_pageranks(query_terms)
+        scores = self.index.taat_scores(query_terms, pageranks)
+        return self._build_results(scores, query_terms, k, pageranks)
+
+    def _boolean_search(self, parsed, k):
+        """
+        Запрос с фразами, обязательными (+, AND) и исключенными (-, NOT) условиями:
+        пересечение списков с самого редкого терма, одинаково для daat и taat
+        """
+        query_terms = parsed.terms()
+        if self.shards is not None:
+            scores, pageranks = self.shards.top_k(parsed, k, 'boolean')
+            return self._build_results(scores, query_terms, k, pageranks)
+
+        pageranks = self._query_pageranks(query_terms)
+        scores = boolean_top_k(self.index, parsed, k, pageranks)
+        return self._build_results(scores, query_terms, k, pageranks)
+
+    def _parse_query(self, query):
+        return parse_query(query, self._tokenize_query)
+
+    def _query_pageranks(self, query_terms):
+        """PageRank запроса: смесь с тематическими векторами по термам запроса (None - глобальный)"""
+        return TopicBlend.for_query(self.index.pageranks, self.index.topic_vectors, query_terms,
+                                    self.index.max_pagerank)
+
+    def _build_results(self, scores, query_terms, k, pageranks=None):
+        """Выбор top-k и загрузка документов и смещений термов только для них"""
+        top = heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+        doc_ids = [doc_id for doc_id, _ in top]
+        docs = self.db.get_result_documents(doc_ids)
+        spans = self.db.get_term_offsets(doc_ids, set(query_terms))
 
-        # Формируем результаты
         results = []
-        for doc_id, score in sorted_results:
-            doc = next((d for d in all_docs if d.id == doc_id), None)
-            if doc:
+        for doc_id, score in top:
+            if doc_id in docs:
+                title, url, pagerank, content_length = docs[doc_id]
                 results.append({
-                    'title': doc.title,
-                    'url': doc.url,
+                    'title': title,
+                    'url': url,
                     'score': score,
-                    'pagerank': doc.pagerank,
-                    'snippet': self._create_snippet(doc.content, query_terms)
+                    'pagerank': (pageranks or self.index.pageranks).get(doc_id, pagerank),
+                    'snippet': self._create_snippet(doc_id, content_length, spans[doc_id], query_terms)
                 })
 
         return results
 
     def _tokenize_query(self, query):
-        """Токенизация запроса"""
-        import re
-        words = re.findall(r'\b[а-яa-z]{3,}\b', query.lower())
-        stop_words = {'и', 'в', 'с', 'по', 'на', 'не', 'что', 'это', 'как', 'а', 'но', 'или'}
-        return [word for word in words if word not in stop_words]
-
-    def _create_snippet(self, content, query_terms, max_length=150):
-        """Создание сниппета с выделением найденных терминов"""
-        if not content:
-            return ""
+        """Токенизация запроса тем же анализатором, что и при индексации"""
+        return self.analyzer.analyze(query)
+
+    def _best_window(self, spans, max_length):
+        """
+        Окно не длиннее max_length с наибольшим числом разных термов запроса,
+        при равенстве - с наибольшим числом вхождений (два указателя по отсортированным смещениям)
+        """
+        best = (0, 0, 0, 0)
+        counts = defaultdict(int)
+        j = 0
+        for i in range(len(spans)):
+            while j < len(spans) and spans[j][1] - spans[i][0] <= max_length:
+                counts[spans[j][2]] += 1
+                j += 1
+            if j > i and (len(counts), j - i) > best[:2]:
+                best = (len(counts), j - i, i, j)
+
+            # Левое вхождение выходит из окна
+            if j > i:
+                counts[spans[i][2]] -= 1
+                if not counts[spans[i][2]]:
+                    del counts[spans[i][2]]
+            else:
+                j = i + 1
+        return spans[best[2]][0], spans[max(best[3], best[2] + 1) - 1][1]
 
-        # Находим первое вхождение любого из терминов
-        content_lower = content.lower()
-        first_pos = len(content)
+    def _create_snippet(self, doc_id, content_length, spans, query_terms, max_length=150):
+        """
+        Создание сниппета по сохраненным смещениям термов: выбирается самое плотное окно,
+        из БД читается только оно, выделение - один проход по вхождениям внутри окна
+        """
+        if not content_length:
+            return ""
 
-        for term in query_terms:
-            pos = content_lower.find(term)
-            if pos != -1 and pos < first_pos:
-                first_pos = pos
+        start = 0
+        if spans:
+            first, last = self._best_window(spans, max_length)
+            # Вхождения в середине окна, но не больше 50 символов контекста слева (как раньше)
+            start = max(0, first - min(50, max(0, max_length - (last - first)) // 2))
+        end = min(content_length, start + max_length)
+        window = self.db.get_content_window(doc_id, start, end - start)
 
-        # Берем фрагмент вокруг найденного термина
-        start = max(0, first_pos - 50)
-        end = min(len(content), start + max_length)
+        if not spans:
+            # Индекс без смещений: находим термы только внутри окна
+            terms = set(query_terms)
+            spans = [(start + m.start(), start + m.end(), None) for m in WORD_RE.finditer(window)
+                     if self.analyzer.stem(m.group().lower()) in terms]
 
-        snippet = content[start:end]
+        # Выделяем термины запроса
+        parts = []
+        pos = start
+        for span_start, span_end, _ in spans:
+            if span_start < pos or span_end > end:
+                continue
+            parts.append(window[pos - start:span_start - start])
+            parts.append(f"**{window[span_start - start:span_end - start]}**")
+            pos = span_end
+        parts.append(window[pos - start:])
+        snippet = ''.join(parts)
 
         if start > 0:
             snippet = "..." + snippet
-        if end < len(content):
+        if end < content_length:
             snippet = snippet + "..."
 
-        # Выделяем термины запроса
-        for term in query_terms:
-            snippet = snippet.replace(term, f"**{term}**")
-            snippet = snippet.replace(term.capitalize(), f"**{term.capitalize()}**")
-
         return snippet
 
-    def hybrid_search(self, query, k=5, alpha=0.7):
+    def close(self):
+        """Остановка процессов шардов (после фоновой перестройки, если она идет)"""
+        if self.shard_build is not None:
+            self.shard_build.join()
+        if self.shards is not None:
+            self.shards.close()
+
+    def hybrid_search(self, query, k=5, bm25_weight=config.HYBRID_BM25_WEIGHT):
         """
-        Гибридный поиск: комбинация document-at-a-time и term-at-a-time
-        alpha - вес document-at-a-time подхода
+        Гибридный поиск за один проход: BM25 (вес bm25_weight), PageRank (вес 1 - bm25_weight)
+        и, если задан HYBRID_PROXIMITY_WEIGHT, близость термов сливаются в одну оценку
+        (min-max или reciprocal rank fusion, HYBRID_FUSION); сниппеты строятся только для top-k.
+        Булевы запросы сливаются так же, их условия только отбирают документы
         """
-        daat_results = self.document_at_a_time(query, k * 2)
-        taat_results = self.term_at_a_time(query, k * 2)
-
-        # Нормализуем scores
-        if daat_results:
-            max_daat = max(r['score'] for r in daat_results)
-            for r in daat_results:
-                r['normalized_score'] = r['score'] / max_daat if max_daat > 0 else 0
-
-        if taat_results:
-            max_taat = max(r['score'] for r in taat_results)
-            for r in taat_results:
-                r['normalized_score'] = r['score'] / max_taat if max_taat > 0 else 0
-
-        # Объединяем результаты
-        combined = {}
-        for r in daat_results:
-            combined[r['url']] = {
-                'data': r,
-                'score': r['normalized_score'] * alpha
-            }
-
-        for r in taat_results:
-            if r['url'] in combined:
-                combined[r['url']]['score'] += r['normalized_score'] * (1 - alpha)
-            else:
-                combined[r['url']] = {
-                    'data': r,
-                    'score': r['normalized_score'] * (1 - alpha)
-                }
-
-        # Сортируем по комбинированному score
-        sorted_results = sorted(
-            combined.items(),
-            key=lambda x: x[1]['score'],
-            reverse=True
-        )[:k]
-
-        return [item[1]['data'] for item in sorted_results]
\ No newline at end of file
+        self._refresh()
+        parsed = self._parse_query(query)
+        weights = (bm25_weight, 1 - bm25_weight, self.proximity_weight)
+        # Версии в ключе: результат, посчитанный параллельно с перестройкой, не переживет ее
+        key = (self.versions, parsed.key(), k, weights, self.fusion)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return [dict(r) for r in cached]
+
+        query_terms = parsed.terms()
+        if self.shards is not None:
+            # Шарды считают сигналы своих кандидатов с глобальной статистикой, слияние - здесь
+            candidates = self.shards.hybrid_candidates(parsed, k, weights, self.fusion)
+            scores = fuse_candidates(candidates, k, weights, self.fusion)
+            pageranks = {doc_id: signals[1] for _, doc_id, signals in candidates}
+        else:
+            pageranks = self._query_pageranks(query_terms)
+            scores = hybrid_top_k(self.index, parsed, k, pageranks, weights, self.fusion)
+        results = self._build_results(scores, query_terms, k, pageranks)
+
+        self.cache.put(key, results)
+        return [dict(r) for r in results]
\ No newline at end of file
@@ -0,0 +1,175 @@
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from database import Database
+from search_engine import SearchEngine
+import config
+
+
+class LatencyHistogram:
+    """Гистограмма задержек по меткам (режим поиска, код ответа) с кумулятивными корзинами"""
+
+    def __init__(self, buckets=config.SERVER_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, seconds):
+        with self.lock:
+            counts, total = self.series.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, seconds)] += 1
+            self.series[labels] = (counts, total + seconds)
+
+    def render(self, name):
+        """Текстовый формат Prometheus"""
+        lines = [f"# TYPE {name} histogram"]
+        with self.lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self.series.items()}
+        for (mode, status), (counts, total) in sorted(series.items()):
+            labels = f'mode="{mode}",status="{status}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {total}')
+            lines.append(f'{name}_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """
+    GET /search?q=...&mode=hybrid|daat|taat&k=5&bm25_weight=0.7 - JSON с результатами,
+    bm25_weight - вес BM25 в гибриде (PageRank получает 1 - bm25_weight). Прежний alpha
+    смешивал две одинаковые оценки DAAT и TAAT и на ранжирование не влиял - он принимается и игнорируется.
+    GET /metrics - гистограммы задержек и статистика кэша, GET /health - проверка живости
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/search':
+            self.handle_search(parse_qs(url.query))
+        elif url.path == '/metrics':
+            self.send_text(200, self.server.render_metrics())
+        elif url.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def handle_search(self, params):
+        start = time.perf_counter()
+        mode = params.get('mode', ['hybrid'])[0]
+        status = 200
+        try:
+            query = params.get('q', [''])[0]
+            k = int(params.get('k', ['5'])[0])
+            bm25_weight = float(params.get('bm25_weight', [config.HYBRID_BM25_WEIGHT])[0])
+            # Сравнение цепочкой отбрасывает и nan/inf: с ними слитые оценки гибрида - nan
+            if not query or mode not in self.server.modes or not 0 < k <= 100 or not 0 <= bm25_weight <= 1:
+                status = 400
+                self.send_json(status, {'error': 'нужны q, mode из hybrid/daat/taat, 0 < k <= 100 и 0 <= bm25_weight <= 1'})
+                return
+
+            results = self.server.search(mode, query, k, bm25_weight)
+            self.send_json(status, {
+                'query': query,
+                'mode': mode,
+                'k': k,
+                'took_ms': (time.perf_counter() - start) * 1000,
+                'results': results,
+            })
+        except ValueError:
+            status = 400
+            self.send_json(status, {'error': 'k и bm25_weight должны быть числами'})
+        except Exception as e:
+            status = 500
+            traceback.print_exc()
+            self.send_json(status, {'error': str(e)})
+        finally:
+            self.server.engine.db.release()
+            self.server.latency.observe((mode if mode in self.server.modes else 'invalid', status),
+                                        time.perf_counter() - start)
+
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                       'application/json; charset=utf-8')
+
+    def send_text(self, status, text):
+        self.send_body(status, text.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SearchServer(ThreadingHTTPServer):
+    """Многопоточный HTTP-сервер поиска: один SearchEngine на все потоки, БД только на чтение"""
+
+    daemon_threads = True
+
+    def __init__(self, host=config.SERVER_HOST, port=config.SERVER_PORT, db_path=None):
+        # БД на чтение открывается без create_all: без готового индекса сервер не запускается
+        db_path = db_path or config.DB_PATH
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"БД поиска не найдена: {db_path} - сначала проиндексируйте документы (main.py)")
+        db = Database(db_path, read_only=True)
+        if not db.has_tables('documents', 'index_meta'):
+            db.close()
+            raise RuntimeError(f"В БД {db_path} нет таблиц индекса - сначала проиндексируйте документы (main.py)")
+
+        super().__init__((host, port), SearchHandler)
+        self.engine = SearchEngine(db)
+        self.modes = {
+            'hybrid': lambda query, k, bm25_weight: self.engine.hybrid_search(query, k, bm25_weight),
+            'daat': lambda query, k, bm25_weight: self.engine.document_at_a_time(query, k),
+            'taat': lambda query, k, bm25_weight: self.engine.term_at_a_time(query, k),
+        }
+        self.latency = LatencyHistogram()
+
+    def search(self, mode, query, k, bm25_weight):
+        return self.modes[mode](query, k, bm25_weight)
+
+    def render_metrics(self):
+        stats = self.engine.cache.stats()
+        lines = [self.latency.render('search_request_duration_seconds')]
+        for key in ('size', 'hits', 'misses'):
+            lines.append(f"# TYPE search_cache_{key} gauge\nsearch_cache_{key} {stats[key]}\n")
+        return ''.join(lines)
+
+    def server_close(self):
+        super().server_close()
+        self.engine.close()
+        self.engine.db.close()
+
+
+def serve(host=config.SERVER_HOST, port=config.SERVER_PORT, db_path=None):
+    try:
+        server = SearchServer(host, port, db_path)
+    except (FileNotFoundError, RuntimeError) as e:
+        sys.exit(f"Сервер не запущен: {e}")
+    print(f"Сервер поиска: http://{host}:{server.server_address[1]}/search?q=...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve(port=int(sys.argv[1]) if len(sys.argv) > 1 else config.SERVER_PORT)
@@ -0,0 +1,462 @@
+import math
+import mmap
+import os
+import struct
+from bisect import bisect_left
+from array import array
+from collections.abc import Mapping
+from database import Document
+from inverted_index import InvertedIndex
+import config
+
+# Заголовок: магия, версия формата, шаг пропусков, версия индекса, число документов,
+# суммарная длина, число термов, минимальный и максимальный id документа,
+# смещения словаря, строк и документов
+HEADER = struct.Struct('<4sIIQQQIIIQQQ')
+MAGIC = b'PSEG'
+# 3: у вхождения хранится число позиций (у строк старой схемы без позиций оно 0, а tf - 1)
+FORMAT_VERSION = 3
+
+# Запись словаря: смещение и длина строки терма, смещение блока вхождений, df,
+# байт в потоке документов и в потоке позиций, максимальный tf и минимальная длина документа
+TERM = struct.Struct('<IIQIIIII')
+
+# Пропуск: последний id документа блока, смещения блока в потоках документов и позиций
+SKIP = struct.Struct('<III')
+
+
+def encode_varbyte(values, out):
+    """Переменная длина: по 7 бит в байте, старший бит - продолжение"""
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def decode_varbyte(buf, pos, count):
+    """Декодирование count чисел с позиции pos, возвращает (список, новая позиция)"""
+    values = []
+    for _ in range(count):
+        value = 0
+        shift = 0
+        byte = buf[pos]
+        pos += 1
+        while byte >= 0x80:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            byte = buf[pos]
+            pos += 1
+        values.append(value | (byte << shift))
+    return values, pos
+
+
+def write_postings(path, term_postings, lengths, index_version,
+                   skip_interval=config.SEGMENT_SKIP_INTERVAL):
+    """
+    Запись сегмента потоково по термам.
+    term_postings - (слово, id документов по возрастанию, tf, позиции) для каждого терма,
+    lengths - {doc_id: длина} всех документов сегмента (может дополняться, пока идут термы).
+    Блок терма: таблица пропусков, поток документов (varbyte разности id, tf и число позиций),
+    поток позиций (varbyte разности позиций). Файл пишется во временный и подменяется целиком
+    """
+    terms = []
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(bytes(HEADER.size))
+
+        def flush_term(word, doc_ids, tfs, positions):
+            if not doc_ids:
+                return
+            docs = bytearray()
+            pos_bytes = bytearray()
+            skips = bytearray()
+            previous = 0
+            for i, (doc_id, tf, doc_positions) in enumerate(zip(doc_ids, tfs, positions)):
+                encode_varbyte((doc_id - previous, tf, len(doc_positions)), docs)
+                last = 0
+                gaps = []
+                for p in doc_positions:
+                    gaps.append(p - last)
+                    last = p
+                encode_varbyte(gaps, pos_bytes)
+                previous = doc_id
+                if (i + 1) % skip_interval == 0 or i + 1 == len(doc_ids):
+                    skips += SKIP.pack(doc_id, len(docs), len(pos_bytes))
+
+            terms.append((word, f.tell(), len(doc_ids), len(docs), len(pos_bytes),
+                          max(tfs), min(lengths[d] for d in doc_ids)))
+            f.write(skips)
+            f.write(docs)
+            f.write(pos_bytes)
+
+        for word, doc_ids, tfs, positions in term_postings:
+            flush_term(word, doc_ids, tfs, positions)
+
+        # Словарь отсортирован по байтам UTF-8 (тот же порядок, что у строк Python)
+        terms.sort(key=lambda t: t[0].encode('utf-8'))
+        strings = bytearray()
+        dictionary = bytearray()
+        for word, offset, df, doc_bytes, pos_bytes, max_tf, min_length in terms:
+            encoded = word.encode('utf-8')
+            dictionary += TERM.pack(len(strings), len(encoded), offset, df, doc_bytes, pos_bytes,
+                                    max_tf, min_length)
+            strings += encoded
+
+        dict_offset = f.tell()
+        f.write(dictionary)
+        strings_offset = f.tell()
+        f.write(strings)
+
+        # Длины документов по id от min_doc_id (+1, 0 - документа нет)
+        docs_offset = f.tell()
+        min_doc_id = min(lengths, default=0)
+        max_doc_id = max(lengths, default=0)
+        doc_table = array('I', bytes(4 * (max_doc_id - min_doc_id + 1)))
+        for doc_id, length in lengths.items():
+            doc_table[doc_id - min_doc_id] = length + 1
+        f.write(doc_table.tobytes())
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, skip_interval, index_version, len(lengths),
+                            sum(lengths.values()), len(terms), min_doc_id, max_doc_id,
+                            dict_offset, strings_offset, docs_offset))
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def write_segment(db, path, index_version, skip_interval=config.SEGMENT_SKIP_INTERVAL):
+    """Выгрузка всего индекса из таблиц БД в файл сегмента"""
+    lengths = {}
+    missing_lengths = set()
+    for doc_id, length in db.session.query(Document.id, Document.length):
+        lengths[doc_id] = length or 0
+        if length is None:
+            missing_lengths.add(doc_id)
+
+    def term_postings():
+        current_word = None
+        doc_ids, tfs, positions = [], [], []
+        for word, doc_id, tf, doc_positions in db.get_posting_rows():
+            if doc_id not in lengths:
+                continue
+            tf = tf or 1
+            if doc_id in missing_lengths:
+                # Документы из старой схемы без статистики: длина = сумма tf
+                lengths[doc_id] += tf
+            if word != current_word:
+                if doc_ids:
+                    yield current_word, doc_ids, tfs, positions
+                current_word = word
+                doc_ids, tfs, positions = [], [], []
+            elif doc_ids and doc_ids[-1] == doc_id:
+                # Дубликаты пар (документ, терм) из старой схемы БД
+                continue
+            doc_ids.append(doc_id)
+            tfs.append(tf)
+            positions.append([int(p) for p in doc_positions.split()] if doc_positions else [])
+        if doc_ids:
+            yield current_word, doc_ids, tfs, positions
+
+    return write_postings(path, term_postings(), lengths, index_version, skip_interval)
+
+
+def read_header(path):
+    """Заголовок сегмента или None, если файла нет или формат другой"""
+    try:
+        with open(path, 'rb') as f:
+            header = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    if header[0] != MAGIC or header[1] != FORMAT_VERSION:
+        return None
+    return header
+
+
+def _split_positions(values, counts):
+    """Позиции документов из общего потока разностей: по counts[i] значений на документ"""
+    positions = []
+    start = 0
+    for count in counts:
+        doc_positions = []
+        last = 0
+        for gap in values[start:start + count]:
+            last += gap
+            doc_positions.append(last)
+        positions.append(doc_positions)
+        start += count
+    return positions
+
+
+class Segment:
+    """Сегмент, открытый через mmap: словарь и длины документов читаются прямо из отображения"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, format_version, self.skip_interval, self.index_version, self.doc_count, self.total_length,
+         self.term_count, self.min_doc_id, self.max_doc_id, dict_offset, strings_offset,
+         docs_offset) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            self.mm.close()
+            raise ValueError(f"Сегмент {path} другого формата ({format_version}, нужен {FORMAT_VERSION})")
+
+        self.view = memoryview(self.mm)
+        self.dict_offset = dict_offset
+        self.strings = self.view[strings_offset:docs_offset]
+        self.lengths = self.view[
+            docs_offset:docs_offset + 4 * (self.max_doc_id - self.min_doc_id + 1)].cast('I')
+
+    def entry(self, i):
+        return TERM.unpack_from(self.mm, self.dict_offset + i * TERM.size)
+
+    def word(self, i):
+        string_offset, string_length = self.entry(i)[:2]
+        return bytes(self.strings[string_offset:string_offset + string_length])
+
+    def lookup(self, term):
+        """Запись словаря для терма (двоичный поиск по отображению) или None"""
+        key = term.encode('utf-8')
+        lo, hi = 0, self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.word(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.term_count and self.word(lo) == key:
+            return TermInfo(self, *self.entry(lo)[2:])
+        return None
+
+    def terms(self):
+        for i in range(self.term_count):
+            yield self.word(i).decode('utf-8')
+
+    def doc_length(self, doc_id):
+        """Длина документа или None, если его нет в сегменте"""
+        i = doc_id - self.min_doc_id
+        if 0 <= i < len(self.lengths) and self.lengths[i]:
+            return self.lengths[i] - 1
+        return None
+
+    def doc_ids(self):
+        return (self.min_doc_id + i for i, value in enumerate(self.lengths) if value)
+
+    def postings(self, info):
+        """Список терма целиком: (id документов, tf, позиции) - для слияния сегментов"""
+        values, _ = decode_varbyte(self.mm, info.docs_start, 3 * info.df)
+        counts = values[2::3]
+        flat, _ = decode_varbyte(self.mm, info.pos_start, sum(counts))
+        doc_ids = []
+        previous = 0
+        for gap in values[0::3]:
+            previous += gap
+            doc_ids.append(previous)
+        return doc_ids, values[1::3], _split_positions(flat, counts)
+
+    def close(self):
+        """Закрытие отображения (курсоры и списки сегмента после этого недействительны)"""
+        self.lengths.release()
+        self.strings.release()
+        self.view.release()
+        self.mm.close()
+
+
+class TermInfo:
+    """Расположение списка терма в сегменте"""
+
+    __slots__ = ('segment', 'offset', 'df', 'doc_bytes', 'pos_bytes', 'max_tf', 'min_length',
+                 'skip_count', 'docs_start', 'pos_start')
+
+    def __init__(self, segment, offset, df, doc_bytes, pos_bytes, max_tf, min_length):
+        self.segment = segment
+        self.offset = offset
+        self.df = df
+        self.doc_bytes = doc_bytes
+        self.pos_bytes = pos_bytes
+        self.max_tf = max_tf
+        self.min_length = min_length
+        self.skip_count = -(-df // segment.skip_interval)
+        self.docs_start = offset + self.skip_count * SKIP.size
+        self.pos_start = self.docs_start + doc_bytes
+
+    def skip(self, block):
+        """(последний id блока, смещение в потоке документов, смещение в потоке позиций) конца блока"""
+        return SKIP.unpack_from(self.segment.mm, self.offset + block * SKIP.size)
+
+
+class SegmentCursor:
+    """
+    Курсор по списку терма в сегменте с тем же интерфейсом, что PostingCursor.
+    Декодируется по одному блоку (skip_interval вхождений), next_geq выбирает блок
+    двоичным поиском по таблице пропусков
+    """
+
+    END = float('inf')
+
+    __slots__ = ('info', 'term', 'idf', 'upper_bound', 'block', 'i',
+                 'doc_ids', 'tfs', 'counts', 'block_positions', 'pos_offset')
+
+    def __init__(self, info, term=None, idf=0.0, upper_bound=0.0):
+        self.info = info
+        self.term = term
+        self.idf = idf
+        self.upper_bound = upper_bound
+        self.block = -1
+        self._load_block(0)
+
+    def _load_block(self, block):
+        """Декодирование блока: id документов и tf, позиции - при первом обращении"""
+        info = self.info
+        self.block = block
+        self.i = 0
+        if block >= info.skip_count:
+            self.doc_ids, self.tfs, self.counts = [], [], []
+            return
+
+        if block == 0:
+            previous, doc_offset, pos_offset = 0, 0, 0
+        else:
+            previous, doc_offset, pos_offset = info.skip(block - 1)
+        count = min(info.segment.skip_interval, info.df - block * info.segment.skip_interval)
+        values, _ = decode_varbyte(info.segment.mm, info.docs_start + doc_offset, 3 * count)
+
+        doc_ids = []
+        for gap in values[0::3]:
+            previous += gap
+            doc_ids.append(previous)
+        self.doc_ids = doc_ids
+        self.tfs = values[1::3]
+        self.counts = values[2::3]
+        self.block_positions = None
+        self.pos_offset = pos_offset
+
+    @property
+    def doc(self):
+        if self.i < len(self.doc_ids):
+            return self.doc_ids[self.i]
+        return self.END
+
+    def tf(self):
+        return self.tfs[self.i]
+
+    def positions(self):
+        if self.block_positions is None:
+            # Позиции всего блока: разности внутри каждого документа
+            values, _ = decode_varbyte(self.info.segment.mm, self.info.pos_start + self.pos_offset,
+                                       sum(self.counts))
+            self.block_positions = _split_positions(values, self.counts)
+        return self.block_positions[self.i]
+
+    def next(self):
+        self.i += 1
+        if self.i >= len(self.doc_ids) and self.block < self.info.skip_count:
+            self._load_block(self.block + 1)
+
+    def next_geq(self, target):
+        """Переход к первому документу с id >= target"""
+        if self.doc >= target:
+            return
+        info = self.info
+        if self.doc_ids[-1] < target:
+            # Первый блок, последний документ которого >= target
+            lo, hi = self.block + 1, info.skip_count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if info.skip(mid)[0] < target:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            self._load_block(lo)
+            if lo >= info.skip_count:
+                return
+        self.i = bisect_left(self.doc_ids, target, self.i)
+
+
+class SegmentPostingList:
+    """Список терма целиком (doc_ids и tfs) - для term-at-a-time"""
+
+    __slots__ = ('doc_ids', 'tfs')
+
+    def __init__(self, info):
+        values, _ = decode_varbyte(info.segment.mm, info.docs_start, 3 * info.df)
+        doc_ids = array('i')
+        previous = 0
+        for gap in values[0::3]:
+            previous += gap
+            doc_ids.append(previous)
+        self.doc_ids = doc_ids
+        self.tfs = array('i', values[1::3])
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+
+class DocLengths(Mapping):
+    """Длины документов по id прямо из отображения сегмента"""
+
+    def __init__(self, segment):
+        self.segment = segment
+
+    def __getitem__(self, doc_id):
+        length = self.segment.doc_length(doc_id)
+        if length is None:
+            raise KeyError(doc_id)
+        return length
+
+    def __iter__(self):
+        return self.segment.doc_ids()
+
+    def __len__(self):
+        return self.segment.doc_count
+
+
+class SegmentIndex(InvertedIndex):
+    """
+    Индекс поверх файла сегмента: списки вхождений не загружаются в память,
+    курсоры и словарь читают отображение напрямую. PageRank - из БД, как у InvertedIndex
+    """
+
+    def __init__(self, segment):
+        super().__init__()
+        self.segment = segment
+        self.doc_lengths = DocLengths(segment)
+        self.set_corpus_stats(segment.doc_count, segment.total_length)
+
+    @classmethod
+    def open(cls, path, db):
+        index = cls(Segment(path))
+        index._load_pageranks(db)
+        index._compute_upper_bounds()
+        return index
+
+    def _compute_upper_bounds(self):
+        """Верхние оценки термов считаются при открытии курсора, здесь - только множитель PageRank"""
+        if self.pageranks:
+            self.max_boost = max(self.pagerank_boost(doc_id) for doc_id in self.pageranks)
+
+    def term_upper_bound(self, info, idf):
+        """BM25 при максимальном tf и минимальной длине документа терма - не меньше любой оценки"""
+        norm = self.K1 * (1 - self.B + self.B * (info.min_length / self.avg_doc_length))
+        return idf * (info.max_tf * (self.K1 + 1)) / (info.max_tf + norm)
+
+    def cursor(self, term):
+        info = self.segment.lookup(term)
+        if info is None:
+            return None
+        idf = self._idf(term, info.df)
+        return SegmentCursor(info, term, idf, self.term_upper_bound(info, idf))
+
+    def get_postings(self, term):
+        info = self.segment.lookup(term)
+        return SegmentPostingList(info) if info is not None else None
+
+    def idf(self, term):
+        info = self.segment.lookup(term)
+        return self._idf(term, info.df) if info is not None else 0.0
+
+    def _idf(self, term, df):
+        if self.global_df:
+            df = self.global_df.get(term, df)
+        return math.log((self.doc_count + 1) / (df + 0.5))
@@ -0,0 +1,512 @@
+import heapq
+import json
+import math
+import os
+import threading
+import time
+from collections.abc import Mapping
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from itertools import groupby, repeat
+from array import array
+from database import Document
+from inverted_index import InvertedIndex
+from segment import Segment, SegmentCursor, SegmentIndex, write_postings, write_segment, FORMAT_VERSION
+import config
+
+MANIFEST = 'manifest.json'
+WRITER_LOCK = 'writer.lock'
+
+
+def read_manifest(directory):
+    """
+    Манифест директории сегментов или None, если индекс еще не создан:
+    {'generation', 'index_version', 'format', 'next_segment', 'segments': [{'name', 'deleted'}]}
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(directory, manifest):
+    """Атомарная публикация манифеста: читатели видят либо старый, либо новый набор сегментов"""
+    path = os.path.join(directory, MANIFEST)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def manifest_stamp(directory):
+    """Отметка текущего манифеста (меняется при каждой публикации) или None"""
+    try:
+        stat = os.stat(os.path.join(directory, MANIFEST))
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def lock_writer(directory):
+    """
+    Эксклюзивная блокировка директории сегментов на время жизни писателя: перестройка
+    из БД, удаление файлов вне манифеста и публикация манифеста идут только у одного процесса.
+    Блокировку снимает ОС при завершении процесса, поэтому сбой писателя ее не оставляет
+    """
+    f = open(os.path.join(directory, WRITER_LOCK), 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        raise RuntimeError(f"Сегменты {directory} уже открыты другим писателем")
+    return f
+
+
+def segment_name(number):
+    return f'{number:06d}.seg'
+
+
+def build_segments(db, directory, manifest=None):
+    """Индекс из таблиц БД одним сегментом - для новой директории или после расхождения с БД"""
+    os.makedirs(directory, exist_ok=True)
+    index_version = db.get_versions()[0]
+    number = manifest['next_segment'] if manifest else 1
+    segments = []
+    if db.session.query(Document.id).first() is not None:
+        size = write_segment(db, os.path.join(directory, segment_name(number)), index_version)
+        segments.append({'name': segment_name(number), 'deleted': []})
+        print(f"Индекс выгружен из БД в сегмент {segment_name(number)} ({size / 1024:.0f} КБ)")
+    manifest = {
+        'generation': (manifest['generation'] if manifest else 0) + 1,
+        'index_version': index_version,
+        'format': FORMAT_VERSION,
+        'next_segment': number + 1,
+        'segments': segments,
+    }
+    write_manifest(directory, manifest)
+    return manifest
+
+
+class LiveDocLengths(Mapping):
+    """Длины живых документов по всем сегментам (удаленные в сегменте документы пропускаются)"""
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def __getitem__(self, doc_id):
+        for segment, deleted in reversed(self.parts):
+            length = segment.doc_length(doc_id)
+            if length is not None and doc_id not in deleted:
+                return length
+        raise KeyError(doc_id)
+
+    def __iter__(self):
+        for segment, deleted in self.parts:
+            for doc_id in segment.doc_ids():
+                if doc_id not in deleted:
+                    yield doc_id
+
+    def __len__(self):
+        return sum(segment.doc_count - len(deleted) for segment, deleted in self.parts)
+
+
+class MergedCursor:
+    """
+    Курсор по списку терма в нескольких сегментах: текущий документ - минимальный
+    среди курсоров сегментов, удаленные документы пропускаются. Интерфейс как у PostingCursor
+    """
+
+    END = float('inf')
+
+    __slots__ = ('cursors', 'term', 'idf', 'upper_bound', 'current', 'doc')
+
+    def __init__(self, cursors, term=None, idf=0.0, upper_bound=0.0):
+        # cursors - [(курсор сегмента, удаленные документы сегмента)]
+        self.cursors = cursors
+        self.term = term
+        self.idf = idf
+        self.upper_bound = upper_bound
+        self._settle()
+
+    def _settle(self):
+        """Выбор курсора с минимальным живым документом"""
+        while True:
+            cursor, deleted = min(self.cursors, key=lambda item: item[0].doc)
+            doc = cursor.doc
+            if doc != self.END and doc in deleted:
+                cursor.next()
+                continue
+            self.current = cursor
+            self.doc = doc
+            return
+
+    def tf(self):
+        return self.current.tf()
+
+    def positions(self):
+        return self.current.positions()
+
+    def next(self):
+        self.current.next()
+        self._settle()
+
+    def next_geq(self, target):
+        """Переход к первому живому документу с id >= target"""
+        if self.doc >= target:
+            return
+        for cursor, _ in self.cursors:
+            cursor.next_geq(target)
+        self._settle()
+
+
+class MergedPostingList:
+    """Живые вхождения терма из всех сегментов (doc_ids и tfs) - для term-at-a-time"""
+
+    __slots__ = ('doc_ids', 'tfs')
+
+    def __init__(self, parts):
+        self.doc_ids = array('i')
+        self.tfs = array('i')
+        for segment, deleted, info in parts:
+            doc_ids, tfs, _ = segment.postings(info)
+            for doc_id, tf in zip(doc_ids, tfs):
+                if doc_id not in deleted:
+                    self.doc_ids.append(doc_id)
+                    self.tfs.append(tf)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+
+class SegmentedIndex(SegmentIndex):
+    """
+    Индекс из нескольких неизменяемых сегментов (LSM): набор живых сегментов
+    и удаленные в каждом документы берутся из манифеста. Документ живет ровно в одном
+    сегменте - при переиндексации старая копия помечается удаленной, поэтому списки
+    сегментов сливаются без приоритетов. df, как и в Lucene, учитывает удаленные
+    документы до слияния их сегмента
+    """
+
+    def __init__(self, parts, generation=0):
+        InvertedIndex.__init__(self)
+        self.parts = parts
+        self.generation = generation
+        self.doc_lengths = LiveDocLengths(parts)
+        total_length = 0
+        for segment, deleted in parts:
+            total_length += segment.total_length - sum(segment.doc_length(d) for d in deleted)
+        self.set_corpus_stats(len(self.doc_lengths), total_length)
+
+    @classmethod
+    def open(cls, directory, db, previous=None):
+        """
+        Открытие сегментов по текущему манифесту. Уже отображенные сегменты
+        предыдущего индекса (previous) используются повторно.
+        None, если сегментов нет или они в другом формате: читатель их не пишет -
+        их создает или перестраивает только SegmentWriter
+        """
+        opened = {}
+        if isinstance(previous, SegmentedIndex):
+            opened = {os.path.basename(segment.path): segment for segment, _ in previous.parts}
+
+        for attempt in range(3):
+            manifest = read_manifest(directory)
+            if manifest is None or manifest.get('format') != FORMAT_VERSION:
+                return None
+            try:
+                parts = []
+                for entry in manifest['segments']:
+                    segment = opened.get(entry['name']) or Segment(os.path.join(directory, entry['name']))
+                    parts.append((segment, frozenset(entry['deleted'])))
+                break
+            except FileNotFoundError:
+                # Сегмент слит и удален между чтением манифеста и открытием - читаем новый манифест
+                if attempt == 2:
+                    raise
+
+        # Пакет уже в БД, но еще не в сегментах (писатель между коммитом и сбросом, сбой
+        # или запись в обход SegmentWriter). Перестраивать здесь нельзя - писатель может быть жив
+        db_version = db.get_versions()[0]
+        if manifest['index_version'] != db_version:
+            print(f"Внимание: сегменты {directory} отстают от БД (версия индекса {manifest['index_version']}, "
+                  f"в БД {db_version}) - поиск идет по последнему записанному набору до следующей индексации")
+
+        index = cls(parts, manifest['generation'])
+        index._load_pageranks(db)
+        index._compute_upper_bounds()
+        return index
+
+    def _lookup(self, term):
+        """[(сегмент, удаленные, запись словаря)] сегментов, где есть терм"""
+        found = []
+        for segment, deleted in self.parts:
+            info = segment.lookup(term)
+            if info is not None:
+                found.append((segment, deleted, info))
+        return found
+
+    def cursor(self, term):
+        found = self._lookup(term)
+        if not found:
+            return None
+        idf = self._idf(term, sum(info.df for _, _, info in found))
+        cursors = [(SegmentCursor(info, term, idf, self.term_upper_bound(info, idf)), deleted)
+                   for _, deleted, info in found]
+        if len(cursors) == 1 and not cursors[0][1]:
+            return cursors[0][0]
+        return MergedCursor(cursors, term, idf, max(cursor.upper_bound for cursor, _ in cursors))
+
+    def get_postings(self, term):
+        found = self._lookup(term)
+        return MergedPostingList(found) if found else None
+
+    def idf(self, term):
+        found = self._lookup(term)
+        return self._idf(term, sum(info.df for _, _, info in found)) if found else 0.0
+
+
+class SegmentWriter:
+    """
+    Запись индекса сегментами (LSM) для одного процесса-писателя.
+    Каждый пакет документов сбрасывается в новый маленький сегмент, старые копии
+    документов пакета и удаленные документы помечаются в манифесте. Фоновый поток
+    сливает сегменты по ступеням: merge_factor сегментов одного порядка размера
+    (log по основанию merge_factor от числа живых документов) - в один, сегменты с долей
+    удаленных >= max_deleted переписываются без них. Читатели только открывают
+    опубликованный манифест и поэтому не ждут ни записи, ни слияний
+    """
+
+    def __init__(self, directory, merge_factor=config.SEGMENT_MERGE_FACTOR,
+                 max_deleted=config.SEGMENT_MAX_DELETED, retry_delay=config.SEGMENT_MERGE_RETRY,
+                 max_retry_delay=config.SEGMENT_MERGE_RETRY_MAX):
+        self.directory = directory
+        self.merge_factor = merge_factor
+        self.max_deleted = max_deleted
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.manifest = None
+        self.segments = {}
+        self.merging = set()
+        self.closing = False
+        self.thread = None
+        self.lock_file = None
+        self.lock = threading.Lock()
+        self.merge_wanted = threading.Condition(self.lock)
+
+    def open(self, db):
+        """
+        Блокировка директории, загрузка манифеста (перестройка из БД, если индекс отстал от нее)
+        и запуск слияний. RuntimeError, если директорию уже держит другой писатель
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock_file = lock_writer(self.directory)
+        manifest = read_manifest(self.directory)
+        if (manifest is None or manifest['index_version'] != db.get_versions()[0]
+                or manifest.get('format') != FORMAT_VERSION):
+            manifest = build_segments(db, self.directory, manifest)
+        self.manifest = manifest
+        for entry in manifest['segments']:
+            self.segments[entry['name']] = Segment(os.path.join(self.directory, entry['name']))
+        self._remove_orphans()
+
+        self.closing = False
+        self.thread = threading.Thread(target=self._merge_loop, daemon=True)
+        self.thread.start()
+        with self.lock:
+            self.merge_wanted.notify()
+
+    def _remove_orphans(self):
+        """Файлы сегментов, которых нет в манифесте (после слияний и сбоев)"""
+        for filename in os.listdir(self.directory):
+            if filename not in (MANIFEST, WRITER_LOCK) and filename not in self.segments:
+                self._remove(filename)
+
+    def _remove(self, filename):
+        try:
+            os.remove(os.path.join(self.directory, filename))
+        except OSError:
+            # Файл еще отображен читателем (Windows) - удалится при следующем открытии
+            pass
+
+    def _next_name(self):
+        """Имя нового сегмента (вызывается под блокировкой)"""
+        number = self.manifest['next_segment']
+        self.manifest['next_segment'] = number + 1
+        return segment_name(number)
+
+    def _publish(self):
+        """Новое поколение манифеста (вызывается под блокировкой)"""
+        self.manifest['generation'] += 1
+        write_manifest(self.directory, self.manifest)
+
+    def flush(self, documents, deleted_ids, index_version):
+        """
+        Сброс пакета в новый сегмент.
+        documents - [(doc_id, длина, {слово: позиции})] новых и измененных документов,
+        deleted_ids - id удаленных документов, index_version - версия индекса в БД после пакета
+        """
+        with self.lock:
+            name = self._next_name() if documents else None
+
+        segment = None
+        if documents:
+            postings = {}
+            lengths = {}
+            for doc_id, length, positions in documents:
+                lengths[doc_id] = length
+                for word, word_positions in positions.items():
+                    postings.setdefault(word, []).append((doc_id, word_positions))
+
+            def term_postings():
+                for word, doc_postings in postings.items():
+                    doc_postings.sort()
+                    yield (word, [doc_id for doc_id, _ in doc_postings],
+                           [len(p) for _, p in doc_postings], [p for _, p in doc_postings])
+
+            write_postings(os.path.join(self.directory, name), term_postings(), lengths, index_version)
+            segment = Segment(os.path.join(self.directory, name))
+
+        replaced = set(deleted_ids)
+        replaced.update(doc_id for doc_id, _, _ in documents)
+        with self.lock:
+            self._mark_deleted(replaced)
+            if segment is not None:
+                self.segments[name] = segment
+                self.manifest['segments'].append({'name': name, 'deleted': []})
+            self.manifest['index_version'] = index_version
+            self._publish()
+            self.merge_wanted.notify()
+
+    def _mark_deleted(self, doc_ids):
+        """Пометка документов удаленными в сегментах, где они живы (вызывается под блокировкой)"""
+        for entry in self.manifest['segments']:
+            segment = self.segments[entry['name']]
+            deleted = set(entry['deleted'])
+            for doc_id in doc_ids:
+                if doc_id not in deleted and segment.doc_length(doc_id) is not None:
+                    entry['deleted'].append(doc_id)
+
+    def _pick_merge(self):
+        """Сегменты для следующего слияния по ступенчатой политике или None (под блокировкой)"""
+        tiers = {}
+        for entry in self.manifest['segments']:
+            if entry['name'] in self.merging:
+                continue
+            segment = self.segments[entry['name']]
+            if len(entry['deleted']) >= self.max_deleted * segment.doc_count:
+                return [entry]
+            live = segment.doc_count - len(entry['deleted'])
+            tiers.setdefault(int(math.log(max(live, 1), self.merge_factor)), []).append(entry)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier][:self.merge_factor]
+        return None
+
+    def _merge_loop(self):
+        delay = 0
+        while True:
+            with self.lock:
+                entries = self._pick_merge()
+                while entries is None and not self.closing:
+                    self.merge_wanted.wait()
+                    entries = self._pick_merge()
+                if entries is None:
+                    return
+                names = [entry['name'] for entry in entries]
+                snapshot = [(self.segments[entry['name']], set(entry['deleted'])) for entry in entries]
+                name = self._next_name()
+                index_version = self.manifest['index_version']
+                self.merging.update(names)
+            try:
+                self._merge(names, snapshot, name, index_version)
+                delay = 0
+            except Exception as e:
+                # Поток не останавливается: сегменты снова доступны для слияния, повтор с растущей паузой
+                delay = min(delay * 2 or self.retry_delay, self.max_retry_delay)
+                print(f"Ошибка слияния сегментов {', '.join(names)}: {e} - повтор через {delay:g} с")
+                self._remove(name)
+                with self.lock:
+                    self.merging.difference_update(names)
+                    if not self._wait_retry(delay):
+                        print("Писатель закрывается после ошибки слияния - сегменты останутся неслитыми")
+                        return
+
+    def _wait_retry(self, delay):
+        """Пауза перед повтором слияния (под блокировкой); False - писатель закрывается"""
+        deadline = time.monotonic() + delay
+        while not self.closing:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            self.merge_wanted.wait(remaining)
+        return False
+
+    def _merge(self, names, snapshot, name, index_version):
+        """Слияние сегментов без удаленных документов и подмена их в манифесте"""
+        lengths = {}
+        for segment, deleted in snapshot:
+            for doc_id in segment.doc_ids():
+                if doc_id not in deleted:
+                    lengths[doc_id] = segment.doc_length(doc_id)
+
+        def term_postings():
+            # Словари сегментов отсортированы - термы сливаются одним проходом
+            streams = [zip(segment.terms(), repeat(i)) for i, (segment, _) in enumerate(snapshot)]
+            for word, group in groupby(heapq.merge(*streams), key=lambda item: item[0]):
+                postings = []
+                for _, i in group:
+                    segment, deleted = snapshot[i]
+                    doc_ids, tfs, positions = segment.postings(segment.lookup(word))
+                    postings.extend(p for p in zip(doc_ids, tfs, positions) if p[0] not in deleted)
+                if postings:
+                    postings.sort()
+                    yield (word, [p[0] for p in postings], [p[1] for p in postings],
+                           [p[2] for p in postings])
+
+        segment = None
+        if lengths:
+            write_postings(os.path.join(self.directory, name), term_postings(), lengths, index_version)
+            segment = Segment(os.path.join(self.directory, name))
+
+        with self.lock:
+            snapshot_deleted = dict(zip(names, (deleted for _, deleted in snapshot)))
+            remaining = [entry for entry in self.manifest['segments'] if entry['name'] not in names]
+            if segment is not None:
+                # Документы, удаленные во время слияния, остаются удаленными в новом сегменте
+                deleted_during = set()
+                for entry in self.manifest['segments']:
+                    if entry['name'] in snapshot_deleted:
+                        deleted_during.update(set(entry['deleted']) - snapshot_deleted[entry['name']])
+                self.segments[name] = segment
+                remaining.append({'name': name, 'deleted': sorted(deleted_during)})
+            self.manifest['segments'] = remaining
+            self._publish()
+            for old_name in names:
+                self.segments.pop(old_name).close()
+                self._remove(old_name)
+            self.merging.difference_update(names)
+        print(f"Слияние сегментов: {len(names)} -> {name if segment else 'ничего'} "
+              f"({len(lengths)} документов)")
+
+    def close(self):
+        """Завершение незаконченных слияний и остановка потока"""
+        if self.thread is not None:
+            with self.lock:
+                self.closing = True
+                self.merge_wanted.notify()
+            self.thread.join()
+            self.thread = None
+        for segment in self.segments.values():
+            segment.close()
+        self.segments = {}
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
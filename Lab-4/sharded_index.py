@@ -0,0 +1,238 @@
+import heapq
+import itertools
+import multiprocessing as mp
+import threading
+from database import Database
+from inverted_index import InvertedIndex
+from pagerank_topics import TopicBlend
+from wand import wand_top_k
+from boolean_query import boolean_top_k
+from hybrid import hybrid_candidates
+import config
+
+
+def _merge_stats(stats):
+    """Сумма статистик шардов: (число документов, суммарная длина, {терм: df})"""
+    doc_count = 0
+    total_length = 0
+    document_frequencies = {}
+    for count, length, frequencies in stats:
+        doc_count += count
+        total_length += length
+        for term, df in frequencies.items():
+            document_frequencies[term] = document_frequencies.get(term, 0) + df
+    return doc_count, total_length, document_frequencies
+
+
+def _shard_search(index, query, k, mode, options=None):
+    """
+    Top-k шарда [(score, doc_id, pagerank)] с глобальными IDF и avgdl.
+    query - список термов или BooleanQuery для mode='boolean' и 'hybrid'.
+    mode='hybrid' - кандидаты hybrid_candidates с сигналами, options - (веса, слияние)
+    """
+    query_terms = query if isinstance(query, list) else query.terms()
+    pageranks = TopicBlend.for_query(index.pageranks, index.topic_vectors, query_terms, index.max_pagerank)
+    if mode == 'hybrid':
+        return hybrid_candidates(index, query, k, pageranks, *options)
+    if mode == 'boolean':
+        scores = boolean_top_k(index, query, k, pageranks)
+    elif mode == 'daat':
+        scores = wand_top_k(index, query_terms, k, pageranks)
+    else:
+        scores = index.taat_scores(query_terms, pageranks)
+    top = heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+    return [(score, doc_id, (pageranks or index.pageranks).get(doc_id, 0.0)) for doc_id, score in top]
+
+
+def _shard_worker(conn, db_path, shard, num_shards):
+    """
+    Процесс шарда: держит свой индекс в памяти и выполняет команды координатора по очереди.
+    Ответ помечается номером запроса - координатор отдает его ждущему потоку.
+    Новый индекс строится в фоновом потоке, а поиск до global_stats идет по текущему
+    """
+    db = Database(db_path, read_only=True)
+    state = {'index': None, 'next': None}
+    send_lock = threading.Lock()
+
+    def reply(request_id, result):
+        with send_lock:
+            conn.send((request_id, result))
+
+    def build(request_id):
+        try:
+            state['next'] = InvertedIndex.build(db, (shard, num_shards))
+            reply(request_id, state['next'].local_stats())
+        except Exception as e:
+            reply(request_id, e)
+        finally:
+            db.release()
+
+    builder = None
+    while True:
+        request_id, command, args = conn.recv()
+        if command == 'build':
+            builder = threading.Thread(target=build, args=(request_id,), daemon=True)
+            builder.start()
+        elif command == 'global_stats':
+            # Подмена индекса: статистика уже глобальная для нового
+            state['next'].set_global_stats(*args)
+            state['index'], state['next'] = state['next'], None
+            reply(request_id, True)
+        elif command == 'pageranks':
+            state['index'].reload_pageranks(db)
+            reply(request_id, True)
+        elif command == 'search':
+            reply(request_id, _shard_search(state['index'], *args))
+        elif command == 'stop':
+            break
+        db.release()
+    if builder is not None:
+        builder.join()
+    db.close()
+    conn.close()
+
+
+class _Reply:
+    """Ответы шардов на один запрос: заполняются потоками-читателями каналов"""
+
+    def __init__(self, num_shards):
+        self.results = [None] * num_shards
+        self.remaining = num_shards
+        self.error = None
+        self.done = threading.Event()
+
+
+class ShardedIndex:
+    """
+    Индекс, разбитый по документам на num_shards шардов (doc_id % num_shards).
+    Каждый шард - отдельный процесс со своим InvertedIndex и локальной статистикой;
+    координатор суммирует df, число документов и длины в глобальную статистику
+    и рассылает ее обратно, поэтому оценки шардов совпадают с единым индексом.
+    Запрос рассылается всем шардам сразу, их top-k сливаются.
+    Запросы разных потоков не ждут друг друга целиком: у каждого свой номер, шард
+    обрабатывает их очередью, а ответы по номеру раздает поток-читатель его канала
+    """
+
+    def __init__(self, db_path, num_shards=config.SEARCH_SHARDS):
+        self.db_path = db_path
+        self.num_shards = num_shards
+        self.connections = []
+        self.processes = []
+        self.doc_count = 0
+        self.avg_doc_length = 1
+        self.readers = []
+        # Блокировка на отправку в канал шарда; ожидающие ответа запросы - по номерам
+        self.send_locks = []
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.failure = None
+
+    def _start(self):
+        for shard in range(self.num_shards):
+            parent_conn, child_conn = mp.Pipe()
+            process = mp.Process(target=_shard_worker, daemon=True,
+                                 args=(child_conn, self.db_path, shard, self.num_shards))
+            process.start()
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+            self.send_locks.append(threading.Lock())
+        self.failure = None
+        for shard, conn in enumerate(self.connections):
+            reader = threading.Thread(target=self._read_replies, args=(shard, conn), daemon=True)
+            reader.start()
+            self.readers.append(reader)
+
+    def _read_replies(self, shard, conn):
+        """Поток-читатель канала шарда: ответ кладется в запрос с его номером"""
+        while True:
+            try:
+                request_id, result = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.pending_lock:
+                # Ответ на запрос, которого уже нет (устаревший), отбрасывается
+                reply = self.pending.get(request_id)
+                if reply is None:
+                    continue
+                if isinstance(result, Exception):
+                    reply.error = result
+                reply.results[shard] = result
+                reply.remaining -= 1
+                if reply.remaining == 0:
+                    del self.pending[request_id]
+                    reply.done.set()
+
+        # Шард завершился: ждущие запросы и все следующие получают ошибку
+        with self.pending_lock:
+            self.failure = EOFError(f"Процесс шарда {shard} завершился")
+            for reply in self.pending.values():
+                reply.error = self.failure
+                reply.done.set()
+            self.pending.clear()
+
+    def _scatter(self, command, args=None):
+        """Команда всем шардам, затем сбор ответов (шарды работают параллельно)"""
+        reply = _Reply(len(self.connections))
+        with self.pending_lock:
+            if self.failure is not None:
+                raise self.failure
+            request_id = next(self.request_ids)
+            self.pending[request_id] = reply
+        for conn, lock in zip(self.connections, self.send_locks):
+            with lock:
+                conn.send((request_id, command, args))
+        reply.done.wait()
+        if reply.error is not None:
+            raise reply.error
+        return reply.results
+
+    def build(self):
+        """
+        Построение индексов шардов и рассылка глобальной статистики.
+        Шарды строят новый индекс в фоне и до его подмены отвечают на поиск по старому
+        """
+        if not self.processes:
+            self._start()
+        doc_count, total_length, document_frequencies = _merge_stats(self._scatter('build'))
+        self._scatter('global_stats', (doc_count, total_length, document_frequencies))
+
+        self.doc_count = doc_count
+        self.avg_doc_length = total_length / doc_count if doc_count > 0 and total_length > 0 else 1
+        print(f"Шардированный индекс: {self.num_shards} шардов, {doc_count} документов")
+
+    def reload_pageranks(self):
+        self._scatter('pageranks')
+
+    def top_k(self, query_terms, k, mode='daat'):
+        """
+        Слияние top-k шардов: ({doc_id: score}, {doc_id: PageRank запроса}).
+        mode - 'daat' (WAND в каждом шарде), 'taat' или 'boolean' (query_terms - BooleanQuery)
+        """
+        results = self._scatter('search', (query_terms, k, mode))
+        top = heapq.nlargest(k, (item for shard_top in results for item in shard_top))
+        return ({doc_id: score for score, doc_id, _ in top},
+                {doc_id: pagerank for _, doc_id, pagerank in top})
+
+    def hybrid_candidates(self, query, k, weights, fusion):
+        """
+        Кандидаты гибридного поиска всех шардов [(оценка отбора, doc_id, сигналы)]: шарды считают
+        сигналы с глобальной статистикой, слияние (fuse_candidates) - у координатора
+        """
+        results = self._scatter('search', (query, k, 'hybrid', (weights, fusion)))
+        return [candidate for shard_candidates in results for candidate in shard_candidates]
+
+    def close(self):
+        for conn, lock in zip(self.connections, self.send_locks):
+            with lock:
+                conn.send((None, 'stop', None))
+        # Читатель выходит, когда шард закрывает свой конец канала
+        for process, reader, conn in zip(self.processes, self.readers, self.connections):
+            process.join()
+            reader.join()
+            conn.close()
+        self.connections = []
+        self.processes = []
+        self.readers = []
+        self.send_locks = []
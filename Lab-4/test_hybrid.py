@@ -0,0 +1,118 @@
+"""Гибридный поиск: слияние сигналов, отсечение и шарды (запуск: python -m pytest Lab-4)"""
+import os
+import random
+import pytest
+from database import Database
+from hybrid import HybridScorer, hybrid_top_k
+from pagerank_sparse import SparsePageRank
+from parser import Parser
+from search_engine import SearchEngine
+
+PAGE = '<html><head><title>{title}</title></head><body><p>{text}</p>{links}</body></html>'
+WORDS = ['ракета', 'облако', 'море', 'город', 'дорога', 'песок', 'ветер', 'звезда']
+
+
+def write_page(directory, filename, text, hrefs=()):
+    links = ''.join(f'<a href="{href}">ссылка</a>' for href in hrefs)
+    with open(os.path.join(directory, filename), 'w', encoding='utf-8') as f:
+        f.write(PAGE.format(title=filename, text=text, links=links))
+
+
+@pytest.fixture(scope='module')
+def db_path(tmp_path_factory):
+    """Короткая страница о ракете, длинная популярная с одним упоминанием и случайные страницы"""
+    directory = tmp_path_factory.mktemp('hybrid')
+    pages = directory / 'pages'
+    pages.mkdir()
+    write_page(pages, 'strong.html', 'море ракета ракета ракета старт')
+    write_page(pages, 'popular.html', ' '.join(['город дорога песок'] * 30 + ['ракета'] + ['город'] * 30))
+    rng = random.Random(0)
+    for i in range(60):
+        text = ' '.join(rng.choice(WORDS[1:]) for _ in range(rng.randint(5, 40)))
+        if i % 3 == 0:
+            text += ' ракета' * rng.randint(1, 3)
+        write_page(pages, f'page{i}.html', text, ['popular.html'] + [f'page{rng.randrange(60)}.html'])
+
+    path = str(directory / 'test.db')
+    db = Database(path)
+    parser = Parser(db)
+    parser.parse_directory(str(pages), workers=1)
+    parser.flush_links()
+    parser.close_segments()
+    db.close()
+    SparsePageRank(path).calculate_pagerank()
+    return path
+
+
+@pytest.fixture(scope='module')
+def engine(db_path):
+    db = Database(db_path)
+    engine = SearchEngine(db, shards=1, use_segment=False)
+    yield engine
+    engine.close()
+    db.close()
+
+
+def urls(results):
+    return [result['url'] for result in results]
+
+
+def test_strong_bm25_match_beats_weak_match_with_high_pagerank(engine):
+    results = engine.hybrid_search('ракета', k=3)
+    assert urls(results)[0] == 'strong.html'
+    assert results[0]['pagerank'] < max(r['pagerank'] for r in engine.hybrid_search('ракета', k=20))
+    # Вес BM25 действительно меняет ранжирование: без него первым идет самый популярный документ
+    assert urls(engine.hybrid_search('ракета', k=1, bm25_weight=0.0)) == ['popular.html']
+
+
+def exhaustive_top_k(index, query_terms, k, weights):
+    """Слитые оценки всех документов, где есть термы запроса, без отсечения"""
+    scorer = HybridScorer(index, query_terms, None, weights)
+    scores = {}
+    for doc_id in index.doc_lengths:
+        cursors = []
+        for term in query_terms:
+            cursor = index.cursor(term)
+            if cursor is not None:
+                cursor.next_geq(doc_id)
+                if cursor.doc == doc_id:
+                    cursors.append(cursor)
+        if cursors:
+            scores[doc_id] = scorer.fuse(scorer.signals(doc_id, cursors))
+    return sorted(scores.items(), key=lambda item: (item[1], item[0]), reverse=True)[:k]
+
+
+@pytest.mark.parametrize('weights', [(0.7, 0.3, 0.0), (0.2, 0.8, 0.0), (0.6, 0.2, 0.2)])
+def test_pruning_matches_exhaustive_ranking(engine, weights):
+    engine.hybrid_search('ракета', k=1)
+    index = engine.index
+    for words in (['ракета'], ['облако', 'звезда'], ['ракета', 'море', 'ветер']):
+        query_terms = [term for word in words for term in engine._tokenize_query(word)]
+        scores = sorted(hybrid_top_k(index, query_terms, 5, None, weights).items(),
+                        key=lambda item: (item[1], item[0]), reverse=True)
+        expected = exhaustive_top_k(index, query_terms, 5, weights)
+        assert [doc_id for doc_id, _ in scores] == [doc_id for doc_id, _ in expected]
+        assert [score for _, score in scores] == pytest.approx([score for _, score in expected])
+
+
+def test_boolean_queries_are_fused(engine):
+    results = engine.hybrid_search('+ракета -старт', k=5)
+    assert results and 'strong.html' not in urls(results)
+    # Оценка слитая (от 0 до суммы весов), а не BM25 x PageRank
+    assert all(0 < result['score'] <= 1 for result in results)
+    assert urls(engine.hybrid_search('ракета -старт', k=5)) == urls(results)
+
+
+def test_sharded_hybrid_matches_single_index(db_path, engine):
+    db = Database(db_path)
+    sharded = SearchEngine(db, shards=2, use_segment=False)
+    try:
+        for query in ('ракета', 'облако звезда', '+ракета -старт'):
+            for bm25_weight in (0.7, 0.2):
+                expected = [(r['url'], pytest.approx(r['score'])) for r in
+                            engine.hybrid_search(query, k=5, bm25_weight=bm25_weight)]
+                assert [(r['url'], r['score']) for r in
+                        sharded.hybrid_search(query, k=5, bm25_weight=bm25_weight)] == expected
+    finally:
+        sharded.close()
+        db.close()
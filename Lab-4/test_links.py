@@ -0,0 +1,54 @@
+"""Разрешение ссылок между сохраненными страницами (запуск: python -m pytest Lab-4)"""
+import os
+from database import Database, Document
+from parser import Parser
+
+PAGE = '<html><head>{head}<title>{title}</title></head><body><p>текст</p>{links}</body></html>'
+
+
+def write_page(directory, filename, title, head='', hrefs=()):
+    links = ''.join(f'<a href="{href}">ссылка</a>' for href in hrefs)
+    with open(os.path.join(directory, filename), 'w', encoding='utf-8') as f:
+        f.write(PAGE.format(head=head, title=title, links=links))
+
+
+def source_meta(url):
+    return f'<meta name="source-url" content="{url}">'
+
+
+def parse_links(directory):
+    db = Database(str(directory / 'test.db'))
+    parser = Parser(db)
+    parser.parse_directory(str(directory / 'pages'), workers=1)
+    parser.flush_links()
+    parser.close_segments()
+    names = dict(db.session.query(Document.id, Document.url))
+    links = {(names[link.source_id], names[link.target_id]) for link in db.get_all_links()}
+    db.close()
+    return links
+
+
+def test_absolute_links_resolve_to_source_urls(tmp_path):
+    pages = tmp_path / 'pages'
+    pages.mkdir()
+    write_page(pages, 'a.html', 'A', source_meta('https://wiki.example/wiki/A'),
+               ['https://wiki.example/wiki/B', 'https://other.example/page'])
+    write_page(pages, 'b.html', 'B', source_meta('https://wiki.example/wiki/B'),
+               ['C#section', 'https://wiki.example/wiki/B'])
+    write_page(pages, 'c.html', 'C', '<meta property="og:url" content="https://wiki.example/wiki/C">',
+               ['HTTPS://WIKI.EXAMPLE:443/wiki/A'])
+
+    assert parse_links(tmp_path) == {('a.html', 'b.html'), ('b.html', 'c.html'), ('c.html', 'a.html')}
+
+
+def test_local_names_and_deferred_absolute_links(tmp_path):
+    pages = tmp_path / 'pages'
+    pages.mkdir()
+    # Ссылка загрузчика на соседний файл и абсолютная ссылка на страницу, которой еще нет
+    write_page(pages, 'a.html', 'A', source_meta('https://site.example/a/'),
+               ['b.html', 'https://site.example/later'])
+    write_page(pages, 'b.html', 'B')
+    assert parse_links(tmp_path) == {('a.html', 'b.html')}
+
+    write_page(pages, 'later.html', 'Later', source_meta('https://site.example/later'))
+    assert parse_links(tmp_path) == {('a.html', 'b.html'), ('a.html', 'later.html')}
@@ -0,0 +1,63 @@
+"""Методы PageRank: экстраполяция сокращает число итераций (запуск: python -m pytest Lab-4)"""
+import random
+import sqlite3
+import pytest
+from database import Database
+from pagerank_mr import MapReducePageRank
+from pagerank_sparse import SparsePageRank
+
+
+def make_graph(path, num_docs, edges):
+    Database(path).close()
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO documents (id, url) VALUES (?, ?)",
+                     [(i, f'{i}.html') for i in range(1, num_docs + 1)])
+    conn.executemany("INSERT INTO links (source_id, target_id) VALUES (?, ?)", edges)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def two_components(tmp_path):
+    """Клика и звезда без связи между ними: ошибка затухает по одному направлению с множителем d"""
+    clique = [(i, j) for i in range(1, 6) for j in range(1, 6) if i != j]
+    star = [(i, 6) for i in range(7, 30)] + [(6, 7)]
+    return make_graph(str(tmp_path / 'two.db'), 29, clique + star)
+
+
+def random_graph(tmp_path):
+    rng = random.Random(0)
+    edges = {(rng.randint(1, 300), rng.randint(1, 300)) for _ in range(1500)}
+    return make_graph(str(tmp_path / 'random.db'), 300, sorted(edges))
+
+
+def iterations(engine, solver):
+    result = engine.calculate_pagerank(solver=solver)
+    assert engine.trace.converged
+    return len(engine.trace.iterations), result
+
+
+def test_extrapolation_drops_iterations(tmp_path):
+    path = two_components(tmp_path)
+    power, expected = iterations(SparsePageRank(path), 'power')
+    for solver in ('aitken', 'quadratic'):
+        count, result = iterations(SparsePageRank(path), solver)
+        assert count < power / 2
+        assert max(abs(result[d] - expected[d]) for d in expected) < 1e-5
+
+        mr_count, mr_result = iterations(MapReducePageRank(path), solver)
+        assert mr_count < power / 2
+        assert max(abs(mr_result[d] - expected[d]) for d in expected) < 1e-5
+
+
+def test_extrapolation_never_adds_iterations(tmp_path):
+    path = random_graph(tmp_path)
+    power, _ = iterations(SparsePageRank(path), 'power')
+    for solver in ('aitken', 'quadratic'):
+        assert iterations(SparsePageRank(path), solver)[0] <= power
+
+
+def test_mapreduce_rejects_gauss_seidel(tmp_path):
+    path = two_components(tmp_path)
+    with pytest.raises(ValueError):
+        MapReducePageRank(path).calculate_pagerank(solver='gauss_seidel')
@@ -0,0 +1,67 @@
+import heapq
+
+
+def wand_top_k(index, query_terms, k=5, pageranks=None, skip=None):
+    """
+    Top-k поиск с динамическим отсечением WAND.
+    Документ полностью оценивается, только если сумма верхних оценок его термов,
+    умноженная на максимальный множитель PageRank, может превысить порог top-k.
+    pageranks - PageRank конкретного запроса (None - глобальный),
+    skip - функция doc_id -> True для исключенных документов (вызывается по возрастанию id).
+    Возвращает словарь {doc_id: score} не более чем из k документов.
+    """
+    cursors = []
+    for term in dict.fromkeys(query_terms):
+        cursor = index.cursor(term)
+        if cursor:
+            cursors.append(cursor)
+
+    top = []  # min-куча (score, doc_id)
+    threshold = 0.0
+    max_boost = index.max_boost_for(pageranks)
+
+    while cursors:
+        cursors.sort(key=lambda c: c.doc)
+
+        # Ищем pivot: первый курсор, на котором накопленная верхняя оценка превышает порог
+        bound = 0.0
+        pivot = None
+        for i, cursor in enumerate(cursors):
+            if cursor.doc == cursor.END:
+                break
+            bound += cursor.upper_bound
+            if bound * max_boost > threshold:
+                pivot = i
+                break
+
+        if pivot is None:
+            break
+
+        pivot_doc = cursors[pivot].doc
+
+        if cursors[0].doc == pivot_doc:
+            # Все курсоры до pivot стоят на этом документе
+            aligned = [c for c in cursors if c.doc == pivot_doc]
+            boost = index.pagerank_boost(pivot_doc, pageranks)
+
+            # Уточняем оценку реальным PageRank документа перед полным подсчетом
+            if sum(c.upper_bound for c in aligned) * boost > threshold and \
+                    (skip is None or not skip(pivot_doc)):
+                score = sum(index.bm25(c.tf(), pivot_doc, c.idf) for c in aligned) * boost
+                if len(top) < k:
+                    heapq.heappush(top, (score, pivot_doc))
+                elif score > top[0][0]:
+                    heapq.heapreplace(top, (score, pivot_doc))
+                if len(top) == k:
+                    threshold = top[0][0]
+
+            for cursor in aligned:
+                cursor.next()
+        else:
+            # Документы до pivot не могут попасть в top-k - перепрыгиваем их
+            for cursor in cursors[:pivot]:
+                cursor.next_geq(pivot_doc)
+
+        cursors = [c for c in cursors if c.doc != c.END]
+
+    return {doc_id: score for score, doc_id in top}